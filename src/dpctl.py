@@ -1,15 +1,44 @@
 from datetime import datetime
 import array
+import collections
+import flow_rates
+import flow_store
+import flow_source
+import itertools
 import os
+import re
 import sys
-import subprocess as sub
+import time
+import traffic_matrix
+
+# Cheap substring test used to reject ARP, IPv6 and other non-IPv4 datapath
+# flows before the full regular expression is run against them.
+IPV4_ETH_TYPE = 'eth_type(0x0800)'
+
+# Fields of an IPv4 datapath flow, matched by name rather than by position so
+# that extra keys (recirc_id, skb_mark, ct_state, ...), L4 keys that differ per
+# protocol and masked megaflow values ('src=10.0.0.1/255.255.255.0') do not
+# upset the parse. Each expression starts with a literal and is searched from
+# where the previous one stopped, so a line is scanned once.
+DP_ETH_RE = re.compile(r'eth\(src=([0-9a-fA-F:]+)(?:/[0-9a-fA-F:]+)?,dst=([0-9a-fA-F:]+)')
+DP_IPV4_RE = re.compile(r'ipv4\(src=([0-9.]+)(?:/[0-9.]+)?,dst=([0-9.]+)')
+DP_STATS_RE = re.compile(r'packets:(\d+), bytes:(\d+), used:(never|[0-9.]+)')
+
+# Literals delimiting the statistics of a dump-flows line, for
+# DpCtl.changed_entries.
+DP_STATS_PREFIX = ', packets:'
+DP_BYTES_PREFIX = ' bytes:'
+
+# Prefix of the datapath flow ID, present when dumps are taken with ufids.
+UFID_PREFIX = 'ufid:'
 
 class FlowEntry(object):
 	"""
 	Class representing a single piece of flow data.
 	"""
+	__slots__ = ('srcMac', 'dstMac', 'srcIp', 'dstIp', 'bytes', 'packets', 'used', 'delta')
 
-	def __init__(self, src_mac, dst_mac, src_ip, dst_ip, bytes):
+	def __init__(self, src_mac, dst_mac, src_ip, dst_ip, bytes, packets=0, used=None):
 		"""
 		Initialise a flow entry.
 
@@ -19,6 +48,12 @@ class FlowEntry(object):
 		param dstIp:	IP address of dst host.
 		param bytes:	Bytes transferred during the measurement period this
 						entry is taken from.
+		param packets:	Packets transferred during the same period.
+		param used:		Seconds since the datapath flow last matched a packet;
+						None if it never has.
+
+		delta is set by DpCtl.changed_entries to the bytes the datapath flow
+		has carried since the previous poll; it is None if that is unknown.
 		"""
 		self.srcMac = src_mac
 		self.dstMac = dst_mac
@@ -27,20 +62,220 @@ class FlowEntry(object):
 		self.dstIp = dst_ip
 		#self.dstPort = dst_port
 		self.bytes = bytes
+		self.packets = packets
+		self.used = used
+		self.delta = None
+
+def parse_dp_flow(line):
+	"""
+	Parse a single line of 'ovs-dpctl dump-flows' output in one pass.
+
+	param line:	A line of 'ovs-dpctl dump-flows' output.
+	return:		A FlowEntry for IPv4 flows; None for ARP, IPv6 and any other
+				line that does not carry an IPv4 match.
+	"""
+	record = parse_dp_record(line)
+	if record is None:
+		return None
+	return FlowEntry(*record)
+
+def parse_dp_record(line):
+	"""
+	Parse a single line of 'ovs-dpctl dump-flows' output into a tuple, which
+	is cheaper than a FlowEntry to pass between processes.
+
+	param line:	A line of 'ovs-dpctl dump-flows' output.
+	return:		(src mac, dst mac, src ip, dst ip, bytes, packets, used), as
+				the arguments of FlowEntry, for IPv4 flows; None otherwise.
+	"""
+	if IPV4_ETH_TYPE not in line:
+		return None
+	eth = DP_ETH_RE.search(line)
+	if eth is None:
+		return None
+	ipv4 = DP_IPV4_RE.search(line, eth.end())
+	if ipv4 is None:
+		return None
+	stats = DP_STATS_RE.search(line, ipv4.end())
+	if stats is None:
+		return None
+	src_mac, dst_mac = eth.groups()
+	src_ip, dst_ip = ipv4.groups()
+	packets, bytes, used = stats.groups()
+	if used == 'never':
+		used = None
+	else:
+		used = float(used)
+	return src_mac, dst_mac, src_ip, dst_ip, int(bytes), int(packets), used
+
+class PollStats(object):
+	"""
+	Counts of datapath flows seen by one poll, relative to the previous poll.
+	"""
+	__slots__ = ('new', 'changed', 'unchanged', 'vanished', 'bytes')
+
+	def __init__(self, new=0, changed=0, unchanged=0, vanished=0, bytes=0):
+		"""
+		param new:			Flows not present in the previous poll.
+		param changed:		Flows whose byte count differs from the previous poll.
+		param unchanged:	Flows whose byte count is the same as in the previous
+							poll; these are not applied to the flowset.
+		param vanished:		Flows present in the previous poll but not this one.
+		param bytes:		Bytes moved by all flows since the previous poll.
+		"""
+		self.new = new
+		self.changed = changed
+		self.unchanged = unchanged
+		self.vanished = vanished
+		self.bytes = bytes
+
+	def __repr__(self):
+		return 'PollStats(new=%d, changed=%d, unchanged=%d, vanished=%d, bytes=%d)' % (
+			self.new, self.changed, self.unchanged, self.vanished, self.bytes)
+
+def iter_dp_flow_entries(lines):
+	"""
+	Lazily parse 'ovs-dpctl dump-flows' output.
+
+	param lines:	Iterable over lines of 'ovs-dpctl dump-flows' output.
+	return:			Generator of FlowEntry objects for the IPv4 lines.
+	"""
+	for line in lines:
+		entry = parse_dp_flow(line)
+		if entry is not None:
+			yield entry
+
+def batched(iterable, size):
+	"""
+	Group an iterable into lists of at most size items, without reading ahead
+	of the batch being built.
+
+	param iterable:	Items to group.
+	param size:		Maximum batch size.
+	return:			Generator of lists.
+	"""
+	iterator = iter(iterable)
+	while True:
+		batch = list(itertools.islice(iterator, size))
+		if not batch:
+			return
+		yield batch
+
+def queue_counts(changed, counts):
+	"""
+	Pass on the lines found by DpCtl.changed_lines, queueing the byte counts
+	of each.
+
+	param changed:	Iterable of (line, previous byte count, byte count), as
+					DpCtl.changed_lines.
+	param counts:	collections.deque to append (previous byte count, byte
+					count) to as each line is yielded.
+	return:			Generator of lines.
+	"""
+	for line, last, bytes in changed:
+		counts.append((last, bytes))
+		yield line
+
+def reset_time(entries):
+	"""
+	Get the time of an entry's last reset.
+
+	param entries:	The [mac, {peer: edge}, datetime, epoch] entry.
+	return:			Seconds since the epoch.
+	"""
+	reset = entries[2]
+	return time.mktime(reset.timetuple()) + reset.microsecond / 1e6
+
+# Bits of a Flows edge's view field, marking which indexes hold the edge.
+SRC_VIEW = 1
+DST_VIEW = 2
+BOTH_VIEWS = SRC_VIEW | DST_VIEW
+
+# Slots of a Flows edge holding, per view, the entry that holds the edge and
+# the reset epoch of that entry the view's offset is relative to; indexed as
+# edge[EDGE_RECORD + view] and edge[EDGE_EPOCH + view].
+EDGE_RECORD = 3
+EDGE_EPOCH = 5
+
+# Slots added to each edge of a Flows with aging enabled: when the edge was
+# last updated, its neighbours in the least-recently-updated list and the
+# pair it belongs to.
+EDGE_STAMP = 8
+EDGE_PREV = 9
+EDGE_NEXT = 10
+EDGE_SRC_IP = 11
+EDGE_DST_IP = 12
+
+# Slot added last to each edge of a Flows that keeps rates: the edge's rate
+# state (see flow_rates).
+EDGE_RATES = -1
+
+# Most edges Flows.expire examines per call.
+EXPIRE_BUDGET = 512
 
 class Flows(object):
 	"""
 	Class representing a set of flows.
+
+	Each (src, dst) pair is stored once, as an edge of the form
+	[bytes, src offset, dst offset, views, src entry, dst entry, src epoch,
+	dst epoch]. The src and dst flowsets are indexes over those edges, keyed
+	by source and destination IP address respectively:
+	{ip: [mac, {peer ip: edge}, datetime, epoch]}. Entries handed out by the
+	accessors are [mac, {peer ip: [bytes, offset]}, datetime] views built
+	from the edges, using the offset belonging to that side.
+
+	Resetting all flows of an entry only advances the entry's epoch. An
+	edge whose epoch for that view is behind is taken to have an offset of
+	-bytes, as a reset would have set it; this is written into the edge the
+	next time the edge is updated, before its byte count changes.
+
+	With aging enabled, edges also carry the EDGE_* slots and are kept in a
+	doubly linked list, least recently updated first, from which expire()
+	evicts idle edges and, above max_entries, the least recently updated
+	ones. An IP address whose last edge is evicted loses its entry.
+
+	With rates enabled, edges also carry EDGE_RATES, updated with the bytes
+	of each new reading, and get_*_rates* return exponentially weighted
+	throughput rates as of the last tick.
+
+	save_state and load_state convert the flowset to and from a
+	flow_store.FlowState, which flow_store writes to and reads from disk.
 	"""
 
-	def __init__(self):
+	def __init__(self, ttl=None, max_entries=None, rate_windows=None):
 		"""
 		Initialise an empty flowset.
+
+		param ttl:			Seconds after its last update that a flow is
+							evicted by expire(); None to keep idle flows.
+		param max_entries:	Number of flows above which expire() evicts the
+							least recently updated; None for no limit.
+		param rate_windows:	Time constants, in seconds, of the rates to keep
+							per flow (e.g. flow_rates.RATE_WINDOWS); None to
+							keep no rates.
 		"""
 		self._src = dict()
 		self._dst = dict()
-		#self.tmp_src = []
-		#self.tmp_dst = []
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.rate_windows = rate_windows
+		self.now = time.time()
+		self.resident = 0
+		self.evicted_idle = 0
+		self.evicted_lru = 0
+		self._lru = None
+		if ttl is not None or max_entries is not None:
+			# Sentinel of the circular least-recently-updated list.
+			self._lru = [None, 0, 0, 0, None, None, None, None,
+						 None, None, None, None, None]
+			self._lru[EDGE_PREV] = self._lru[EDGE_NEXT] = self._lru
+
+	def __len__(self):
+		"""
+		return:	Number of (src, dst) edges held.
+		"""
+		return self.resident
 
 	def has_flow_history(self, ipaddr, flowset):
 		"""
@@ -101,14 +336,244 @@ class Flows(object):
 		else:
 			return self._dst[dstIp][1].has_key(srcIp)
 
+	def find_edge(self, srcIp, dstIp):
+		"""
+		Find the edge for a (src, dst) pair through either index.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		return:			The edge; None if neither index holds the pair.
+		"""
+		entries = self._src.get(srcIp)
+		if entries is not None:
+			edge = entries[1].get(dstIp)
+			if edge is not None:
+				return edge
+		entries = self._dst.get(dstIp)
+		if entries is not None:
+			return entries[1].get(srcIp)
+		return None
+
+	def attach_edge(self, entry, view, entries):
+		"""
+		Get the edge for a flow entry, creating it if needed, and mark it as
+		newly added to the given view with a zero offset.
+
+		param entry:	Flow entry containing flow data.
+		param view:		SRC_VIEW or DST_VIEW.
+		param entries:	The [mac, {peer: edge}, datetime, epoch] entry the
+						edge is being added to.
+		return:			The edge.
+		"""
+		edge = self.find_edge(entry.srcIp, entry.dstIp)
+		if edge is None:
+			edge = [entry.bytes, 0, 0, 0, None, None, 0, 0]
+			self.resident += 1
+			if self._lru is not None:
+				edge.extend((None, None, None, entry.srcIp, entry.dstIp))
+			if self.rate_windows is not None:
+				edge.append(flow_rates.new_rates(self.rate_windows, self.now))
+		else:
+			self.increment_edge(edge, entry.bytes)
+		edge[view] = 0
+		edge[3] |= view
+		edge[EDGE_RECORD + view] = entries
+		edge[EDGE_EPOCH + view] = entries[3]
+		if self._lru is not None:
+			self.touch_edge(edge)
+		return edge
+
+	def detach_edges(self, entries, view):
+		"""
+		Mark the edges of a src or dst entry as no longer held by that view.
+
+		param entries:	The [mac, {peer: edge}, datetime] entry being removed.
+		param view:		SRC_VIEW or DST_VIEW.
+		"""
+		for edge in entries[1].itervalues():
+			edge[3] &= ~view
+			edge[EDGE_RECORD + view] = None
+			if not edge[3]:
+				self.release_edge(edge)
+
+	def release_edge(self, edge):
+		"""
+		Forget an edge that is no longer held by either view.
+
+		param edge:	The edge.
+		"""
+		self.resident -= 1
+		if self._lru is not None and edge[EDGE_PREV] is not None:
+			edge[EDGE_PREV][EDGE_NEXT] = edge[EDGE_NEXT]
+			edge[EDGE_NEXT][EDGE_PREV] = edge[EDGE_PREV]
+			edge[EDGE_PREV] = edge[EDGE_NEXT] = None
+
+	def touch_edge(self, edge):
+		"""
+		Mark an edge as updated now, moving it to the most recently updated
+		end of the aging list. Only used with aging enabled.
+
+		param edge:	The edge.
+		"""
+		now = self.now
+		if edge[EDGE_STAMP] == now:
+			return
+		edge[EDGE_STAMP] = now
+		lru = self._lru
+		if edge[EDGE_PREV] is not None:
+			edge[EDGE_PREV][EDGE_NEXT] = edge[EDGE_NEXT]
+			edge[EDGE_NEXT][EDGE_PREV] = edge[EDGE_PREV]
+		tail = lru[EDGE_PREV]
+		edge[EDGE_PREV] = tail
+		edge[EDGE_NEXT] = lru
+		tail[EDGE_NEXT] = edge
+		lru[EDGE_PREV] = edge
+
+	def evict_edge(self, edge):
+		"""
+		Remove an edge from both views, along with any IP address entry left
+		without flows.
+
+		param edge:	The edge.
+		"""
+		srcIp = edge[EDGE_SRC_IP]
+		dstIp = edge[EDGE_DST_IP]
+		for flowset, ipaddr, peer, view in ((self._src, srcIp, dstIp, SRC_VIEW),
+											(self._dst, dstIp, srcIp, DST_VIEW)):
+			if edge[3] & view:
+				peers = flowset[ipaddr][1]
+				del peers[peer]
+				if not peers:
+					del flowset[ipaddr]
+		edge[3] = 0
+		self.release_edge(edge)
+
+	def tick(self, now=None):
+		"""
+		Set the time at which subsequent updates are taken to happen.
+
+		param now:	Time in seconds since the epoch; the current time if None.
+		"""
+		if now is None:
+			now = time.time()
+		self.now = now
+
+	def expire(self, budget=EXPIRE_BUDGET, ips=None):
+		"""
+		Evict flows not updated within ttl seconds of the last tick, then the
+		least recently updated flows while more than max_entries are held.
+		At most budget flows are evicted per call, so that callers holding a
+		lock can release it between calls.
+
+		param budget:	Most flows to evict.
+		param ips:		Set to add the IP addresses of evicted flows to.
+		return:			Number of flows evicted; less than budget once there
+						is nothing left to evict.
+		"""
+		lru = self._lru
+		if lru is None:
+			return 0
+		oldest = None
+		if self.ttl is not None:
+			oldest = self.now - self.ttl
+		evicted = 0
+		while evicted < budget:
+			edge = lru[EDGE_NEXT]
+			if edge is lru:
+				break
+			if oldest is not None and edge[EDGE_STAMP] < oldest:
+				self.evicted_idle += 1
+			elif self.max_entries is not None and self.resident > self.max_entries:
+				self.evicted_lru += 1
+			else:
+				break
+			if ips is not None:
+				ips.add(edge[EDGE_SRC_IP])
+				ips.add(edge[EDGE_DST_IP])
+			self.evict_edge(edge)
+			evicted += 1
+		return evicted
+
+	def get_eviction_stats(self):
+		"""
+		Get counts of flows held and evicted.
+
+		return:	Dictionary of resident flows and src/dst IP addresses, and of
+				flows evicted for being idle or for exceeding max_entries.
+		"""
+		return {'resident_flows': self.resident,
+				'resident_src_ips': len(self._src),
+				'resident_dst_ips': len(self._dst),
+				'evicted_idle': self.evicted_idle,
+				'evicted_lru': self.evicted_lru}
+
+	def settle_edge(self, edge):
+		"""
+		Write the offsets of any resets the edge has not seen yet into it.
+
+		param edge:	The edge.
+		"""
+		entries = edge[EDGE_RECORD + SRC_VIEW]
+		if entries is not None and edge[EDGE_EPOCH + SRC_VIEW] != entries[3]:
+			edge[SRC_VIEW] = 0 - edge[0]
+			edge[EDGE_EPOCH + SRC_VIEW] = entries[3]
+		entries = edge[EDGE_RECORD + DST_VIEW]
+		if entries is not None and edge[EDGE_EPOCH + DST_VIEW] != entries[3]:
+			edge[DST_VIEW] = 0 - edge[0]
+			edge[EDGE_EPOCH + DST_VIEW] = entries[3]
+
+	def increment_edge(self, edge, bytes):
+		"""
+		Apply an updated byte count to an edge.
+
+		param edge:		The edge to update.
+		param bytes:	Byte count from the most recent reading.
+		"""
+		if edge[0] == bytes:
+			return
+		self.settle_edge(edge)
+		if edge[0] <= bytes:
+			# Flow count has incremented beyond our current tally;
+			# overwrite with new tally.
+			edge[0] = bytes
+		else:
+			# A new flow has been started but a previous flow exists;
+			# update current tally and offset our previous bytes to account
+			# for the new flow, in both views.
+			edge[1] = edge[1] + edge[0]
+			edge[2] = edge[2] + edge[0]
+			edge[0] = bytes
+
+	def add_rates(self, edge, entry, tally):
+		"""
+		Add the bytes of a flow entry to the rates of its edge. These are the
+		entry's delta; entries without one are taken to carry what the edge's
+		tally moved by, which only holds for a single datapath flow per pair.
+
+		param edge:		The edge the entry was applied to.
+		param entry:	Flow entry containing flow data.
+		param tally:	Byte count of the edge before the entry was applied.
+		"""
+		seen = entry.delta
+		if seen is None:
+			if tally <= entry.bytes:
+				seen = entry.bytes - tally
+			else:
+				seen = entry.bytes
+		if seen:
+			flow_rates.add_bytes(edge[EDGE_RATES], self.rate_windows, self.now, seen)
+
 	def add_new_src_flow(self, entry):
 		"""
 		Add a new src flow entry into the flowset.
 
 		param entry: Flow entry containing flow data.
 		"""
-		self._src[entry.srcIp] = [entry.srcMac, dict(), datetime.now()]
-		self._src[entry.srcIp][1][entry.dstIp] = [entry.bytes, 0]
+		if self.has_src_flow_history(entry.srcIp):
+			self.detach_edges(self._src[entry.srcIp], SRC_VIEW)
+		entries = [entry.srcMac, dict(), datetime.now(), 0]
+		self._src[entry.srcIp] = entries
+		entries[1][entry.dstIp] = self.attach_edge(entry, SRC_VIEW, entries)
 
 	def add_new_dst_flow(self, entry):
 		"""
@@ -116,8 +581,11 @@ class Flows(object):
 
 		param entry: Flow entry containing flow data.
 		"""
-		self._dst[entry.dstIp] = [entry.dstMac, dict(), datetime.now()]
-		self._dst[entry.dstIp][1][entry.srcIp] = [entry.bytes, 0]
+		if self.has_dst_flow_history(entry.dstIp):
+			self.detach_edges(self._dst[entry.dstIp], DST_VIEW)
+		entries = [entry.dstMac, dict(), datetime.now(), 0]
+		self._dst[entry.dstIp] = entries
+		entries[1][entry.srcIp] = self.attach_edge(entry, DST_VIEW, entries)
 	
 	def add_new_src_dst_flow(self, entry):
 		"""
@@ -126,7 +594,8 @@ class Flows(object):
 		param entry: Flow entry containing flow data.
 		"""
 		if self.has_src_flow_history(entry.srcIp):
-			self._src[entry.srcIp][1][entry.dstIp] = [entry.bytes, 0]
+			entries = self._src[entry.srcIp]
+			entries[1][entry.dstIp] = self.attach_edge(entry, SRC_VIEW, entries)
 
 	def add_new_dst_src_flow(self, entry):
 		"""
@@ -135,7 +604,8 @@ class Flows(object):
 		param entry: Flow entry containing flow data.
 		"""
 		if self.has_dst_flow_history(entry.dstIp):
-			self._dst[entry.dstIp][1][entry.srcIp] = [entry.bytes, 0]
+			entries = self._dst[entry.dstIp]
+			entries[1][entry.srcIp] = self.attach_edge(entry, DST_VIEW, entries)
 
 	def increment_src_flow(self, entry):
 		"""
@@ -144,17 +614,7 @@ class Flows(object):
 		param entry: Flow entry containing flow data.
 		"""
 		if (self.has_src_flow_dst_entry(entry.srcIp, entry.dstIp)):
-			flow_bytes = self._src[entry.srcIp][1][entry.dstIp]
-			if flow_bytes[0] <= entry.bytes:
-				# Flow count has incremented beyond our current tally;
-				# overwrite with new tally.
-				flow_bytes[0] = entry.bytes
-			else:
-				# A new flow has been started but a previous flow exists;
-				# update current tally and offset our previous bytes to account
-				# for the new flow.
-				flow_bytes[1] = flow_bytes[1] + flow_bytes[0]
-				flow_bytes[0] = entry.bytes
+			self.increment_edge(self._src[entry.srcIp][1][entry.dstIp], entry.bytes)
 
 	def increment_dst_flow(self, entry):
 		"""
@@ -163,17 +623,7 @@ class Flows(object):
 		param entry: Flow entry containing flow data.
 		"""
 		if (self.has_dst_flow_src_entry(entry.dstIp, entry.srcIp)):
-			flow_bytes = self._dst[entry.dstIp][1][entry.srcIp]
-			if flow_bytes[0] <= entry.bytes:
-				# Flow count has incremented beyond our current tally;
-				# overwrite with new tally.
-				flow_bytes[0] = entry.bytes
-			else:
-				# A new flow has been started but a previous flow exists;
-				# update current tally and offset our previous bytes to account
-				# for the new flow.
-				flow_bytes[1] = flow_bytes[1] + flow_bytes[0]
-				flow_bytes[0] = entry.bytes
+			self.increment_edge(self._dst[entry.dstIp][1][entry.srcIp], entry.bytes)
 
 	def reset_src_flow(self, srcIp, dstIp):
 		"""
@@ -184,21 +634,23 @@ class Flows(object):
 		param dstIp:	Destination IP address of the flow.
 		"""
 		if (self.has_src_flow_dst_entry(srcIp, dstIp)):
-			flow_bytes = self._src[srcIp][1][dstIp]
-			flow_bytes[1] = 0 - flow_bytes[0]
+			entries = self._src[srcIp]
+			edge = entries[1][dstIp]
+			edge[SRC_VIEW] = 0 - edge[0]
+			edge[EDGE_EPOCH + SRC_VIEW] = entries[3]
 
 	def reset_src_flows(self, srcIp):
 		"""
 		Reset all flows for a src IP address so that further updates will be
-		calculated against the value at the most recent reading.
+		calculated against the value at the most recent reading. Only the
+		entry's epoch is advanced; the flows themselves are not visited.
 
 		param srcIp:	Source IP address of the flow.
 		"""
 		if (self.has_src_flow_history(srcIp)):
-			for key in self._src[srcIp][1].keys():
-				flow_bytes = self._src[srcIp][1][key]
-				flow_bytes[1] = 0 - flow_bytes[0]
-			self._src[srcIp][2] = datetime.now()
+			entries = self._src[srcIp]
+			entries[3] += 1
+			entries[2] = datetime.now()
 
 	def reset_dst_flow(self, dstIp, srcIp):
 		"""
@@ -209,21 +661,23 @@ class Flows(object):
 		param srcIp:	Source IP address of the flow.
 		"""
 		if (self.has_dst_flow_src_entry(dstIp, srcIp)):
-			flow_bytes = self._dst[dstIp][1][srcIp]
-			flow_bytes[1] = 0 - flow_bytes[0]
+			entries = self._dst[dstIp]
+			edge = entries[1][srcIp]
+			edge[DST_VIEW] = 0 - edge[0]
+			edge[EDGE_EPOCH + DST_VIEW] = entries[3]
 
 	def reset_dst_flows(self, dstIp):
 		"""
 		Reset all flows for a dst IP address so that further updates will be
-		calculated against the value at the most recent reading.
+		calculated against the value at the most recent reading. Only the
+		entry's epoch is advanced; the flows themselves are not visited.
 
 		param dstIp:	Destination IP address of the flow.
 		"""
 		if (self.has_dst_flow_history(dstIp)):
-			for key in self._dst[dstIp][1].keys():
-				flow_bytes = self._dst[dstIp][1][key]
-				flow_bytes[1] = 0 - flow_bytes[0]
-			self._dst[dstIp][2] = datetime.now()
+			entries = self._dst[dstIp]
+			entries[3] += 1
+			entries[2] = datetime.now()
 
 	def update_src_flow(self, entry):
 		"""
@@ -261,33 +715,59 @@ class Flows(object):
 
 		param entry:	Flow entry containing flow data.
 		"""
+		entries = self._src.get(entry.srcIp)
+		if entries is not None:
+			edge = entries[1].get(entry.dstIp)
+			if edge is not None and edge[3] == BOTH_VIEWS:
+				# Common case: a known pair held by both indexes.
+				tally = edge[0]
+				self.increment_edge(edge, entry.bytes)
+				if self._lru is not None:
+					self.touch_edge(edge)
+				if self.rate_windows is not None:
+					self.add_rates(edge, entry, tally)
+				return
+		if self.rate_windows is None:
+			self.update_src_flow(entry)
+			self.update_dst_flow(entry)
+			return
+		edge = self.find_edge(entry.srcIp, entry.dstIp)
+		if edge is None:
+			tally = entry.bytes
+		else:
+			tally = edge[0]
 		self.update_src_flow(entry)
 		self.update_dst_flow(entry)
+		self.add_rates(self.find_edge(entry.srcIp, entry.dstIp), entry, tally)
 
-		#dstIp, proto, srcPort, dstPort, currentBytes, offsetBytes
-#		src_entry_list = array.array('I', [entry.dstIp, 0, 0, 0, entry.bytes, 0])
-#		if not self._src.has_key(entry.srcIp):
-#			self._src[entry.srcIp] = [entry.srcMac]
-#		self._src[entry.srcIp].append(src_entry_list)
+	def view_flows(self, entries, view):
+		"""
+		Build a src or dst view of an entry from its edges.
 
-#		dst_entry_list = array.array('I', [entry.srcIp, 0, 0, 0, entry.bytes, 0])
-#		if not self._dst.has_key(entry.dstIp):
-#			self._dst[entry.dstIp] = [entry.dstMac]
-#		self._dst[entry.dstIp].append(dst_entry_list)
-		
-#		src_entry_list = array.array('I', [1, 1, entry.srcIp, entry.dstIp, entry.bytes])
-#		self.tmp_src.append(src_entry_list)
-#		self.tmp_src.append(1)
-#		self.tmp_src.append(1)
-#		self.tmp_src.append(entry.srcIp)
-#		self.tmp_src.append(entry.dstIp)
-#		self.tmp_src.append(entry.bytes)
-#		print sys.getsizeof(src_entry_list)
-#		dst_entry_list = array.array('I', [1, 1, entry.srcIp, entry.dstIp, entry.bytes])
-#		self.tmp_src.append(src_entry_list)
-#		dst_flow_entry = FlowEntry(entry.srcMac, entry.dstMac,
-#							  entry.srcIp, entry.dstIp, entry.bytes)
-#		self.tmp_dst.append(dst_entry_list)
+		param entries:	The [mac, {peer: edge}, datetime, epoch] entry.
+		param view:		SRC_VIEW or DST_VIEW.
+		return:			[mac, {peer: [bytes, offset]}, datetime].
+		"""
+		flows = dict()
+		epoch = entries[3]
+		epoch_slot = EDGE_EPOCH + view
+		for peer, edge in entries[1].iteritems():
+			if edge[epoch_slot] == epoch:
+				flows[peer] = [edge[0], edge[view]]
+			else:
+				flows[peer] = [edge[0], 0 - edge[0]]
+		return [entries[0], flows, entries[2]]
+
+	def flowset_view(self, flowset):
+		"""
+		Identify which view a flowset corresponds to.
+
+		param flowset:	src or dst flowset.
+		return:			SRC_VIEW or DST_VIEW.
+		"""
+		if flowset is self._src:
+			return SRC_VIEW
+		return DST_VIEW
 
 	def get_src_flows_by_ip(self, srcIp):
 		"""
@@ -299,7 +779,7 @@ class Flows(object):
 		"""
 		entries = None
 		if self.has_src_flow_history(srcIp):
-			entries = self._src[srcIp]
+			entries = self.view_flows(self._src[srcIp], SRC_VIEW)
 		return entries
 
 	def copy_flows_by_ip(self, ipaddr, flowset):
@@ -313,10 +793,7 @@ class Flows(object):
 		"""
 		entries_copy = None
 		if self.has_flow_history(ipaddr, flowset):
-			entries = flowset[ipaddr]
-			entries_copy = [entries[0], dict(), entries[2]]
-			for key in entries[1].keys():
-				entries_copy[1][key] = [entries[1][key][0], entries[1][key][1]]
+			entries_copy = self.view_flows(flowset[ipaddr], self.flowset_view(flowset))
 		return entries_copy
 
 	def copy_src_flows_by_ip(self, srcIp):
@@ -328,13 +805,7 @@ class Flows(object):
 		return:			A copy of the flow entries with this IP address as the
 						source; None if no such flows exist.
 		"""
-		entries_copy = None
-		if self.has_src_flow_history(srcIp):
-			entries = self._src[srcIp]
-			entries_copy = [entries[0], dict(), entries[2]]
-			for key in entries[1].keys():
-				entries_copy[1][key] = [entries[1][key][0], entries[1][key][1]]
-		return entries_copy
+		return self.copy_flows_by_ip(srcIp, self._src)
 
 	def copy_dst_flows_by_ip(self, dstIp):
 		"""
@@ -345,19 +816,14 @@ class Flows(object):
 		return:			A copy of the flow entries with this IP address as the
 						source; None if no such flows exist.
 		"""
-		entries_copy = None
-		if self.has_dst_flow_history(dstIp):
-			entries = self._dst[dstIp]
-			entries_copy = [entries[0], dict(), entries[2]]
-			for key in entries[1].keys():
-				entries_copy[1][key] = [entries[1][key][0], entries[1][key][1]]
-		return entries_copy
+		return self.copy_flows_by_ip(dstIp, self._dst)
 
 	def copy_and_reset_flows_by_ip(self, ipaddr, flowset):
 		"""
 		Copy flows corresponding to the given IP address into new data structures
 		and reset all flows so that further updates will be calculated against
-		the value at the most recent reading.
+		the value at the most recent reading. The flows are visited once, to
+		copy them; the reset only advances the entry's epoch.
 
 		param ipaddr:	IP address of flows to retrieve.
 		param flowset:	src or dst flowset.
@@ -367,12 +833,31 @@ class Flows(object):
 		entries_copy = None
 		if self.has_flow_history(ipaddr, flowset):
 			entries = flowset[ipaddr]
-			entries_copy = [entries[0], dict(), entries[2]]
-			for key in entries[1].keys():
-				entries_copy[1][key] = [entries[1][key][0], entries[1][key][1]]
-				entries[1][key][1] = entries[1][key][0]
+			entries_copy = self.view_flows(entries, self.flowset_view(flowset))
+			entries[3] += 1
+			entries[2] = datetime.now()
 		return entries_copy
 
+	def copy_and_reset_src_flows_by_ip(self, srcIp):
+		"""
+		Copy src flows corresponding to the given src IP address and reset them.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			A copy of the flow entries with this IP address as the
+						source; None if no such flows exist.
+		"""
+		return self.copy_and_reset_flows_by_ip(srcIp, self._src)
+
+	def copy_and_reset_dst_flows_by_ip(self, dstIp):
+		"""
+		Copy dst flows corresponding to the given dst IP address and reset them.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			A copy of the flow entries with this IP address as the
+						destination; None if no such flows exist.
+		"""
+		return self.copy_and_reset_flows_by_ip(dstIp, self._dst)
+
 	def get_dst_flows_by_ip(self, dstIp):
 		"""
 		Get dst flows corresponding to the given dst IP address.
@@ -383,28 +868,311 @@ class Flows(object):
 		"""
 		entries = None
 		if self.has_dst_flow_history(dstIp):
-			entries = self._dst[dstIp]
+			entries = self.view_flows(self._dst[dstIp], DST_VIEW)
 		return entries
 
 	def del_src_flows_by_ip(self, srcIp):
 		"""
-		Delete src flows corresponding to the given src IP address.
+		Delete src flows corresponding to the given src IP address. Edges still
+		held by the dst flowset remain there.
 
 		param srcIP:	Source IP address of flows to delete.
 		"""
-		entries = None
 		if self.has_src_flow_history(srcIp):
-			del self._src[srcIp]
+			self.detach_edges(self._src.pop(srcIp), SRC_VIEW)
 
 	def del_dst_flows_by_ip(self, dstIp):
 		"""
-		Delete dst flows corresponding to the given dst IP address.
+		Delete dst flows corresponding to the given dst IP address. Edges still
+		held by the src flowset remain there.
 
 		param dstIP:	Source IP address of flows to delete.
 		"""
-		entries = None
 		if self.has_dst_flow_history(dstIp):
-			del self._dst[dstIp]
+			self.detach_edges(self._dst.pop(dstIp), DST_VIEW)
+
+	def get_flow_bytes(self, srcIp, dstIp):
+		"""
+		Get the byte count last read for the flow from srcIp to dstIp.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		return:			Byte count; None if no such flow exists.
+		"""
+		edge = self.find_edge(srcIp, dstIp)
+		if edge is None:
+			return None
+		return edge[0]
+
+	def get_flow_rates(self, srcIp, dstIp):
+		"""
+		Get the throughput rates of the flow from srcIp to dstIp.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		return:			Tuple of rates in bytes/sec as of the last tick, one per
+						rate window; None if no such flow exists or no rates
+						are kept.
+		"""
+		if self.rate_windows is None:
+			return None
+		edge = self.find_edge(srcIp, dstIp)
+		if edge is None:
+			return None
+		return flow_rates.current_rates(edge[EDGE_RATES], self.rate_windows, self.now)
+
+	def view_rates(self, entries):
+		"""
+		Get the throughput rates of each flow of an entry.
+
+		param entries:	The [mac, {peer: edge}, datetime, epoch] entry, or None.
+		return:			{peer ip: tuple of rates in bytes/sec}; None if entries
+						is None or no rates are kept.
+		"""
+		if entries is None or self.rate_windows is None:
+			return None
+		windows = self.rate_windows
+		now = self.now
+		rates = dict()
+		for peer, edge in entries[1].iteritems():
+			rates[peer] = flow_rates.current_rates(edge[EDGE_RATES], windows, now)
+		return rates
+
+	def get_src_rates_by_ip(self, srcIp):
+		"""
+		Get the throughput rates of the flows from the given src IP address.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			{dst ip: tuple of rates in bytes/sec} as of the last
+						tick; None if no such flows exist or no rates are kept.
+		"""
+		return self.view_rates(self._src.get(srcIp))
+
+	def get_dst_rates_by_ip(self, dstIp):
+		"""
+		Get the throughput rates of the flows to the given dst IP address.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			{src ip: tuple of rates in bytes/sec} as of the last
+						tick; None if no such flows exist or no rates are kept.
+		"""
+		return self.view_rates(self._dst.get(dstIp))
+
+	def matrix_row(self, entries, window):
+		"""
+		Get the values of a src entry's flows for a traffic matrix.
+
+		param entries:	The [mac, {peer: edge}, datetime, epoch] src entry.
+		param window:	Index of the rate window; None for bytes since reset.
+		return:			Generator of (peer ip, value).
+		"""
+		if window is None:
+			epoch = entries[3]
+			epoch_slot = EDGE_EPOCH + SRC_VIEW
+			for peer, edge in entries[1].iteritems():
+				if edge[epoch_slot] == epoch:
+					yield peer, edge[0] + edge[SRC_VIEW]
+				else:
+					yield peer, 0
+		else:
+			windows = self.rate_windows
+			now = self.now
+			for peer, edge in entries[1].iteritems():
+				yield peer, flow_rates.current_rates(edge[EDGE_RATES], windows, now)[window]
+
+	def export_matrix(self, window=None):
+		"""
+		Export the flows of the src view as a sparse traffic matrix.
+
+		param window:	Index of the rate window whose rates (bytes/sec) to
+						export; None to export the bytes counted since each
+						flow was last reset.
+		return:			traffic_matrix.TrafficMatrix; None if a rate window
+						is asked for and no rates are kept.
+		"""
+		if window is not None and self.rate_windows is None:
+			return None
+		return traffic_matrix.build_matrix([(ipaddr, self.matrix_row(entries, window))
+											for ipaddr, entries in self._src.iteritems()])
+
+	def iter_edges(self):
+		"""
+		Iterate over every edge once, least recently updated first if aging
+		is enabled.
+
+		return:	Generator of (src ip, dst ip, edge).
+		"""
+		lru = self._lru
+		if lru is not None:
+			edge = lru[EDGE_NEXT]
+			while edge is not lru:
+				yield edge[EDGE_SRC_IP], edge[EDGE_DST_IP], edge
+				edge = edge[EDGE_NEXT]
+			return
+		for srcIp, entries in self._src.iteritems():
+			for dstIp, edge in entries[1].iteritems():
+				yield srcIp, dstIp, edge
+		for dstIp, entries in self._dst.iteritems():
+			for srcIp, edge in entries[1].iteritems():
+				if not edge[3] & SRC_VIEW:
+					yield srcIp, dstIp, edge
+
+	def save_state(self):
+		"""
+		Take the state of the flowset as columns, for flow_store to write.
+		Offsets are taken as seen since each entry's last reset.
+
+		return:	flow_store.FlowState.
+		"""
+		state = flow_store.FlowState(self.now, self.rate_windows)
+		index = dict()
+		for flowset, macs, times in ((self._src, state.src_macs, state.src_times),
+									 (self._dst, state.dst_macs, state.dst_times)):
+			for ipaddr, entries in flowset.iteritems():
+				idx = state.number_ip(index, ipaddr)
+				macs[idx] = entries[0]
+				times[idx] = reset_time(entries)
+		aging = self._lru is not None
+		rates = self.rate_windows is not None
+		for srcIp, dstIp, edge in self.iter_edges():
+			stamp = -1.0
+			if aging:
+				stamp = edge[EDGE_STAMP]
+			state.add_edge(index[srcIp], index[dstIp], edge[0], self.state_offset(edge, SRC_VIEW),
+						   self.state_offset(edge, DST_VIEW), edge[3], stamp,
+						   rates and edge[EDGE_RATES] or None)
+		return state
+
+	def state_offset(self, edge, view):
+		"""
+		Get the offset of an edge in a view as seen since the last reset of
+		the entry holding it there.
+
+		param edge:	The edge.
+		param view:	SRC_VIEW or DST_VIEW.
+		return:		The offset; zero if the view does not hold the edge.
+		"""
+		entries = edge[EDGE_RECORD + view]
+		if entries is None:
+			return 0
+		if edge[EDGE_EPOCH + view] == entries[3]:
+			return edge[view]
+		return 0 - edge[0]
+
+	def get_ips(self):
+		"""
+		return:	(IP addresses with src flows, IP addresses with dst flows), as
+				lists.
+		"""
+		return self._src.keys(), self._dst.keys()
+
+	def add_to_state(self, state, numbers, saved, ips, view, budget=None):
+		"""
+		Add the entries of some IP addresses in one view, and their edges, to
+		a state being taken a batch at a time (see
+		dpctl_thread.DpReadClass.save). An edge is added with the view it was
+		found in; found again in the other view, that view is merged into it.
+		IP addresses that no longer have an entry are skipped. Edges are added
+		in no particular order; see flow_store.FlowState.sort_edges.
+
+		param state:	flow_store.FlowState to add to.
+		param numbers:	{ip: index in state} of the IP addresses added so
+						far; updated.
+		param saved:	{(src ip, dst ip): index in state} of the edges added
+						so far; updated.
+		param ips:		Iterator over the IP addresses whose entries to add.
+		param view:		SRC_VIEW or DST_VIEW.
+		param budget:	Number of edges after which to stop, once the entry
+						being added is complete; None for no limit.
+		return:			False if ips was exhausted, True if it may have more.
+		"""
+		aging = self._lru is not None
+		rates = self.rate_windows is not None
+		if view == SRC_VIEW:
+			flowset, macs, times, offsets = self._src, state.src_macs, state.src_times, state.src_offsets
+		else:
+			flowset, macs, times, offsets = self._dst, state.dst_macs, state.dst_times, state.dst_offsets
+		added = 0
+		for ipaddr in ips:
+			entries = flowset.get(ipaddr)
+			if entries is None:
+				continue
+			idx = state.number_ip(numbers, ipaddr)
+			macs[idx] = entries[0]
+			times[idx] = reset_time(entries)
+			for peer, edge in entries[1].iteritems():
+				offset = self.state_offset(edge, view)
+				if view == SRC_VIEW:
+					pair = (ipaddr, peer)
+				else:
+					pair = (peer, ipaddr)
+				i = saved.get(pair)
+				if i is not None:
+					state.views[i] |= view
+					offsets[i] = offset
+					continue
+				saved[pair] = len(state)
+				stamp = -1.0
+				if aging:
+					stamp = edge[EDGE_STAMP]
+				peer_idx = state.number_ip(numbers, peer)
+				if view == SRC_VIEW:
+					state.add_edge(idx, peer_idx, edge[0], offset, 0, view, stamp,
+								   rates and edge[EDGE_RATES] or None)
+				else:
+					state.add_edge(peer_idx, idx, edge[0], 0, offset, view, stamp,
+								   rates and edge[EDGE_RATES] or None)
+			added += len(entries[1])
+			if budget is not None and added >= budget:
+				return True
+		return False
+
+	def load_state(self, state):
+		"""
+		Replace the flows held with those of a saved state. Rates are restored
+		if the state's rate windows are the flowset's, and otherwise restart.
+
+		param state:	flow_store.FlowState, from either backend.
+		"""
+		self._src = dict()
+		self._dst = dict()
+		self.resident = 0
+		self.now = state.now
+		lru = self._lru
+		if lru is not None:
+			lru[EDGE_PREV] = lru[EDGE_NEXT] = lru
+		windows = self.rate_windows
+		same_windows = windows is not None and state.windows == tuple([float(window) for window in windows])
+		ips = state.ips
+		records = {SRC_VIEW: [None] * len(ips), DST_VIEW: [None] * len(ips)}
+		views = ((SRC_VIEW, self._src, state.edge_src, state.edge_dst, state.src_macs, state.src_times),
+				 (DST_VIEW, self._dst, state.edge_dst, state.edge_src, state.dst_macs, state.dst_times))
+		for i in xrange(len(state)):
+			edge = [state.bytes[i], state.src_offsets[i], state.dst_offsets[i], state.views[i],
+					None, None, 0, 0]
+			self.resident += 1
+			if lru is not None:
+				stamp = state.stamps[i]
+				if stamp < 0:
+					stamp = state.now
+				edge.extend((stamp, lru[EDGE_PREV], lru, ips[state.edge_src[i]], ips[state.edge_dst[i]]))
+				# Saved least recently updated first, so each goes to the tail.
+				lru[EDGE_PREV][EDGE_NEXT] = edge
+				lru[EDGE_PREV] = edge
+			if same_windows:
+				edge.append(state.get_rates(i))
+			elif windows is not None:
+				edge.append(flow_rates.new_rates(windows, state.now))
+			for view, flowset, owners, peers, macs, times in views:
+				if not edge[3] & view:
+					continue
+				idx = owners[i]
+				entries = records[view][idx]
+				if entries is None:
+					entries = records[view][idx] = [macs[idx], dict(), datetime.fromtimestamp(times[idx]), 0]
+					flowset[ips[idx]] = entries
+				entries[1][ips[peers[i]]] = edge
+				edge[EDGE_RECORD + view] = entries
 
 	def get_src_mac_by_ip(self, srcIp):
 		"""
@@ -414,7 +1182,7 @@ class Flows(object):
 		return:			The MAC address linked to the given IP address;
 						None otherwise.
 		"""
-		entries = self.get_src_flows_by_ip(srcIp)
+		entries = self._src.get(srcIp)
 		if entries is not None:
 			return entries[0]
 		else:
@@ -428,7 +1196,7 @@ class Flows(object):
 		return:			The MAC address linked to the given IP address;
 						None otherwise.
 		"""
-		entries = self.get_dst_flows_by_ip(dstIp)
+		entries = self._dst.get(dstIp)
 		if entries is not None:
 			return entries[0]
 		else:
@@ -454,14 +1222,60 @@ class DpCtl(object):
 	Provides utility functions for handling/updating flows.
 	"""
 
-	def __init__(self, bridge):
+	def __init__(self, bridge, flows=None, source=None, heavy_hitters=None, history=None,
+				 parser=None, shared=False):
 		"""
 		Initialise the DpCtl class.
 
-		param bridge:	The network bridge to dump datapath flows for.
+		param bridge:			The network bridge to dump datapath flows for.
+		param flows:			Flowset to update; a new Flows if None. Any
+								object with the Flows accessor API (e.g.
+								flowtable.ColumnarFlows) may be used.
+		param source:			Flow source to take dumps from; if None, the
+								ovs-vswitchd unixctl socket, falling back to
+								running 'ovs-dpctl dump-flows'.
+		param heavy_hitters:	heavy_hitters.HeavyHitters to count the traffic
+								of each poll into, alongside the flowset; None
+								for none.
+		param history:			flow_history.FlowHistory to record the traffic
+								of each poll into; None for none.
+		param parser:			Parser of the changed lines of each dump, with a
+								parse(lines) method taking an iterable of lines,
+								read as needed, and returning an iterable of
+								FlowEntry or None per line, and a close() method
+								(e.g. parallel_parse.ParallelParser); None to
+								parse each line as it is read.
+		param shared:			Whether the flowset is also updated by other
+								DpCtls (e.g. one per bridge). Each flow then
+								adds the bytes its datapath flow moved to its
+								pair's count, rather than replacing the count
+								with its own.
 		"""
 		self.bridge = bridge
-		self.flows = Flows()
+		if flows is None:
+			flows = Flows()
+		self.flows = flows
+		if source is None:
+			source = flow_source.default_flow_source(bridge)
+		self.source = source
+		self.parser = parser
+		self.shared = shared
+		# Time of the dump last taken, for sources replaying recorded dumps.
+		self.clock = getattr(source, 'now', None)
+		# Byte counts by datapath flow key (see changed_entries) as of the last
+		# completed poll, and as seen so far by the poll in progress.
+		self.last_bytes = dict()
+		self.poll_bytes = dict()
+		self.stats = PollStats()
+		self.poll_stats = PollStats()
+		self.heavy_hitters = heavy_hitters
+		self.history = history
+		# Companions fed the bytes each datapath flow moved in a poll.
+		self.trackers = [tracker for tracker in (heavy_hitters, history)
+						 if tracker is not None]
+		# Whether a poll has completed, so that byte counts of new datapath
+		# flows were accumulated since the previous one.
+		self.polled = False
 
 	def get_dp_flows(self):
 		"""
@@ -470,36 +1284,221 @@ class DpCtl(object):
 		return:	Unprocessed output of the 'ovs-dpctl dump-flows' command as a
 				list of lines.
 		"""
-		proc = sub.Popen('ovs-dpctl dump-flows ' + self.bridge, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
-		lines = proc.stdout.readlines()
-		return lines
+		return list(self.source.dump())
+
+	def iter_dp_flows(self):
+		"""
+		Stream flows for the bridge specified at class construction time.
+
+		return:	Iterator over lines of 'ovs-dpctl dump-flows' output, yielded
+				as they are read.
+		"""
+		return self.source.dump()
+
+	def close(self):
+		"""
+		Release the flow source (e.g. its connection to ovs-vswitchd), and the
+		parser.
+		"""
+		self.source.close()
+		if self.parser is not None:
+			self.parser.close()
 
 	def update_entries(self, lines):
 		"""
-		Update the flow entries using the 'ovs-dpctl dump-flows' output.
-
-		param lines:	Output from 'ovs-dpctl dump-flows' command.
-		"""
-		for line in lines:
-			line = line.split(',')
-			# Check we have an IPv4 packet
-			if (line[3] == 'eth_type(0x0800)'):
-				# Now add the entry to the dictionaries
-				# First, extract MAC, IP and packets
-				srcMac = line[1][8:]
-				dstMac = line[2][4:-1]
-				srcIp = line[4][9:]
-				dstIp = line[5][4:]
-				if not (line[13].strip().startswith('bytes')):
-					# This happens with IGMP packets (IP proto 2).
-					# If it happens with other packet types in other unknown ways,
-					# might be best to process just TCP/UDP packets.
-					#print 'Out-of-normal line: ' + str(line)
-					bytes = int(line[11].strip()[6:])
+		Update the flow entries using the 'ovs-dpctl dump-flows' output, as
+		one poll; datapath flows unchanged since the previous poll are skipped.
+
+		param lines:	Output from 'ovs-dpctl dump-flows' command; any iterable
+						of lines, consumed as it is parsed.
+		"""
+		self.begin_poll()
+		self.apply_entries(self.changed_entries(lines))
+		self.end_poll()
+
+	def begin_poll(self):
+		"""
+		Start a poll; changed_entries compares lines against the previous poll.
+		Flows updated by the poll are taken to have been updated now, or, if
+		the source replays a trace, at the recorded time of the dump last
+		taken from it.
+		"""
+		self.poll_bytes = dict()
+		self.stats = PollStats()
+		if self.clock is not None:
+			self.flows.tick(self.clock())
+		else:
+			self.flows.tick()
+		for tracker in self.trackers:
+			tracker.tick(self.flows.now)
+
+	def changed_entries(self, lines):
+		"""
+		Parse the lines of a dump that describe new or changed IPv4 datapath
+		flows (see changed_lines). Only the key and byte count of a line are
+		read to decide whether it has changed, so unchanged flows are never
+		fully parsed. Counts are added to the poll in progress as the lines
+		are consumed. Each entry's delta is set, except for flows new in the
+		first poll.
+
+		With a parser, the changed lines are passed to it as they are found,
+		and parsed by it, e.g. in a process pool (see parallel_parse); the
+		counts of the lines it has read ahead are queued until their entries
+		come back.
+
+		param lines:	Iterable over lines of 'ovs-dpctl dump-flows' output.
+		return:			Generator of FlowEntry objects.
+		"""
+		stats = self.stats
+		polled = self.polled
+		moved = 0
+		changed = self.changed_lines(lines)
+		if self.parser is None:
+			parsed = ((parse_dp_flow(line), last, bytes) for line, last, bytes in changed)
+		else:
+			counts = collections.deque()
+			entries = self.parser.parse(queue_counts(changed, counts))
+			parsed = ((entry,) + counts.popleft() for entry in entries)
+		try:
+			for entry, last, bytes in parsed:
+				if entry is None:
+					continue
+				if last is None:
+					stats.new += 1
+					if polled:
+						entry.delta = bytes
+						moved += bytes
 				else:
-					bytes = int(line[13].strip()[6:])
-				entry = FlowEntry(srcMac, dstMac, srcIp, dstIp, bytes)
-				self.flows.update_flows(entry)
+					stats.changed += 1
+					if last < bytes:
+						entry.delta = bytes - last
+					else:
+						# The datapath flow was replaced by one with the same key.
+						entry.delta = bytes
+					moved += entry.delta
+				yield entry
+		finally:
+			stats.bytes += moved
+
+	def changed_lines(self, lines):
+		"""
+		Find the lines of a dump whose IPv4 datapath flows are new or have
+		changed since the previous poll. A flow is identified by its ufid if
+		the line carries one and otherwise by a hash of its match (the part
+		of the line before its statistics). Byte counts are recorded for the
+		poll in progress, and unchanged flows counted, as lines are consumed.
+
+		param lines:	Iterable over lines of 'ovs-dpctl dump-flows' output.
+		return:			Generator of (line, byte count in the previous poll or
+						None if new, byte count).
+		"""
+		last_bytes = self.last_bytes
+		poll_bytes = self.poll_bytes
+		unchanged = 0
+		try:
+			for line in lines:
+				if IPV4_ETH_TYPE not in line:
+					continue
+				# Plain string searches rather than DP_STATS_RE; this runs for
+				# every flow of every dump.
+				end = line.find(DP_STATS_PREFIX)
+				start = line.find(DP_BYTES_PREFIX, end)
+				if end < 0 or start < 0:
+					continue
+				if line.startswith(UFID_PREFIX):
+					key = line[len(UFID_PREFIX):line.find(',', 0, end)]
+				else:
+					key = hash(line[:end])
+				start += len(DP_BYTES_PREFIX)
+				bytes = int(line[start:line.find(',', start)])
+				poll_bytes[key] = bytes
+				last = last_bytes.get(key)
+				if last == bytes:
+					unchanged += 1
+					continue
+				yield line, last, bytes
+		finally:
+			self.stats.unchanged += unchanged
+
+	def end_poll(self):
+		"""
+		Complete a poll: count the flows that have vanished since the previous
+		poll and remember this poll's byte counts for the next.
+
+		return:	PollStats for the completed poll, also kept as poll_stats.
+		"""
+		stats = self.stats
+		stats.vanished = len(self.last_bytes.viewkeys() - self.poll_bytes.viewkeys())
+		self.last_bytes = self.poll_bytes
+		self.poll_bytes = dict()
+		self.poll_stats = stats
+		self.polled = True
+		return stats
+
+	def apply_entries(self, entries):
+		"""
+		Update the flow entries using already parsed flow entries.
+
+		param entries:	Iterable of FlowEntry objects.
+		"""
+		update_flows = self.flows.update_flows
+		trackers = self.trackers
+		if self.shared:
+			entries = self.accumulated_entries(entries)
+		if not trackers:
+			for entry in entries:
+				update_flows(entry)
+			return
+		for entry in entries:
+			update_flows(entry)
+			if entry.delta:
+				for tracker in trackers:
+					tracker.add(entry.srcIp, entry.dstIp, entry.delta)
+
+	def accumulated_entries(self, entries):
+		"""
+		Add the bytes each flow entry moved to the count its pair has in the
+		shared flowset, as each entry is consumed. A pair the flowset does not
+		hold starts from its datapath flow's count, as in a flowset of its
+		own; a datapath flow first seen in the first poll adds nothing to a
+		pair it does hold, whose count it may already be in (e.g. restored
+		from a store).
+
+		param entries:	Iterable of FlowEntry objects, from changed_entries.
+		return:			Generator of the same entries, counts updated.
+		"""
+		get_flow_bytes = self.flows.get_flow_bytes
+		for entry in entries:
+			bytes = get_flow_bytes(entry.srcIp, entry.dstIp)
+			if bytes is not None:
+				entry.bytes = bytes + (entry.delta or 0)
+			yield entry
+
+	def expire(self, budget=EXPIRE_BUDGET, ips=None):
+		"""
+		Evict idle flows, and flows above the flowset's size limit.
+
+		param budget:	Most flows to evict.
+		param ips:		Set to add the IP addresses of evicted flows to.
+		return:			Number of flows evicted; less than budget once there
+						is nothing left to evict.
+		"""
+		return self.flows.expire(budget, ips)
+
+	def get_eviction_stats(self):
+		"""
+		Get counts of flows held and evicted.
+
+		return:	Dictionary of resident flows and src/dst IP addresses, and of
+				flows evicted for being idle or for exceeding the size limit;
+				with a history, also of the pairs it tracks and has evicted
+				for exceeding its limit.
+		"""
+		stats = self.flows.get_eviction_stats()
+		if self.history is not None:
+			stats['history_pairs'] = len(self.history.pairs)
+			stats['evicted_history'] = self.history.evicted
+		return stats
 
 	def get_src_flows_by_ip(self, srcIp):
 		"""
@@ -542,7 +1541,7 @@ class DpCtl(object):
 		return:			A copy of the flow entries with this IP address as the
 						source; None if no such flows exist.
 		"""
-		return self.copy_flows_by_ip(srcIp, self.flows.src_flows)
+		return self.flows.copy_src_flows_by_ip(srcIp)
 
 	def copy_dst_flows_by_ip(self, dstIp):
 		"""
@@ -553,7 +1552,7 @@ class DpCtl(object):
 		return:			A copy of the flow entries with this IP address as the
 						destination; None if no such flows exist.
 		"""
-		return self.copy_flows_by_ip(dstIp, self.flows.dst_flows)
+		return self.flows.copy_dst_flows_by_ip(dstIp)
 
 	def copy_and_reset_flows_by_ip(self, ipaddr, flowset):
 		"""
@@ -574,7 +1573,7 @@ class DpCtl(object):
 		return:			A copy of the flow entries with this IP address as the
 						source; None if no such flows exist.
 		"""
-		return self.copy_and_reset_flows_by_ip(srcIp, self.flows._src)
+		return self.flows.copy_and_reset_src_flows_by_ip(srcIp)
 
 	def copy_and_reset_dst_flows_by_ip(self, dstIp):
 		"""
@@ -584,7 +1583,91 @@ class DpCtl(object):
 		return:			A copy of the flow entries with this IP address as the
 						source; None if no such flows exist.
 		"""
-		return self.copy_and_reset_flows_by_ip(dstIp, self.flows._dst)
+		return self.flows.copy_and_reset_dst_flows_by_ip(dstIp)
+
+	def get_flow_rates(self, srcIp, dstIp):
+		"""
+		Get the throughput rates of the flow from srcIp to dstIp.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		return:			Tuple of rates in bytes/sec, one per rate window; None
+						if no such flow exists or no rates are kept.
+		"""
+		return self.flows.get_flow_rates(srcIp, dstIp)
+
+	def get_src_rates_by_ip(self, srcIp):
+		"""
+		Get the throughput rates of the flows from the given src IP address.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			{dst ip: tuple of rates in bytes/sec}; None if no such
+						flows exist or no rates are kept.
+		"""
+		return self.flows.get_src_rates_by_ip(srcIp)
+
+	def get_dst_rates_by_ip(self, dstIp):
+		"""
+		Get the throughput rates of the flows to the given dst IP address.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			{src ip: tuple of rates in bytes/sec}; None if no such
+						flows exist or no rates are kept.
+		"""
+		return self.flows.get_dst_rates_by_ip(dstIp)
+
+	def export_matrix(self, window=None):
+		"""
+		Export the flows as a sparse traffic matrix.
+
+		param window:	Index of the rate window to export; None for the bytes
+						counted since each flow was last reset.
+		return:			traffic_matrix.TrafficMatrix; None if a rate window is
+						asked for and no rates are kept.
+		"""
+		return self.flows.export_matrix(window)
+
+	def get_history_rate(self, srcIp, dstIp, seconds):
+		"""
+		Get the average rate of a flow over the last seconds, from its history.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		param seconds:	Length of the period.
+		return:			Bytes/sec; None if no history is kept for the flow.
+		"""
+		if self.history is None:
+			return None
+		return self.history.get_rate(srcIp, dstIp, seconds)
+
+	def get_history_samples(self, srcIp, dstIp, level=0, count=None):
+		"""
+		Get the bytes per bucket of a flow at one resolution of its history,
+		oldest first; see flow_history.FlowHistory.get_samples.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		param level:	Index of the resolution.
+		param count:	Number of buckets; all that are kept if None.
+		return:			List of byte counts; None if no history is kept for
+						the flow.
+		"""
+		if self.history is None:
+			return None
+		return self.history.get_samples(srcIp, dstIp, level, count)
+
+	def get_top_peers(self, ipaddr, n):
+		"""
+		Get the peers an IP address exchanges the most traffic with.
+
+		param ipaddr:	IP address.
+		param n:		Most peers to return.
+		return:			List of (peer, bytes/sec), highest rate first; None if
+						no heavy hitters are tracked.
+		"""
+		if self.heavy_hitters is None:
+			return None
+		return self.heavy_hitters.top_peers(ipaddr, n)
 
 	def get_src_mac_by_ip(self, srcIp):
 		"""
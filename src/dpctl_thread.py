@@ -1,37 +1,376 @@
 import datetime
 import dpctl
+import flow_snapshot
+import flow_store
+import poll_metrics
 import threading
 import time
 
+# Flows applied per acquisition of DpReadClass.lock while ingesting a dump.
+BATCH_SIZE = 512
+
+# Adaptive polling: fraction of datapath flows appearing or vanishing in a
+# poll above which the interval is shortened, and below which it may be
+# lengthened.
+CHURN_HIGH = 0.1
+CHURN_LOW = 0.01
+# Relative change of the aggregate byte rate from its recent average that
+# is taken as a burst, and the weight of each poll in that average.
+RATE_SHIFT = 0.5
+RATE_WEIGHT = 0.3
+# Factor the interval is lengthened by while traffic is stable.
+BACKOFF = 1.5
+
+# Seconds between saves of the flowset to DpReadClass's store.
+STORE_INTERVAL = 60.0
+
+class PollScheduler(object):
+	"""
+	Class choosing the interval between polls from what each poll found.
+
+	A poll in which many datapath flows appeared or vanished, or in which
+	the aggregate byte rate moved far from its recent average, halves the
+	interval; one in which neither happened lengthens it by BACKOFF. The
+	fraction of flows whose counts changed is not used: on a busy but
+	steady host it is close to one on every poll.
+	"""
+
+	def __init__(self, interval, min_interval, max_interval, churn_high=CHURN_HIGH,
+				 churn_low=CHURN_LOW, rate_shift=RATE_SHIFT, backoff=BACKOFF):
+		"""
+		Initialise the scheduler.
+
+		param interval:		Interval to start with, in seconds.
+		param min_interval:	Shortest interval, in seconds.
+		param max_interval:	Longest interval, in seconds.
+		param churn_high:	Fraction of flows new or vanished above which
+							polls are made more frequent.
+		param churn_low:	Fraction of flows new or vanished below which
+							polls may be made less frequent.
+		param rate_shift:	Relative change of the byte rate taken as a burst.
+		param backoff:		Factor the interval is lengthened by.
+		"""
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.churn_high = churn_high
+		self.churn_low = churn_low
+		self.rate_shift = rate_shift
+		self.backoff = backoff
+		self.interval = min(max(interval, min_interval), max_interval)
+		self.rate = None
+		self.last = None
+
+	def update(self, stats, now=None):
+		"""
+		Choose the interval to wait before the next poll.
+
+		param stats:	dpctl.PollStats of the poll just taken.
+		param now:		Time the poll was taken; the current time if None.
+		return:			The interval, in seconds.
+		"""
+		if now is None:
+			now = time.time()
+		flows = stats.new + stats.changed + stats.unchanged + stats.vanished
+		churn = 0.0
+		if flows:
+			churn = float(stats.new + stats.vanished) / flows
+		shift = 0.0
+		if self.last is not None and now > self.last:
+			rate = stats.bytes / (now - self.last)
+			if self.rate is None:
+				self.rate = rate
+			else:
+				shift = abs(rate - self.rate) / max(self.rate, 1.0)
+				self.rate += (rate - self.rate) * RATE_WEIGHT
+		self.last = now
+		if churn > self.churn_high or shift > self.rate_shift:
+			self.interval = max(self.interval / 2.0, self.min_interval)
+		elif churn < self.churn_low and shift < self.rate_shift / 2:
+			self.interval = min(self.interval * self.backoff, self.max_interval)
+		return self.interval
+
 class DpReadClass(threading.Thread):
 	"""
 	Class wrapping DpCtl in a thread, for continual updating of flow throughput.
+
+	In read-copy-update mode, the flow data is only read and written by the
+	polling thread and by copy_and_reset_entries_by_*; the get_*, copy_* and
+	get_mac_by_ip queries are answered from a flow_snapshot.FlowSnapshot
+	published at the end of each poll, without taking the lock, and so see
+	the flows as of the last completed poll.
+
+	Given min_interval or max_interval, the thread waits between polls for
+	an interval chosen by a PollScheduler, kept as interval.
+
+	Given a store, the flowset is loaded from it when the thread is created,
+	if it holds a usable snapshot (see flow_store), and saved to it every
+	store_interval seconds and when the thread terminates, so that a
+	restarted agent resumes with the flows, offsets and rates it had. The
+	first poll after a restart applies every datapath flow, since which of
+	them changed while the agent was down is not known.
+
+	Given metrics, each poll's dump, parse, lock and overall times, line
+	counts and resident flow counts are recorded into it (see
+	poll_metrics), and read with get_poll_metrics.
 	"""
 
-	def __init__(self, interval=1, bridge='xenbr0'):
+	def __init__(self, interval=1, bridge='xenbr0', flows=None, source=None,
+				 batch_size=BATCH_SIZE, rcu=False, heavy_hitters=None,
+				 min_interval=None, max_interval=None, history=None, store=None,
+				 store_interval=STORE_INTERVAL, metrics=None, parser=None):
 		"""
 		Initialise the DpCtl thread.
 
-		param interval:	Polling interval for reading datapath flow data. Default: 1 sec.
-		param bridge:	Bridge to read datapath flow data from. Default: 'xenbr0'.
+		param interval:			Polling interval for reading datapath flow data. Default: 1 sec.
+		param bridge:			Bridge to read datapath flow data from. Default: 'xenbr0'.
+		param flows:			Flowset backend to use; see dpctl.DpCtl.
+		param source:			Flow source to take dumps from; see dpctl.DpCtl.
+		param batch_size:		Maximum number of flows applied per lock acquisition.
+		param rcu:				Answer queries from published snapshots.
+		param heavy_hitters:	Heavy-hitter tracker; see dpctl.DpCtl.
+		param min_interval:		Shortest polling interval; if this or
+								max_interval is given, the interval adapts to
+								traffic (see PollScheduler) from interval.
+		param max_interval:		Longest polling interval.
+		param history:			Throughput history; see dpctl.DpCtl.
+		param store:			Path of the file to keep the flowset in; None
+								to keep it only in memory.
+		param store_interval:	Seconds between saves to the store.
+		param metrics:			poll_metrics.PollMetrics to record the poller's
+								timings and counts into; None for none.
+		param parser:			Parser of the changed lines of each dump (e.g.
+								parallel_parse.ParallelParser); see
+								dpctl.DpCtl.
 		"""
 		super(DpReadClass, self).__init__()
 		self.interval = interval
+		self.scheduler = None
+		if min_interval is not None or max_interval is not None:
+			if min_interval is None:
+				min_interval = interval
+			if max_interval is None:
+				max_interval = interval
+			self.scheduler = PollScheduler(interval, min_interval, max_interval)
+			self.interval = self.scheduler.interval
 		self.bridge = bridge
+		self.batch_size = batch_size
 		self.doLoop = True
 		self.lock = threading.Lock()
-		self.dpctl = dpctl.DpCtl(bridge)
+		self.dpctl = dpctl.DpCtl(bridge, flows, source, heavy_hitters, history, parser)
+		self.rcu = rcu
+		self.metrics = metrics
+		self.snapshot = flow_snapshot.FlowSnapshot()
+		# IP addresses changed since the snapshot was published; guarded by lock.
+		self.dirty = set()
+		self.store = store
+		self.store_interval = store_interval
+		self.saved = time.time()
+		self.restored = 0
+		if store is not None:
+			self.restored = self.restore()
 
 	def run(self):
 		"""
 		Continually loop and update flow data.
 		"""
 		while self.doLoop:
-			lines = self.dpctl.get_dp_flows()
+			stats = self.poll()
+			if self.scheduler is not None:
+				self.interval = self.scheduler.update(stats)
+			self.save_if_due()
+			time.sleep(self.interval)
+		if self.store is not None:
+			self.save()
+		self.dpctl.close()
+
+	def poll(self):
+		"""
+		Take one dump and apply it to the flow data, then evict expired flows.
+		Lines are parsed as they are read, outside the lock; the lock is only
+		held while applying each batch of parsed flows, or evicting up to a
+		batch of flows. Flows unchanged since the last poll are skipped.
+
+		return:	dpctl.PollStats for the dump.
+		"""
+		metrics = self.metrics
+		if metrics is not None:
+			metrics.begin_poll()
+		# Take the dump first, so that a replayed dump's time is known.
+		stats = self.ingest(self.dpctl, self.start_dump(self.dpctl))
+		ips = None
+		if self.rcu:
+			ips = self.dirty
+		self.evict(ips)
+		if self.rcu:
+			self.publish()
+		if metrics is not None:
+			metrics.end_poll(self.dpctl.get_eviction_stats())
+		return stats
+
+	def start_dump(self, ctl):
+		"""
+		Start a dump, timed if the poller is instrumented.
+
+		param ctl:	dpctl.DpCtl to take the dump through.
+		return:		Iterable over the lines of the dump.
+		"""
+		if self.metrics is None:
+			return ctl.iter_dp_flows()
+		return poll_metrics.TimedDump(ctl.iter_dp_flows)
+
+	def acquire(self):
+		"""
+		Acquire the lock for the poller, timing the wait if instrumented.
+		"""
+		if self.metrics is None:
 			self.lock.acquire()
-			self.dpctl.update_entries(lines)
+		else:
+			self.metrics.acquire(self.lock)
+
+	def release(self):
+		"""
+		Release the lock taken by acquire.
+		"""
+		if self.metrics is None:
 			self.lock.release()
-			time.sleep(self.interval)
+		else:
+			self.metrics.release(self.lock)
+
+	def ingest(self, ctl, lines, tag=None):
+		"""
+		Apply a dump to the flow data, as one poll of a DpCtl, a batch of
+		flows per acquisition of the lock.
+
+		param ctl:		dpctl.DpCtl the dump was taken through.
+		param lines:	Lines of the dump.
+		param tag:		Tag to pass tag_entries with each batch applied; None
+						to not tag them.
+		return:			dpctl.PollStats for the dump.
+		"""
+		metrics = self.metrics
+		if metrics is not None:
+			metrics.begin_ingest()
+		ctl.begin_poll()
+		entries = ctl.changed_entries(lines)
+		for batch in dpctl.batched(entries, self.batch_size):
+			self.acquire()
+			try:
+				ctl.apply_entries(batch)
+				if self.rcu:
+					for entry in batch:
+						self.dirty.add(entry.srcIp)
+						self.dirty.add(entry.dstIp)
+				if tag is not None:
+					self.tag_entries(batch, tag)
+			finally:
+				self.release()
+		stats = ctl.end_poll()
+		if metrics is not None:
+			metrics.end_ingest(lines, stats)
+		return stats
+
+	def tag_entries(self, entries, tag):
+		"""
+		Tag a batch of flow entries just applied by ingest; called with the
+		lock held. Nothing is tagged here; see MultiBridgeReadClass.
+
+		param entries:	List of dpctl.FlowEntry objects.
+		param tag:		Tag passed to ingest.
+		"""
+		pass
+
+	def evict(self, ips=None):
+		"""
+		Evict expired flows, a batch per acquisition of the lock.
+
+		param ips:	Set to add the IP addresses of evicted flows to.
+		"""
+		evicted = self.batch_size
+		while evicted == self.batch_size:
+			self.acquire()
+			try:
+				evicted = self.dpctl.expire(self.batch_size, ips)
+			finally:
+				self.release()
+
+	def save_if_due(self):
+		"""
+		Save the flowset to the store, if there is one and store_interval
+		seconds have passed since it was last saved.
+		"""
+		if self.store is not None and time.time() - self.saved >= self.store_interval:
+			self.save()
+
+	def publish(self):
+		"""
+		Publish a snapshot of the flow data for queries to read. Entries of
+		IP addresses changed since the last snapshot are re-read a batch at a
+		time under the lock; the rest are shared with the last snapshot.
+		"""
+		self.acquire()
+		dirty, self.dirty = self.dirty, set()
+		self.release()
+		flows = self.dpctl.flows
+		snapshot = self.snapshot.derive(getattr(flows, 'rate_windows', None), flows.now)
+		for batch in dpctl.batched(dirty, self.batch_size):
+			self.acquire()
+			try:
+				snapshot.refresh(self.dpctl, batch)
+			finally:
+				self.release()
+		# A single reference assignment, so readers see one snapshot or the other.
+		self.snapshot = snapshot
+
+	def save(self):
+		"""
+		Save the flowset to the store. Its state is copied under the lock
+		about batch_size flows at a time, src entries first, and put in order
+		and written out with the lock released. Polls may run between
+		batches, so a flow created during the save may be left out of it.
+		"""
+		flows = self.dpctl.flows
+		self.acquire()
+		try:
+			state = flow_store.FlowState(flows.now, flows.rate_windows)
+			src_ips, dst_ips = flows.get_ips()
+		finally:
+			self.release()
+		numbers = dict()
+		saved = dict()
+		for ips, view in ((iter(src_ips), dpctl.SRC_VIEW), (iter(dst_ips), dpctl.DST_VIEW)):
+			more = True
+			while more:
+				self.acquire()
+				try:
+					more = flows.add_to_state(state, numbers, saved, ips, view, self.batch_size)
+				finally:
+					self.release()
+		state.sort_edges()
+		flow_store.write_state(self.store, state)
+		self.saved = time.time()
+
+	def restore(self):
+		"""
+		Load the flowset from the store, replacing the flows held. A missing,
+		corrupt or incompatible store is ignored, leaving the flowset as it
+		was. In read-copy-update mode the loaded flows are published at once.
+
+		return:	Number of flows loaded.
+		"""
+		try:
+			state = flow_store.read_state(self.store)
+		except (IOError, flow_store.StoreError):
+			return 0
+		self.lock.acquire()
+		try:
+			self.dpctl.flows.load_state(state)
+			if self.rcu:
+				self.dirty.update(state.ips)
+		finally:
+			self.lock.release()
+		if self.rcu:
+			self.publish()
+		return len(state)
 
 	def terminate(self):
 		"""
@@ -46,11 +385,137 @@ class DpReadClass(threading.Thread):
 		param ipaddr:	IP address to retrieve associated MAC address for.
 		return:			MAC address.
 		"""
+		if self.rcu:
+			return self.snapshot.get_mac_by_ip(ipaddr)
 		self.lock.acquire()
 		ip = self.dpctl.get_mac_by_ip(ipaddr)
 		self.lock.release()
 		return ip
 
+	def get_rates_by_src_ip(self, srcIp):
+		"""
+		Retrieve the throughput rates of source flows by IP address.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			{dst ip: tuple of rates in bytes/sec, one per rate
+						window}; None if no such flows exist or the flowset
+						keeps no rates.
+		"""
+		if self.rcu:
+			return self.snapshot.get_src_rates_by_ip(srcIp)
+		return self.lock_access_get_entries(self.dpctl.get_src_rates_by_ip, srcIp)
+
+	def get_rates_by_dst_ip(self, dstIp):
+		"""
+		Retrieve the throughput rates of destination flows by IP address.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			{src ip: tuple of rates in bytes/sec, one per rate
+						window}; None if no such flows exist or the flowset
+						keeps no rates.
+		"""
+		if self.rcu:
+			return self.snapshot.get_dst_rates_by_ip(dstIp)
+		return self.lock_access_get_entries(self.dpctl.get_dst_rates_by_ip, dstIp)
+
+	def get_top_peers(self, ipaddr, n):
+		"""
+		Retrieve the peers an IP address exchanges the most traffic with. The
+		tracker is small, so this takes the lock even in read-copy-update mode.
+
+		param ipaddr:	IP address to retrieve peers for.
+		param n:		Most peers to return.
+		return:			List of (peer, bytes/sec), highest rate first; None if
+						no heavy hitters are tracked.
+		"""
+		self.lock.acquire()
+		try:
+			return self.dpctl.get_top_peers(ipaddr, n)
+		finally:
+			self.lock.release()
+
+	def export_matrix(self, window=None):
+		"""
+		Export the flows as a sparse traffic matrix, in one acquisition of the
+		lock (or from the published snapshot, in read-copy-update mode).
+
+		param window:	Index of the rate window to export; None for the bytes
+						counted since each flow was last reset.
+		return:			traffic_matrix.TrafficMatrix; None if a rate window is
+						asked for and no rates are kept.
+		"""
+		if self.rcu:
+			return self.snapshot.export_matrix(window)
+		self.lock.acquire()
+		try:
+			return self.dpctl.export_matrix(window)
+		finally:
+			self.lock.release()
+
+	def get_poll_interval(self):
+		"""
+		Get the interval currently waited between polls.
+
+		return:	Seconds.
+		"""
+		return self.interval
+
+	def get_history_rate(self, srcIp, dstIp, seconds):
+		"""
+		Retrieve the average rate of a flow over the last seconds, from its
+		history. Takes the lock even in read-copy-update mode.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		param seconds:	Length of the period.
+		return:			Bytes/sec; None if no history is kept for the flow.
+		"""
+		self.lock.acquire()
+		try:
+			return self.dpctl.get_history_rate(srcIp, dstIp, seconds)
+		finally:
+			self.lock.release()
+
+	def get_history_samples(self, srcIp, dstIp, level=0, count=None):
+		"""
+		Retrieve the bytes per bucket of a flow at one resolution of its
+		history, oldest first. Takes the lock even in read-copy-update mode.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		param level:	Index of the resolution; see flow_history.LEVELS.
+		param count:	Number of buckets; all that are kept if None.
+		return:			List of byte counts; None if no history is kept for
+						the flow.
+		"""
+		self.lock.acquire()
+		try:
+			return self.dpctl.get_history_samples(srcIp, dstIp, level, count)
+		finally:
+			self.lock.release()
+
+	def get_poll_metrics(self):
+		"""
+		Get the poller's timings and counts.
+
+		return:	Dictionary of counts, as poll_metrics.PollMetrics.get_stats;
+				None if the poller is not instrumented.
+		"""
+		if self.metrics is None:
+			return None
+		return self.metrics.get_stats()
+
+	def get_eviction_stats(self):
+		"""
+		Get counts of flows held and evicted; see dpctl.Flows.get_eviction_stats.
+
+		return:	Dictionary of counts.
+		"""
+		self.lock.acquire()
+		stats = self.dpctl.get_eviction_stats()
+		self.lock.release()
+		return stats
+
 	def lock_access_get_entries(self, funct, ipaddr):
 		"""
 		Simple wrapper function to marshal access to DpCtl, to ensure that flow
@@ -65,6 +530,25 @@ class DpReadClass(threading.Thread):
 		self.lock.release()
 		return entries_copy
 
+	def lock_access_reset_entries(self, funct, ipaddr):
+		"""
+		As lock_access_get_entries, for functions that also reset flows. In
+		read-copy-update mode the IP address's entries are republished by
+		the next poll.
+
+		param funct:	The function to be called to access flow data.
+		param ipaddr:	The IP address to retrieve flow data for.
+		return:			Flow entries corresponding to the given IP address.
+		"""
+		self.lock.acquire()
+		try:
+			entries_copy = funct(ipaddr)
+			if self.rcu:
+				self.dirty.add(ipaddr)
+		finally:
+			self.lock.release()
+		return entries_copy
+
 	def get_entries_by_src_ip(self, srcIp):
 		"""
 		Retrieve source entries by IP address.
@@ -73,6 +557,8 @@ class DpReadClass(threading.Thread):
 		return:			Flow entries with this IP address as the source;
 						None if no such flows exist.
 		"""
+		if self.rcu:
+			return self.snapshot.get_src_flows_by_ip(srcIp)
 		funct = self.dpctl.get_src_flows_by_ip
 		return self.lock_access_get_entries(funct, srcIp)
 
@@ -84,6 +570,8 @@ class DpReadClass(threading.Thread):
 		return:			Flow entries with this IP address as the source;
 						None if no such flows exist.
 		"""
+		if self.rcu:
+			return self.snapshot.get_src_flows_by_ip(srcIp)
 		funct = self.dpctl.copy_src_flows_by_ip
 		return self.lock_access_get_entries(funct, srcIp)
 
@@ -96,7 +584,7 @@ class DpReadClass(threading.Thread):
 						None if no such flows exist.
 		"""
 		funct = self.dpctl.copy_and_reset_src_flows_by_ip
-		return self.lock_access_get_entries(funct, srcIp)
+		return self.lock_access_reset_entries(funct, srcIp)
 
 	def get_entries_by_dst_ip(self, dstIp):
 		"""
@@ -106,6 +594,8 @@ class DpReadClass(threading.Thread):
 		return:			Flow entries with this IP address as the source;
 						None if no such flows exist.
 		"""
+		if self.rcu:
+			return self.snapshot.get_dst_flows_by_ip(dstIp)
 		funct = self.dpctl.get_dst_flows_by_ip
 		return self.lock_access_get_entries(funct, dstIp)
 
@@ -117,6 +607,8 @@ class DpReadClass(threading.Thread):
 		return:			Flow entries with this IP address as the source;
 						None if no such flows exist.
 		"""
+		if self.rcu:
+			return self.snapshot.get_dst_flows_by_ip(dstIp)
 		funct = self.dpctl.copy_dst_flows_by_ip
 		return self.lock_access_get_entries(funct, dstIp)
 
@@ -129,7 +621,319 @@ class DpReadClass(threading.Thread):
 						None if no such flows exist.
 		"""
 		funct = self.dpctl.copy_and_reset_dst_flows_by_ip
-		return self.lock_access_get_entries(funct, dstIp)
+		return self.lock_access_reset_entries(funct, dstIp)
+
+	def get_entries_by_ips(self, ipaddrs):
+		"""
+		Retrieve the source and destination entries, and the MAC address, of
+		each of a number of IP addresses, under one acquisition of the lock
+		(or from one snapshot, in read-copy-update mode).
+
+		param ipaddrs:	IP addresses of flows to retrieve.
+		return:			{ip: (src entries, dst entries, MAC address)}; entries
+						are None if no such flows exist, and the MAC address
+						None if it is not known.
+		"""
+		results = dict()
+		if self.rcu:
+			snapshot = self.snapshot
+			for ipaddr in ipaddrs:
+				results[ipaddr] = (snapshot.get_src_flows_by_ip(ipaddr),
+								   snapshot.get_dst_flows_by_ip(ipaddr),
+								   snapshot.get_mac_by_ip(ipaddr))
+			return results
+		self.lock.acquire()
+		try:
+			for ipaddr in ipaddrs:
+				results[ipaddr] = (self.dpctl.copy_src_flows_by_ip(ipaddr),
+								   self.dpctl.copy_dst_flows_by_ip(ipaddr),
+								   self.dpctl.get_mac_by_ip(ipaddr))
+		finally:
+			self.lock.release()
+		return results
+
+	def copy_and_reset_entries_by_ips(self, ipaddrs, rates=False):
+		"""
+		Retrieve copies of the source and destination entries, and the MAC
+		address, of each of a number of IP addresses and reset their flows,
+		under one acquisition of the lock.
+
+		param ipaddrs:	IP addresses of flows to retrieve.
+		param rates:	Whether to also retrieve the throughput rates of the
+						source and destination flows of each IP address, as
+						get_rates_by_src_ip and get_rates_by_dst_ip would.
+		return:			{ip: (src entries, dst entries, MAC address)}, with
+						(src rates, dst rates) appended if asked for; entries
+						and rates are None if no such flows exist, and the
+						MAC address None if it is not known.
+		"""
+		results = dict()
+		self.lock.acquire()
+		try:
+			for ipaddr in ipaddrs:
+				results[ipaddr] = (self.dpctl.copy_and_reset_src_flows_by_ip(ipaddr),
+								   self.dpctl.copy_and_reset_dst_flows_by_ip(ipaddr),
+								   self.dpctl.get_mac_by_ip(ipaddr))
+				if rates:
+					results[ipaddr] += (self.dpctl.get_src_rates_by_ip(ipaddr),
+										self.dpctl.get_dst_rates_by_ip(ipaddr))
+				if self.rcu:
+					self.dirty.add(ipaddr)
+		finally:
+			self.lock.release()
+		return results
+
+
+class BridgeStats(object):
+	"""
+	Timing of the polls of one bridge by a MultiBridgeReadClass.
+	"""
+	__slots__ = ('interval', 'polls', 'seconds', 'last_seconds', 'max_seconds', 'last_poll',
+				 'due')
+
+	def __init__(self, interval):
+		"""
+		param interval:	Seconds between polls of the bridge.
+		"""
+		self.interval = interval
+		self.polls = 0
+		self.seconds = 0.0
+		self.last_seconds = 0.0
+		self.max_seconds = 0.0
+		self.last_poll = None
+		self.due = 0.0
+
+	def add_poll(self, seconds, stats):
+		"""
+		Count a poll of the bridge.
+
+		param seconds:	Time taken to parse and apply the dump.
+		param stats:	dpctl.PollStats of the dump.
+		"""
+		self.polls += 1
+		self.seconds += seconds
+		self.last_seconds = seconds
+		self.max_seconds = max(self.max_seconds, seconds)
+		self.last_poll = stats
+
+	def as_dict(self):
+		"""
+		return:	Dictionary of the interval, polls taken, mean, last and
+				longest seconds per poll and PollStats of the last poll.
+		"""
+		mean = 0.0
+		if self.polls:
+			mean = self.seconds / self.polls
+		return {'interval': self.interval,
+				'polls': self.polls,
+				'mean_seconds': mean,
+				'last_seconds': self.last_seconds,
+				'max_seconds': self.max_seconds,
+				'last_poll': self.last_poll}
+
+class MultiBridgeReadClass(DpReadClass):
+	"""
+	Class polling several bridges from one thread into one flowset.
+
+	Each bridge has its own dpctl.DpCtl, holding only what is needed to tell
+	which of its datapath flows changed between polls; the flowset, and any
+	heavy-hitter tracker and history, are shared, so an IP address and its
+	MAC address are held once however many bridges carry its traffic. The
+	queries of DpReadClass answer for all bridges at once: each flow's count
+	is the sum of what its datapath flows moved on every bridge (see the
+	shared argument of dpctl.DpCtl). get_bridge_by_ip tells which bridge
+	last carried traffic from an IP address, and get_bridges_by_flow which
+	bridges carried a flow.
+
+	Each bridge is polled at its own interval. The dumps of all bridges due
+	are started before any is read: the dump commands of a
+	flow_source.SubprocessFlowSource run at once, and the requests of a
+	flow_source.UnixctlFlowSource are all sent to ovs-vswitchd. The dumps
+	are then parsed and applied one bridge at a time, after which expired
+	flows are evicted once for all.
+	"""
+
+	def __init__(self, bridges, interval=1, intervals=None, flows=None, sources=None,
+				 batch_size=BATCH_SIZE, rcu=False, heavy_hitters=None, history=None,
+				 store=None, store_interval=STORE_INTERVAL, metrics=None, parser=None):
+		"""
+		Initialise the poller.
+
+		param bridges:			Bridges to poll.
+		param interval:			Polling interval of bridges not in intervals.
+		param intervals:		{bridge: polling interval}.
+		param flows:			Flowset backend to use; see dpctl.DpCtl.
+		param sources:			{bridge: flow source}; the default source is
+								used for other bridges.
+		param batch_size:		Maximum number of flows applied per lock acquisition.
+		param rcu:				Answer queries from published snapshots.
+		param heavy_hitters:	Heavy-hitter tracker; see dpctl.DpCtl.
+		param history:			Throughput history; see dpctl.DpCtl.
+		param store:			Path of the file to keep the flowset in.
+		param store_interval:	Seconds between saves to the store.
+		param metrics:			Poller instrumentation; see DpReadClass.
+		param parser:			Parser shared by the bridges; see DpReadClass.
+		"""
+		if intervals is None:
+			intervals = dict()
+		if sources is None:
+			sources = dict()
+		self.bridges = list(bridges)
+		self.ctls = dict()
+		self.bridge_stats = dict()
+		# Bridge that last carried traffic from each IP address; guarded by lock.
+		self.ip_bridges = dict()
+		# {src ip: {dst ip: set of bridges that carried the flow}}; guarded by lock.
+		self.flow_bridges = dict()
+		first = self.bridges[0]
+		super(MultiBridgeReadClass, self).__init__(interval, first, flows, sources.get(first),
+												   batch_size, rcu, heavy_hitters,
+												   history=history, store=store,
+												   store_interval=store_interval,
+												   metrics=metrics, parser=parser)
+		self.dpctl.shared = True
+		for bridge in self.bridges:
+			ctl = self.dpctl
+			if bridge != first:
+				ctl = dpctl.DpCtl(bridge, self.dpctl.flows, sources.get(bridge),
+								  heavy_hitters, history, parser, shared=True)
+			self.ctls[bridge] = ctl
+			self.bridge_stats[bridge] = BridgeStats(intervals.get(bridge, interval))
+
+	def run(self):
+		"""
+		Continually poll each bridge as it falls due.
+		"""
+		while self.doLoop:
+			now = time.time()
+			due = [bridge for bridge in self.bridges if self.bridge_stats[bridge].due <= now]
+			if due:
+				self.poll_bridges(due)
+			self.save_if_due()
+			wait = min([stats.due for stats in self.bridge_stats.itervalues()]) - time.time()
+			if wait > 0:
+				time.sleep(wait)
+		if self.store is not None:
+			self.save()
+		for ctl in self.ctls.itervalues():
+			ctl.close()
+
+	def poll(self):
+		"""
+		Poll every bridge; see poll_bridges.
+
+		return:	{bridge: dpctl.PollStats}.
+		"""
+		return self.poll_bridges(self.bridges)
+
+	def poll_bridges(self, bridges):
+		"""
+		Take a dump of each of the given bridges and apply them to the flow
+		data, then evict expired flows. Each bridge is next due its interval
+		after the poll started.
+
+		param bridges:	Bridges to poll.
+		return:			{bridge: dpctl.PollStats}.
+		"""
+		metrics = self.metrics
+		if metrics is not None:
+			metrics.begin_poll()
+		started = time.time()
+		# Start every dump before reading any.
+		dumps = [(bridge, self.start_dump(self.ctls[bridge])) for bridge in bridges]
+		results = dict()
+		for bridge, lines in dumps:
+			start = time.time()
+			stats = self.ingest(self.ctls[bridge], lines, bridge)
+			timing = self.bridge_stats[bridge]
+			timing.add_poll(time.time() - start, stats)
+			timing.due = started + timing.interval
+			results[bridge] = stats
+		evicted = set()
+		self.evict(evicted)
+		self.acquire()
+		try:
+			for ipaddr in evicted:
+				if self.dpctl.get_mac_by_ip(ipaddr) is None:
+					self.ip_bridges.pop(ipaddr, None)
+				peers = self.flow_bridges.get(ipaddr)
+				if peers is None:
+					continue
+				for peer in peers.keys():
+					if self.dpctl.flows.get_flow_bytes(ipaddr, peer) is None:
+						del peers[peer]
+				if not peers:
+					del self.flow_bridges[ipaddr]
+			if self.rcu:
+				self.dirty.update(evicted)
+		finally:
+			self.release()
+		if self.rcu:
+			self.publish()
+		if metrics is not None:
+			metrics.end_poll(self.dpctl.get_eviction_stats())
+		return results
+
+	def tag_entries(self, entries, tag):
+		"""
+		Record the bridge that carried each of a batch of flow entries.
+
+		param entries:	List of dpctl.FlowEntry objects.
+		param tag:		Bridge the entries were dumped from.
+		"""
+		ip_bridges = self.ip_bridges
+		flow_bridges = self.flow_bridges
+		for entry in entries:
+			ip_bridges[entry.srcIp] = tag
+			peers = flow_bridges.get(entry.srcIp)
+			if peers is None:
+				peers = flow_bridges[entry.srcIp] = dict()
+			bridges = peers.get(entry.dstIp)
+			if bridges is None:
+				bridges = peers[entry.dstIp] = set()
+			bridges.add(tag)
+
+	def get_bridges_by_flow(self, srcIp, dstIp):
+		"""
+		Get the bridges that carried the flow from srcIp to dstIp.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		return:			Set of bridge names; None if the flow is not held.
+		"""
+		self.lock.acquire()
+		try:
+			bridges = self.flow_bridges.get(srcIp, dict()).get(dstIp)
+			if bridges is None:
+				return None
+			return set(bridges)
+		finally:
+			self.lock.release()
+
+	def get_bridge_by_ip(self, ipaddr):
+		"""
+		Get the bridge that last carried traffic from an IP address.
+
+		param ipaddr:	IP address.
+		return:			Bridge name; None if no traffic from it is held.
+		"""
+		self.lock.acquire()
+		try:
+			return self.ip_bridges.get(ipaddr)
+		finally:
+			self.lock.release()
+
+	def get_bridge_stats(self):
+		"""
+		Get the polling interval and timing of each bridge.
+
+		return:	{bridge: dictionary of counts, as BridgeStats.as_dict}.
+		"""
+		stats = dict()
+		for bridge, timing in self.bridge_stats.iteritems():
+			stats[bridge] = timing.as_dict()
+		return stats
+
 """
 thread = DpReadClass()
 thread.start()
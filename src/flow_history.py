@@ -0,0 +1,190 @@
+from array import array
+import collections
+
+"""
+Throughput history of flows, in fixed-size ring buffers at several
+resolutions; an optional companion to the flowset.
+"""
+
+# (Seconds per bucket, buckets kept, array typecode) of each resolution. The
+# 1s buckets are 32-bit, saturating at 4 GiB/s per pair; coarser ones are
+# doubles, exact up to 2**53 bytes.
+LEVELS = ((1, 300, 'I'), (10, 60, 'd'), (60, 60, 'd'))
+# Most pairs tracked.
+MAX_PAIRS = 4096
+# Largest value of an 'I' bucket.
+MAX_UINT = 0xffffffff
+
+def pair_bytes(levels=LEVELS):
+	"""
+	Get the bytes of bucket storage each tracked pair takes.
+
+	param levels:	Resolutions, as LEVELS.
+	return:			Bytes per pair, not counting per-object overheads (about
+					60 bytes per array, plus the pair's key and record).
+	"""
+	return sum([size * array(typecode).itemsize for seconds, size, typecode in levels]) \
+		+ len(levels) * array('l').itemsize
+
+class PairHistory(object):
+	"""
+	Class representing the history of one (src, dst) pair: for each
+	resolution, a ring of byte counts and the number of the newest bucket
+	written.
+	"""
+	__slots__ = ('buckets', 'marks')
+
+	def __init__(self, levels):
+		self.buckets = [array(typecode, [0]) * size for seconds, size, typecode in levels]
+		self.marks = array('l', [-1] * len(levels))
+
+class FlowHistory(object):
+	"""
+	Class keeping the recent throughput of each (src, dst) pair.
+
+	Bytes are added to the current bucket of every resolution at once, so
+	the coarse rings are rollups of the fine one that reach further back.
+	Buckets skipped while a pair is idle are cleared when it is next
+	written, so idle pairs are never visited; pairs idle for longer than the
+	coarsest ring covers are dropped by tick(). At most max_pairs pairs are
+	tracked; a new pair beyond them evicts the one least recently written,
+	counted in evicted. Pairs are kept in the order they were last written,
+	so that eviction and tick() only visit the oldest.
+
+	Memory is bounded by max_pairs * pair_bytes(levels), plus per-pair
+	overheads: about 2.6 KiB per pair with the default levels.
+	"""
+
+	def __init__(self, levels=LEVELS, max_pairs=MAX_PAIRS):
+		"""
+		Initialise an empty history.
+
+		param levels:		(Seconds per bucket, buckets kept, array typecode)
+							of each resolution, finest first.
+		param max_pairs:	Most pairs tracked.
+		"""
+		self.levels = levels
+		self.max_pairs = max_pairs
+		# {(src, dst): PairHistory}, least recently written first.
+		self.pairs = collections.OrderedDict()
+		self.evicted = 0
+		self.now = 0
+		self._pruned = None
+
+	def tick(self, now):
+		"""
+		Set the time at which subsequent traffic is taken to be seen, and
+		drop pairs with no traffic left in any ring, once per coarsest bucket.
+
+		param now:	Time in seconds since the epoch.
+		"""
+		self.now = now
+		seconds, size, typecode = self.levels[-1]
+		bucket = int(now // seconds)
+		if bucket == self._pruned:
+			return
+		self._pruned = bucket
+		oldest = bucket - size
+		last = len(self.levels) - 1
+		stale = []
+		for key, pair in self.pairs.iteritems():
+			if pair.marks[last] > oldest:
+				break
+			stale.append(key)
+		for key in stale:
+			del self.pairs[key]
+
+	def add(self, srcIp, dstIp, bytes):
+		"""
+		Count bytes sent from srcIp to dstIp since the last reading.
+
+		param srcIp:	Source IP address.
+		param dstIp:	Destination IP address.
+		param bytes:	Number of bytes.
+		"""
+		key = (srcIp, dstIp)
+		pair = self.pairs.get(key)
+		now = self.now
+		if pair is None:
+			if len(self.pairs) >= self.max_pairs:
+				self.pairs.popitem(last=False)
+				self.evicted += 1
+			pair = self.pairs[key] = PairHistory(self.levels)
+		elif pair.marks[0] != int(now // self.levels[0][0]):
+			# First write of the pair this bucket; move it to the end.
+			del self.pairs[key]
+			self.pairs[key] = pair
+		for i, (seconds, size, typecode) in enumerate(self.levels):
+			ring = pair.buckets[i]
+			bucket = int(now // seconds)
+			mark = pair.marks[i]
+			if bucket != mark:
+				# Clear the buckets skipped since the last write.
+				if mark < 0:
+					mark = bucket - 1
+				for skipped in xrange(max(mark + 1, bucket - size + 1), bucket + 1):
+					ring[skipped % size] = 0
+				pair.marks[i] = bucket
+			slot = bucket % size
+			if typecode == 'I':
+				ring[slot] = min(ring[slot] + bytes, MAX_UINT)
+			else:
+				ring[slot] += bytes
+
+	def level_for(self, seconds):
+		"""
+		Find the finest resolution covering a period.
+
+		param seconds:	Length of the period.
+		return:			Index into levels; the coarsest if none covers it.
+		"""
+		for i, (resolution, size, typecode) in enumerate(self.levels):
+			if resolution * size >= seconds:
+				return i
+		return len(self.levels) - 1
+
+	def get_samples(self, srcIp, dstIp, level=0, count=None):
+		"""
+		Get the bytes per bucket of a pair at one resolution, oldest first,
+		ending with the bucket of the last tick.
+
+		param srcIp:	Source IP address.
+		param dstIp:	Destination IP address.
+		param level:	Index into levels of the resolution.
+		param count:	Number of buckets; all that are kept if None.
+		return:			List of byte counts; None if the pair is not tracked.
+		"""
+		pair = self.pairs.get((srcIp, dstIp))
+		if pair is None:
+			return None
+		seconds, size, typecode = self.levels[level]
+		if count is None or count > size:
+			count = size
+		ring = pair.buckets[level]
+		mark = pair.marks[level]
+		bucket = int(self.now // seconds)
+		samples = []
+		for b in xrange(bucket - count + 1, bucket + 1):
+			if mark - size < b <= mark:
+				samples.append(ring[b % size])
+			else:
+				samples.append(0)
+		return samples
+
+	def get_rate(self, srcIp, dstIp, seconds):
+		"""
+		Get the average rate of a pair over the last seconds, from the finest
+		resolution covering them, rounded up to whole buckets.
+
+		param srcIp:	Source IP address.
+		param dstIp:	Destination IP address.
+		param seconds:	Length of the period.
+		return:			Bytes/sec; None if the pair is not tracked.
+		"""
+		level = self.level_for(seconds)
+		resolution, size, typecode = self.levels[level]
+		count = min(max(1, -(-int(seconds) // resolution)), size)
+		samples = self.get_samples(srcIp, dstIp, level, count)
+		if samples is None:
+			return None
+		return float(sum(samples)) / (count * resolution)
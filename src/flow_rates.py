@@ -0,0 +1,95 @@
+import math
+
+"""
+Exponentially weighted throughput rates of flows, kept as polls arrive.
+
+Each reading of a flow's byte count gives its average rate over the interval
+since the previous reading, which is folded into each rate with weight
+1 - exp(-interval/tau), so that a steady flow of r bytes/sec reads r however
+irregular the polls. The first reading of a flow is only a baseline, as the
+interval its bytes accumulated over is unknown, and the first interval
+after it sets the rates outright. An interval without new bytes averages zero, which
+only decays the rates; a rate is therefore brought up to date whenever it
+is read, and flows that see no new bytes are never visited. The state of a
+flow's rates is a list [time of last update, length of the interval ending
+then (negative for the first interval, zero before it), rate per time
+constant].
+"""
+
+# Time constants, in seconds, of the rates kept per flow.
+RATE_WINDOWS = (10.0, 60.0, 300.0)
+
+def new_rates(windows, now):
+	"""
+	Create the rate state of a flow with no bytes seen yet.
+
+	param windows:	Time constants of the rates, in seconds.
+	param now:		Time of creation, in seconds since the epoch.
+	return:			Rate state.
+	"""
+	rates = [0.0] * (len(windows) + 2)
+	rates[0] = now
+	return rates
+
+def add_bytes(rates, windows, now, bytes):
+	"""
+	Add bytes seen at the given time to a flow's rates. Bytes seen again at
+	the time of the last update are taken to belong to the same interval;
+	if there is none yet, as when the flow is first seen, they are ignored.
+
+	param rates:	Rate state, updated in place.
+	param windows:	Time constants of the rates, in seconds.
+	param now:		Time the bytes were seen, in seconds since the epoch.
+	param bytes:	Number of bytes seen since the last update.
+	"""
+	elapsed = float(now - rates[0])
+	i = 2
+	if elapsed > 0:
+		rate = float(bytes) / elapsed
+		if rates[1] == 0:
+			rates[2:] = [rate] * len(windows)
+			elapsed = 0 - elapsed
+		else:
+			for window in windows:
+				keep = math.exp(-elapsed / window)
+				rates[i] = rates[i] * keep + (1 - keep) * rate
+				i += 1
+		rates[0] = now
+		rates[1] = elapsed
+	elif rates[1] < 0:
+		rate = float(bytes) / (0 - rates[1])
+		for window in windows:
+			rates[i] += rate
+			i += 1
+	elif rates[1] > 0:
+		interval = rates[1]
+		rate = float(bytes) / interval
+		for window in windows:
+			rates[i] += (1 - math.exp(-interval / window)) * rate
+			i += 1
+
+def current_rates(rates, windows, now):
+	"""
+	Get a flow's rates as of the given time.
+
+	param rates:	Rate state.
+	param windows:	Time constants of the rates, in seconds.
+	param now:		Time to read the rates at, in seconds since the epoch.
+	return:			Tuple of rates in bytes/sec, one per time constant.
+	"""
+	return decay(rates[2:], windows, now - rates[0])
+
+def decay(values, windows, elapsed):
+	"""
+	Decay rates over a period in which no bytes were seen.
+
+	param values:	Rates in bytes/sec, one per time constant.
+	param windows:	Time constants of the rates, in seconds.
+	param elapsed:	Length of the period, in seconds.
+	return:			Tuple of decayed rates.
+	"""
+	if elapsed <= 0:
+		return tuple(values)
+	elapsed = float(elapsed)
+	return tuple([value * math.exp(-elapsed / window)
+				  for value, window in zip(values, windows)])
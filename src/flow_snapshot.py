@@ -0,0 +1,197 @@
+"""
+Immutable, published views of a flowset, for reading without a lock.
+"""
+
+import flow_rates
+import traffic_matrix
+
+class FlowSnapshot(object):
+	"""
+	Class representing the flow data of a flowset at one point in time.
+
+	A snapshot is never modified once built; a newer one is derived from it
+	and published in its place. Entries are held as
+	[mac, {peer ip: [bytes, offset]}, datetime], as returned by the flowset
+	accessors, and the accessors here hand out copies of them.
+
+	If the flowset keeps rates, they are held per IP address as
+	(time read, {peer ip: rates}). An IP address that is not refreshed has
+	seen no new bytes, so its rates are only decayed to the snapshot's time
+	when read.
+	"""
+
+	def __init__(self, src=None, dst=None, generation=0, src_rates=None,
+				 dst_rates=None, windows=None, now=0):
+		"""
+		Initialise a snapshot.
+
+		param src:			Entries by source IP address.
+		param dst:			Entries by destination IP address.
+		param generation:	Number of snapshots published before this one.
+		param src_rates:	Rates by source IP address.
+		param dst_rates:	Rates by destination IP address.
+		param windows:		Time constants of the rates, in seconds.
+		param now:			Time of the poll the snapshot reflects.
+		"""
+		if src is None:
+			src = dict()
+		if dst is None:
+			dst = dict()
+		if src_rates is None:
+			src_rates = dict()
+		if dst_rates is None:
+			dst_rates = dict()
+		self.src = src
+		self.dst = dst
+		self.generation = generation
+		self.src_rates = src_rates
+		self.dst_rates = dst_rates
+		self.windows = windows
+		self.now = now
+
+	def derive(self, windows=None, now=0):
+		"""
+		Start the next snapshot, sharing every entry with this one. It may be
+		refreshed until it is published.
+
+		param windows:	Time constants of the flowset's rates; None if it
+						keeps none.
+		param now:		Time of the poll the new snapshot reflects.
+		return:			The new FlowSnapshot.
+		"""
+		return FlowSnapshot(dict(self.src), dict(self.dst), self.generation + 1,
+							dict(self.src_rates), dict(self.dst_rates), windows, now)
+
+	def refresh(self, flows, ips):
+		"""
+		Re-read the entries of some IP addresses from the flowset. Only used
+		on a snapshot that has not been published yet.
+
+		param flows:	The flowset the snapshot is of.
+		param ips:		IP addresses whose entries may have changed.
+		"""
+		for ipaddr in ips:
+			for entries, get_flows in ((self.src, flows.get_src_flows_by_ip),
+									   (self.dst, flows.get_dst_flows_by_ip)):
+				flow = get_flows(ipaddr)
+				if flow is None:
+					entries.pop(ipaddr, None)
+				else:
+					entries[ipaddr] = flow
+			if self.windows is None:
+				continue
+			for rates, get_rates in ((self.src_rates, flows.get_src_rates_by_ip),
+									 (self.dst_rates, flows.get_dst_rates_by_ip)):
+				peers = get_rates(ipaddr)
+				if peers is None:
+					rates.pop(ipaddr, None)
+				else:
+					rates[ipaddr] = (self.now, peers)
+
+	def view_rates(self, stamped):
+		"""
+		Bring the rates of an IP address up to the snapshot's time.
+
+		param stamped:	(time read, {peer: rates}), or None.
+		return:			{peer: tuple of rates in bytes/sec}; None if stamped
+						is None.
+		"""
+		if stamped is None:
+			return None
+		read, peers = stamped
+		if read == self.now:
+			return dict(peers)
+		elapsed = self.now - read
+		rates = dict()
+		for peer, values in peers.iteritems():
+			rates[peer] = flow_rates.decay(values, self.windows, elapsed)
+		return rates
+
+	def export_matrix(self, window=None):
+		"""
+		Export the flows of the src view as a sparse traffic matrix.
+
+		param window:	Index of the rate window to export; None for the bytes
+						counted since each flow was last reset.
+		return:			traffic_matrix.TrafficMatrix; None if a rate window is
+						asked for and no rates are kept.
+		"""
+		if window is None:
+			rows = [(ipaddr, [(peer, flow[0] + flow[1]) for peer, flow in entries[1].iteritems()])
+					for ipaddr, entries in self.src.iteritems()]
+		elif self.windows is None:
+			return None
+		else:
+			rows = [(ipaddr, [(peer, rates[window]) for peer, rates in
+							  self.view_rates(stamped).iteritems()])
+					for ipaddr, stamped in self.src_rates.iteritems()]
+		return traffic_matrix.build_matrix(rows)
+
+	def get_src_rates_by_ip(self, srcIp):
+		"""
+		Get the throughput rates of the flows from the given src IP address.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			{dst ip: tuple of rates in bytes/sec}; None if no such
+						flows exist or no rates are kept.
+		"""
+		return self.view_rates(self.src_rates.get(srcIp))
+
+	def get_dst_rates_by_ip(self, dstIp):
+		"""
+		Get the throughput rates of the flows to the given dst IP address.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			{src ip: tuple of rates in bytes/sec}; None if no such
+						flows exist or no rates are kept.
+		"""
+		return self.view_rates(self.dst_rates.get(dstIp))
+
+	def copy_entries(self, entries):
+		"""
+		Copy an entry, so that callers cannot modify the snapshot.
+
+		param entries:	[mac, {peer: [bytes, offset]}, datetime], or None.
+		return:			A copy of the entry; None if entries is None.
+		"""
+		if entries is None:
+			return None
+		flows = dict()
+		for peer, flow in entries[1].iteritems():
+			flows[peer] = [flow[0], flow[1]]
+		return [entries[0], flows, entries[2]]
+
+	def get_src_flows_by_ip(self, srcIp):
+		"""
+		Get src flows corresponding to the given src IP address.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			A copy of the flow entries with this IP address as the
+						source; None if no such flows exist.
+		"""
+		return self.copy_entries(self.src.get(srcIp))
+
+	def get_dst_flows_by_ip(self, dstIp):
+		"""
+		Get dst flows corresponding to the given dst IP address.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			A copy of the flow entries with this IP address as the
+						destination; None if no such flows exist.
+		"""
+		return self.copy_entries(self.dst.get(dstIp))
+
+	def get_mac_by_ip(self, ipaddr):
+		"""
+		Retrieve the MAC address corresponding to the given IP address.
+
+		param ipaddr:	IP address linked to the desired MAC address.
+		return:			The MAC address linked to the given IP address;
+						None otherwise.
+		"""
+		entries = self.src.get(ipaddr)
+		if entries is None:
+			entries = self.dst.get(ipaddr)
+		if entries is None:
+			return None
+		return entries[0]
@@ -0,0 +1,671 @@
+import errno
+import glob
+import gzip
+import json
+import os
+import re
+import socket
+import subprocess as sub
+import sys
+import time
+
+"""
+Sources of datapath flow dumps for DpCtl.
+
+A flow source has a dump() method returning an iterable over the lines of a
+'ovs-dpctl dump-flows' listing, which may be a generator that can only be
+consumed once, and a close() method releasing anything it holds open. A
+source replaying recorded dumps also has a now() method giving the time its
+last dump was taken at, which DpCtl takes as the time of the poll.
+
+Traces of recorded dumps are gzip-compressed text: a TRACE_MAGIC line, then
+per dump a 'dump <time> <lines>' line followed by the lines of the dump.
+"""
+
+OVS_RUNDIR = '/var/run/openvswitch'
+RECV_BUF_SIZE = 65536
+
+# First line of a trace file, naming its format version.
+TRACE_MAGIC = 'plan-dump-trace 1\n'
+
+# JSON whitespace, skipped between the tokens of a unixctl reply.
+JSON_SPACE_RE = re.compile(r'[ \t\n\r]*')
+
+class UnixctlError(Exception):
+	"""
+	Raised when ovs-vswitchd answers a unixctl request with an error.
+	"""
+
+class SubprocessFlowSource(object):
+	"""
+	Flow source running 'ovs-dpctl dump-flows' in a child process per dump.
+	"""
+
+	def __init__(self, bridge, command=None):
+		"""
+		Initialise the flow source.
+
+		param bridge:	The network bridge to dump datapath flows for.
+		param command:	Argument list to run instead of
+						['ovs-dpctl', 'dump-flows', bridge].
+		"""
+		self.bridge = bridge
+		if command is None:
+			command = ['ovs-dpctl', 'dump-flows', bridge]
+		self.command = command
+
+	def dump(self):
+		"""
+		Run the dump command, without a shell, and stream its output. The
+		command is started before this returns, so that the dumps of several
+		sources run at once, and reaped once the dump is consumed, closed or
+		dropped; a dump stopped early, or never read, kills it.
+
+		return:	Generator of the lines of output as they arrive from the pipe;
+				empty if the command could not be run.
+		"""
+		lines = self.run()
+		try:
+			lines.next()
+		except StopIteration:
+			return iter([])
+		return lines
+
+	def run(self):
+		"""
+		Start the dump command, yielding None once it is running, then each
+		line of its output.
+		"""
+		devnull = open(os.devnull, 'w')
+		try:
+			proc = sub.Popen(self.command, stdout=sub.PIPE, stderr=devnull)
+		except OSError:
+			return
+		finally:
+			devnull.close()
+		try:
+			yield None
+			for line in proc.stdout:
+				yield line
+		except GeneratorExit:
+			proc.kill()
+			raise
+		finally:
+			proc.stdout.close()
+			proc.wait()
+
+	def close(self):
+		"""
+		Nothing is held open between dumps.
+		"""
+		pass
+
+def find_unixctl_path(rundir=OVS_RUNDIR):
+	"""
+	Locate the unixctl socket of the running ovs-vswitchd.
+
+	param rundir:	Open vSwitch run directory.
+	return:			Path of the control socket; None if there isn't one.
+	"""
+	try:
+		f = open(os.path.join(rundir, 'ovs-vswitchd.pid'), 'r')
+		try:
+			pid = f.read().strip()
+		finally:
+			f.close()
+		path = os.path.join(rundir, 'ovs-vswitchd.' + pid + '.ctl')
+		if os.path.exists(path):
+			return path
+	except IOError:
+		pass
+	paths = glob.glob(os.path.join(rundir, 'ovs-vswitchd.*.ctl'))
+	if paths:
+		return paths[0]
+	return None
+
+def find_unescaped(data, text, start=0):
+	"""
+	Find the first occurrence of text in the body of a JSON string that is
+	not itself escaped, i.e. not preceded by an odd number of backslashes.
+
+	param data:		Body of a JSON string, starting outside any escape.
+	param text:		Text to find; starts with a quote or a backslash.
+	param start:	Index to search from.
+	return:			Index of the text; -1 if it does not occur.
+	"""
+	index = data.find(text, start)
+	while index >= 0:
+		escape = index
+		while escape > 0 and data[escape - 1] == '\\':
+			escape -= 1
+		if (index - escape) % 2 == 0:
+			return index
+		index = data.find(text, index + 1)
+	return -1
+
+def find_last_line_end(data):
+	"""
+	Find the end of the last complete line in the body of a JSON string.
+
+	param data:	Body of a JSON string, starting outside any escape.
+	return:		Index just past the last escaped newline; 0 if there is none.
+	"""
+	index = data.rfind('\\n')
+	while index >= 0:
+		escape = index
+		while escape > 0 and data[escape - 1] == '\\':
+			escape -= 1
+		if (index - escape) % 2 == 0:
+			return index + 2
+		index = data.rfind('\\n', 0, index)
+	return 0
+
+class UnixctlFlowSource(object):
+	"""
+	Flow source requesting 'dpctl/dump-flows' from ovs-vswitchd over its
+	unixctl JSON-RPC socket. The connection is kept open between dumps and
+	re-established after a failure; while the socket is unavailable, dumps
+	are taken from the fallback source, if one is given.
+
+	The dump is streamed: lines are decoded from the reply's result string
+	as it is received, a block at a time, so a dump is never held whole.
+	Only a failure before the result starts is answered from the fallback;
+	one part way through closes the connection and is raised to the reader,
+	as the lines already read cannot be taken back. A dump abandoned part
+	way through also closes the connection, which the next dump re-opens, as
+	does one never read.
+
+	The request is sent when the dump is started and the reply read as its
+	lines are, so the dumps of several bridges are requested before any is
+	read; ovs-vswitchd answers them in turn, without waiting on the reader.
+	"""
+
+	def __init__(self, bridge, path=None, fallback=None, timeout=5.0):
+		"""
+		Initialise the flow source. No connection is made until the first dump.
+
+		param bridge:	The network bridge (datapath) to dump flows for.
+		param path:		Path of the unixctl socket; found under OVS_RUNDIR if None.
+		param fallback:	Flow source to use when the socket cannot be used.
+		param timeout:	Socket timeout in seconds.
+		"""
+		self.bridge = bridge
+		self.path = path
+		self.fallback = fallback
+		self.timeout = timeout
+		self.sock = None
+		self.chunks = []
+		self.request_id = 0
+		# Whether a request was sent whose reply has not been read whole.
+		self.pending = False
+		self.decoder = json.JSONDecoder()
+
+	def connect(self):
+		"""
+		Open the connection to ovs-vswitchd.
+		"""
+		path = self.path
+		if path is None:
+			path = find_unixctl_path()
+		if path is None:
+			raise socket.error(errno.ENOENT, 'ovs-vswitchd control socket not found')
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout(self.timeout)
+		try:
+			sock.connect(path)
+		except socket.error:
+			sock.close()
+			raise
+		self.sock = sock
+		self.chunks = []
+
+	def close(self):
+		"""
+		Close the connection to ovs-vswitchd, if open.
+		"""
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+		self.chunks = []
+		self.pending = False
+
+	def receive(self, data):
+		"""
+		Receive more of a reply.
+
+		param data:	Data of the reply received so far.
+		return:		The data followed by what was received.
+		"""
+		chunk = self.sock.recv(RECV_BUF_SIZE)
+		if not chunk:
+			raise socket.error(errno.ECONNRESET, 'connection closed by ovs-vswitchd')
+		return data + chunk
+
+	def skip_space(self, data, pos):
+		"""
+		Skip whitespace in a reply, receiving more until a token follows.
+
+		return:	(data, index of the token).
+		"""
+		while True:
+			pos = JSON_SPACE_RE.match(data, pos).end()
+			if pos < len(data):
+				return data, pos
+			data = self.receive(data)
+
+	def read_value(self, data, pos):
+		"""
+		Decode a JSON value of a reply, receiving more until the token after
+		it has arrived, so that a number is known to be whole.
+
+		return:	(data, value, index of the token after it).
+		"""
+		while True:
+			try:
+				value, end = self.decoder.raw_decode(data, pos)
+			except ValueError:
+				end = None
+			if end is not None:
+				end = JSON_SPACE_RE.match(data, end).end()
+				if end < len(data):
+					return data, value, end
+			data = self.receive(data)
+
+	def read_members(self, data, pos, reply):
+		"""
+		Read the members of a reply object up to a text result, or its end.
+
+		param data:		Data of the reply received so far.
+		param pos:		Index of the first member, or of the ',' or '}'
+						following the last one read.
+		param reply:	Dictionary to add the members read to.
+		return:			The data following the opening quote of the result;
+						None if the reply has no text result, in which case
+						it has been read whole.
+		"""
+		data, pos = self.skip_space(data, pos)
+		if data[pos] in ',}':
+			if data[pos] == '}':
+				self.chunks = [data[pos + 1:]]
+				return None
+			data, pos = self.skip_space(data, pos + 1)
+		while True:
+			data, key, pos = self.read_value(data, pos)
+			if data[pos] != ':':
+				raise ValueError('malformed unixctl reply')
+			data, pos = self.skip_space(data, pos + 1)
+			if key == 'result' and data[pos] == '"':
+				self.check_reply(reply)
+				return data[pos + 1:]
+			data, reply[key], pos = self.read_value(data, pos)
+			if data[pos] == '}':
+				self.chunks = [data[pos + 1:]]
+				return None
+			if data[pos] != ',':
+				raise ValueError('malformed unixctl reply')
+			data, pos = self.skip_space(data, pos + 1)
+
+	def check_reply(self, reply):
+		"""
+		Raise if the members of a reply read so far show it to be an error, or
+		to answer another request.
+		"""
+		if reply.get('error') is not None:
+			raise UnixctlError(reply['error'])
+		if reply.get('id', self.request_id) != self.request_id:
+			raise ValueError('unixctl reply to request %r' % reply['id'])
+
+	def request_dump(self):
+		"""
+		Send a dump request, first dropping the connection if the reply to the
+		previous one was not read whole.
+		"""
+		if self.pending:
+			self.close()
+		if self.sock is None:
+			self.connect()
+		self.request_id += 1
+		self.sock.sendall(json.dumps({'method': 'dpctl/dump-flows', 'params': [self.bridge],
+									  'id': self.request_id}))
+		self.pending = True
+
+	def start_dump(self):
+		"""
+		Read the reply to the dump requested up to the start of its result.
+
+		return:	(reply members read, data following the opening quote of the
+				result, or None if the reply has no text result).
+		"""
+		data, pos = self.skip_space(''.join(self.chunks), 0)
+		self.chunks = []
+		if data[pos] != '{':
+			raise ValueError('malformed unixctl reply')
+		reply = dict()
+		data = self.read_members(data, pos + 1, reply)
+		if data is None:
+			self.check_reply(reply)
+			self.pending = False
+		return reply, data
+
+	def stream_result(self, reply, data):
+		"""
+		Yield the lines of a dump's result as its reply is received, then read
+		the rest of the reply.
+
+		param reply:	Reply members read so far.
+		param data:		Data following the opening quote of the result.
+		"""
+		decode = self.decoder.decode
+		done = False
+		try:
+			while True:
+				end = find_unescaped(data, '"')
+				if end >= 0:
+					text = decode('"' + data[:end] + '"').encode('utf-8')
+					data = data[end + 1:]
+				else:
+					cut = find_last_line_end(data)
+					text = decode('"' + data[:cut] + '"').encode('utf-8')
+					data = data[cut:]
+				lines = text.split('\n')
+				last = lines.pop()
+				for line in lines:
+					yield line + '\n'
+				if end >= 0:
+					if last:
+						yield last
+					break
+				data = self.receive(data)
+			self.read_members(data, 0, reply)
+			self.check_reply(reply)
+			self.pending = False
+			done = True
+		finally:
+			if not done:
+				self.close()
+
+	def dump(self):
+		"""
+		Get flows for the bridge, over the socket if possible. The request is
+		sent before this returns.
+
+		return:	Iterator over the lines of the flow dump.
+		"""
+		try:
+			self.request_dump()
+		except socket.error:
+			self.close()
+			if self.fallback is None:
+				raise
+			return self.fallback.dump()
+		return self.read_dump()
+
+	def read_dump(self):
+		"""
+		Yield the lines of the dump requested, from the fallback if the reply
+		fails before its result starts.
+		"""
+		try:
+			reply, data = self.start_dump()
+		except (socket.error, ValueError, UnixctlError):
+			self.close()
+			if self.fallback is None:
+				raise
+			for line in self.fallback.dump():
+				yield line
+			return
+		if data is None:
+			return
+		lines = self.stream_result(reply, data)
+		try:
+			for line in lines:
+				yield line
+		finally:
+			lines.close()
+
+def default_flow_source(bridge):
+	"""
+	Create the flow source DpCtl uses unless told otherwise: the unixctl
+	socket, falling back to running ovs-dpctl.
+
+	param bridge:	The network bridge to dump datapath flows for.
+	return:			A flow source.
+	"""
+	return UnixctlFlowSource(bridge, fallback=SubprocessFlowSource(bridge))
+
+class RecordingFlowSource(object):
+	"""
+	Flow source passing the dumps of another through unchanged, while
+	appending each, with the time it was taken, to a trace file. Lines are
+	recorded as the dump is consumed, so a dump abandoned part way through is
+	recorded as far as it was read.
+	"""
+
+	def __init__(self, source, path, clock=time.time):
+		"""
+		Initialise the flow source, creating the trace file.
+
+		param source:	Flow source to take dumps from.
+		param path:		Path of the trace file; replaced if it exists.
+		param clock:	Function giving the current time.
+		"""
+		self.source = source
+		self.clock = clock
+		self.trace = gzip.open(path, 'wb')
+		self.trace.write(TRACE_MAGIC)
+		self.dumps = 0
+
+	def dump(self):
+		"""
+		Take a dump from the underlying source.
+
+		return:	Generator of the lines of the dump.
+		"""
+		return self.record(self.clock(), self.source.dump())
+
+	def record(self, now, lines):
+		"""
+		Yield the lines of a dump, writing them to the trace once consumed.
+
+		param now:		Time the dump was taken.
+		param lines:	Iterable over the lines of the dump.
+		"""
+		seen = []
+		try:
+			for line in lines:
+				seen.append(line)
+				yield line
+		finally:
+			self.trace.write('dump %r %d\n' % (now, len(seen)))
+			for line in seen:
+				if not line.endswith('\n'):
+					line += '\n'
+				self.trace.write(line)
+			# Keep the trace readable up to this dump should the agent die.
+			self.trace.flush()
+			self.dumps += 1
+
+	def close(self):
+		"""
+		Close the trace file and the underlying source.
+		"""
+		self.trace.close()
+		self.source.close()
+
+class ReplayFlowSource(object):
+	"""
+	Flow source replaying the dumps of a trace file, in order.
+
+	Given a speed, each dump is held back until as much time has passed since
+	the first, divided by the speed, as had passed when it was recorded; with
+	no speed, dumps are returned as fast as they are asked for. Either way
+	now() gives the recorded time, so a flowset ticked with it sees the same
+	intervals, and computes the same rates, however fast the trace is
+	replayed. Once the trace is exhausted it is replayed from the start if
+	loop is set, with times carrying on from the end; otherwise dumps are
+	empty and finished is set.
+	"""
+
+	def __init__(self, path, speed=None, loop=False, clock=time.time, sleep=time.sleep):
+		"""
+		Initialise the flow source. The trace is read as dumps are replayed.
+
+		param path:		Path of the trace file.
+		param speed:	Replay speed relative to the recording, e.g. 1.0 for
+						real time or 10.0 for ten times faster; None to not
+						wait between dumps.
+		param loop:		Replay the trace from the start once exhausted.
+		param clock:	Function giving the current time.
+		param sleep:	Function waiting for a number of seconds.
+		"""
+		self.path = path
+		self.speed = speed
+		self.loop = loop
+		self.clock = clock
+		self.sleep = sleep
+		self.trace = None
+		self.pending = None
+		self.finished = False
+		self.dumps = 0
+		# Recorded time of the first dump, and when it was replayed.
+		self.first = None
+		self.started = None
+		# Added to recorded times, growing by the trace's length per loop.
+		self.shift = 0.0
+		# Recorded time of the last dump replayed, and the interval before it.
+		self.last = None
+		self.interval = 0.0
+		self.open()
+
+	def open(self):
+		"""
+		Open the trace file at its first dump.
+		"""
+		self.trace = gzip.open(self.path, 'rb')
+		if self.trace.readline() != TRACE_MAGIC:
+			self.trace.close()
+			raise ValueError('not a dump trace: ' + self.path)
+
+	def read_record(self):
+		"""
+		Read the next dump from the trace file.
+
+		return:	(recorded time, list of lines); None at the end of the file,
+				or at a dump cut short by the recorder dying.
+		"""
+		try:
+			header = self.trace.readline().split()
+			if len(header) != 3 or header[0] != 'dump':
+				return None
+			lines = [self.trace.readline() for i in xrange(int(header[2]))]
+		except (IOError, EOFError):
+			# The gzip stream of a trace still being written has no trailer.
+			return None
+		if lines and not lines[-1].endswith('\n'):
+			return None
+		return float(header[1]) + self.shift, lines
+
+	def read_dump(self):
+		"""
+		Read the next dump of the trace, starting it again if looping.
+
+		return:	(recorded time, list of lines); None at the end of the trace.
+		"""
+		record = self.read_record()
+		if record is None and self.loop and self.last is not None:
+			self.trace.close()
+			self.open()
+			# Carry on one recorded interval after the end of the trace.
+			self.shift = self.last + (self.interval or 1.0) - self.first
+			record = self.read_record()
+		return record
+
+	def next_dump(self):
+		"""
+		return:	The dump next to be replayed, as read_dump, read ahead if needed.
+		"""
+		if self.pending is None and not self.finished:
+			self.pending = self.read_dump()
+			if self.pending is None:
+				self.finished = True
+		return self.pending
+
+	def now(self):
+		"""
+		Get the recorded time of the last dump replayed.
+
+		return:	Seconds since the epoch; before the first dump, its time, or
+				the current time if the trace is empty.
+		"""
+		if self.last is not None:
+			return self.last
+		pending = self.next_dump()
+		if pending is not None:
+			return pending[0]
+		return self.clock()
+
+	def dump(self):
+		"""
+		Replay the next dump of the trace, once it is due.
+
+		return:	List of the lines of the dump; empty once the trace is
+				finished.
+		"""
+		pending = self.next_dump()
+		if pending is None:
+			return []
+		self.pending = None
+		recorded, lines = pending
+		if self.first is None:
+			self.first = recorded
+			self.started = self.clock()
+		elif self.speed:
+			delay = self.started + (recorded - self.first) / self.speed - self.clock()
+			if delay > 0:
+				self.sleep(delay)
+		if self.last is not None:
+			self.interval = recorded - self.last
+		self.last = recorded
+		self.dumps += 1
+		return lines
+
+	def close(self):
+		"""
+		Close the trace file.
+		"""
+		self.trace.close()
+
+def record_trace(source, path, dumps, interval, clock=time.time, sleep=time.sleep):
+	"""
+	Record a number of dumps from a flow source to a trace file.
+
+	param source:	Flow source to take dumps from; closed when done.
+	param path:		Path of the trace file.
+	param dumps:	Number of dumps to record.
+	param interval:	Seconds between the starts of successive dumps.
+	param clock:	Function giving the current time.
+	param sleep:	Function waiting for a number of seconds.
+	"""
+	recorder = RecordingFlowSource(source, path, clock)
+	try:
+		start = clock()
+		for i in xrange(dumps):
+			for line in recorder.dump():
+				pass
+			delay = start + (i + 1) * interval - clock()
+			if delay > 0 and i + 1 < dumps:
+				sleep(delay)
+	finally:
+		recorder.close()
+
+if (__name__ == '__main__'):
+	# Usage: python flow_source.py <bridge> <trace file> [dumps [interval]]
+	if len(sys.argv) < 3:
+		sys.exit('usage: flow_source.py bridge trace [dumps [interval]]')
+	dumps = 60
+	interval = 1.0
+	if len(sys.argv) > 3:
+		dumps = int(sys.argv[3])
+	if len(sys.argv) > 4:
+		interval = float(sys.argv[4])
+	record_trace(default_flow_source(sys.argv[1]), sys.argv[2], dumps, interval)
@@ -0,0 +1,317 @@
+from array import array
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+"""
+Persistence of a flowset to a compact binary file, so that a restarted agent
+resumes with the flows, offsets and rates it had.
+
+A file is a fixed header followed by the columns of a FlowState, each written
+as the raw bytes of an array: 8-byte columns first, then 4-byte, then 1-byte
+ones, so that every column stays aligned, and last the IP and MAC address
+strings, separated by NULs. Reading maps the file and copies each column
+straight into an array; nothing is parsed but the header and one split of
+the strings. The header records the format version, the size of a C long
+and the byte order of the writer, and a CRC-32 of everything after it; a
+file that does not match is refused rather than half loaded.
+"""
+
+# Leading bytes of every file.
+MAGIC = 'PLANFLOW'
+# Version of the format; files of any other version are refused.
+VERSION = 1
+# Magic, version, size of a C long, little-endian flag, number of rate
+# windows, IP addresses, edges and bytes of strings, CRC-32 of the body, and
+# time of the last poll.
+HEADER = struct.Struct('=8sHBBIIIIId')
+
+class StoreError(Exception):
+	"""
+	Exception raised for a file that is not a usable flowset snapshot.
+	"""
+	pass
+
+class FlowState(object):
+	"""
+	Class representing the state of a flowset as columns, independent of the
+	backend it was taken from (see Flows.save_state and
+	flowtable.ColumnarFlows.save_state).
+
+	IP addresses are numbered by their position in ips. Each has a MAC
+	address and reset time per view, the MAC address being None and the time
+	zero if the IP address has no flows in that view. Each (src, dst) edge
+	has its byte count, its offset per view (as seen since the view's last
+	reset), the views holding it (dpctl.SRC_VIEW | dpctl.DST_VIEW), the time
+	it was last updated (-1 if unknown) and, if windows is not None, its rate
+	state (see flow_rates), len(windows) + 2 values per edge. Edges are in
+	least recently updated first order, where the flowset keeps one.
+	"""
+
+	def __init__(self, now, windows=None):
+		"""
+		Initialise an empty state.
+
+		param now:		Time of the flowset's last poll.
+		param windows:	Time constants of the rates kept; None for none.
+		"""
+		self.now = now
+		self.windows = windows
+		self.ips = []
+		self.src_macs = []
+		self.dst_macs = []
+		self.src_times = array('d')
+		self.dst_times = array('d')
+		self.edge_src = array('I')
+		self.edge_dst = array('I')
+		self.bytes = array('l')
+		self.src_offsets = array('l')
+		self.dst_offsets = array('l')
+		self.views = array('B')
+		self.stamps = array('d')
+		self.rates = array('d')
+
+	def __len__(self):
+		"""
+		return:	Number of edges held.
+		"""
+		return len(self.bytes)
+
+	def add_ip(self, ipaddr):
+		"""
+		Number an IP address, with no flows in either view yet.
+
+		param ipaddr:	IP address.
+		return:			Its index.
+		"""
+		self.ips.append(ipaddr)
+		self.src_macs.append(None)
+		self.dst_macs.append(None)
+		self.src_times.append(0.0)
+		self.dst_times.append(0.0)
+		return len(self.ips) - 1
+
+	def number_ip(self, numbers, ipaddr):
+		"""
+		Get the index of an IP address, numbering it if it is new.
+
+		param numbers:	{ip: index} of the IP addresses numbered so far;
+						updated.
+		param ipaddr:	IP address.
+		return:			Its index.
+		"""
+		idx = numbers.get(ipaddr)
+		if idx is None:
+			idx = numbers[ipaddr] = self.add_ip(ipaddr)
+		return idx
+
+	def add_edge(self, src, dst, bytes, src_offset, dst_offset, views, stamp=-1.0, rates=None):
+		"""
+		Add an edge.
+
+		param src:			Index of the source IP address.
+		param dst:			Index of the destination IP address.
+		param bytes:		Byte count of the last reading.
+		param src_offset:	Offset in the src view.
+		param dst_offset:	Offset in the dst view.
+		param views:		Views holding the edge.
+		param stamp:		Time it was last updated; -1 if unknown.
+		param rates:		Rate state; required if windows is not None.
+		"""
+		self.edge_src.append(src)
+		self.edge_dst.append(dst)
+		self.bytes.append(bytes)
+		self.src_offsets.append(src_offset)
+		self.dst_offsets.append(dst_offset)
+		self.views.append(views)
+		self.stamps.append(stamp)
+		if self.windows is not None:
+			self.rates.extend(rates)
+
+	def sort_edges(self):
+		"""
+		Put the edges in least recently updated first order, by the times
+		they were last updated; edges of unknown time go first, in the order
+		they were added.
+		"""
+		order = sorted(xrange(len(self)), key=self.stamps.__getitem__)
+		for name in ('edge_src', 'edge_dst', 'bytes', 'src_offsets', 'dst_offsets', 'views',
+					 'stamps'):
+			column = getattr(self, name)
+			setattr(self, name, array(column.typecode, [column[i] for i in order]))
+		if self.windows is not None:
+			width = len(self.windows) + 2
+			rates = array('d')
+			for i in order:
+				rates.extend(self.rates[i * width:(i + 1) * width])
+			self.rates = rates
+
+	def get_rates(self, edge):
+		"""
+		return:	The rate state of an edge, as a new list; None if no rates
+				are kept.
+		"""
+		if self.windows is None:
+			return None
+		width = len(self.windows) + 2
+		return self.rates[edge * width:(edge + 1) * width].tolist()
+
+def _columns(state):
+	"""
+	return:	The array columns of a state, in the order they are stored.
+	"""
+	return (state.src_times, state.dst_times, state.bytes, state.src_offsets,
+			state.dst_offsets, state.stamps, state.rates, state.edge_src,
+			state.edge_dst, state.views)
+
+def write_state(path, state):
+	"""
+	Write a state to a file, replacing it atomically: the file is written
+	under a temporary name and renamed over the old one, so a reader or a
+	crash never sees a partial snapshot.
+
+	param path:		Path of the file.
+	param state:	FlowState to write.
+	"""
+	macs = dict()
+	mac_list = []
+	src_macs = array('i')
+	dst_macs = array('i')
+	for column, indexes in ((state.src_macs, src_macs), (state.dst_macs, dst_macs)):
+		for mac in column:
+			if mac is None:
+				indexes.append(-1)
+				continue
+			idx = macs.get(mac)
+			if idx is None:
+				idx = macs[mac] = len(mac_list)
+				mac_list.append(mac)
+			indexes.append(idx)
+	strings = '\0'.join(state.ips + mac_list)
+	windows = array('d', state.windows or ())
+	body = [windows.tostring()]
+	columns = _columns(state)
+	# The 4-byte MAC indexes go before the 4-byte edge columns.
+	for column in columns[:7] + (src_macs, dst_macs) + columns[7:]:
+		body.append(column.tostring())
+	body.append(strings)
+	checksum = 0
+	for chunk in body:
+		checksum = zlib.crc32(chunk, checksum)
+	nwindows = 0
+	if state.windows is not None:
+		# One more than the count, so that no rates and no windows differ.
+		nwindows = len(state.windows) + 1
+	header = HEADER.pack(MAGIC, VERSION, array('l').itemsize, sys.byteorder == 'little',
+						 nwindows, len(state.ips), len(state), len(strings),
+						 checksum & 0xffffffff, state.now)
+	temp = path + '.tmp'
+	f = open(temp, 'wb')
+	try:
+		f.write(header)
+		for chunk in body:
+			f.write(chunk)
+		f.flush()
+		os.fsync(f.fileno())
+	finally:
+		f.close()
+	os.rename(temp, path)
+
+def read_state(path):
+	"""
+	Read a state from a file written by write_state.
+
+	param path:	Path of the file.
+	return:		The FlowState.
+	raises:		IOError if the file cannot be opened; StoreError if it is not
+				a complete snapshot of this version, written on a machine
+				with the same C long size and byte order.
+	"""
+	f = open(path, 'rb')
+	try:
+		if os.fstat(f.fileno()).st_size < HEADER.size:
+			raise StoreError('truncated header')
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+		f.close()
+	try:
+		return _read_mapped(mm)
+	finally:
+		mm.close()
+
+def _read_mapped(mm):
+	"""
+	Read a state from a mapped file; see read_state.
+	"""
+	(magic, version, long_size, little, nwindows, nips, nedges, nstrings,
+	 checksum, now) = HEADER.unpack(mm[:HEADER.size])
+	if magic != MAGIC:
+		raise StoreError('not a flowset snapshot')
+	if version != VERSION:
+		raise StoreError('unsupported version %d' % version)
+	if long_size != array('l').itemsize or bool(little) != (sys.byteorder == 'little'):
+		raise StoreError('written on an incompatible machine')
+	windows = None
+	width = 0
+	if nwindows:
+		windows = ()
+		width = nwindows + 1
+	state = FlowState(now, windows)
+	src_macs = array('i')
+	dst_macs = array('i')
+	columns = _columns(state)
+	lengths = (nips, nips, nedges, nedges, nedges, nedges, nedges * width, nips, nips,
+			   nedges, nedges, nedges)
+	columns = columns[:7] + (src_macs, dst_macs) + columns[7:]
+	size = HEADER.size + (nwindows and nwindows - 1) * 8 \
+		+ sum([column.itemsize * length for column, length in zip(columns, lengths)]) + nstrings
+	if len(mm) != size:
+		raise StoreError('expected %d bytes, found %d' % (size, len(mm)))
+	if zlib.crc32(buffer(mm, HEADER.size)) & 0xffffffff != checksum:
+		raise StoreError('checksum mismatch')
+	offset = HEADER.size
+	if windows is not None:
+		values = array('d')
+		values.fromstring(buffer(mm, offset, (nwindows - 1) * 8))
+		state.windows = tuple(values)
+		offset += len(values) * 8
+	for column, length in zip(columns, lengths):
+		count = column.itemsize * length
+		column.fromstring(buffer(mm, offset, count))
+		offset += count
+	strings = []
+	if nstrings:
+		strings = mm[offset:offset + nstrings].split('\0')
+	state.ips = strings[:nips]
+	macs = strings[nips:] + [None]
+	# An index of -1 picks the trailing None.
+	state.src_macs = [macs[idx] for idx in src_macs]
+	state.dst_macs = [macs[idx] for idx in dst_macs]
+	return state
+
+def save_flows(flows, path):
+	"""
+	Write the state of a flowset to a file.
+
+	param flows:	Flowset with save_state (dpctl.Flows or
+					flowtable.ColumnarFlows).
+	param path:		Path of the file.
+	"""
+	write_state(path, flows.save_state())
+
+def load_flows(flows, path):
+	"""
+	Replace the contents of a flowset with the state read from a file. The
+	state may have been saved from either backend; rates are only restored if
+	the windows match the flowset's.
+
+	param flows:	Flowset with load_state.
+	param path:		Path of the file.
+	return:			Number of flows loaded.
+	raises:			As read_state.
+	"""
+	state = read_state(path)
+	flows.load_state(state)
+	return len(state)
@@ -0,0 +1,989 @@
+from array import array
+from datetime import datetime
+import flow_rates
+import flow_store
+import time
+import traffic_matrix
+
+"""
+Columnar flow table; an alternative backend to dpctl.Flows.
+"""
+
+# Bits of ColumnarFlows._live marking which views a row belongs to.
+SRC = 1
+DST = 2
+
+# Most rows ColumnarFlows.expire evicts per call.
+EXPIRE_BUDGET = 512
+
+class ColumnarFlows(object):
+	"""
+	Class representing a set of flows, stored column-wise.
+
+	IP addresses are interned to integer indexes and each (src, dst) pair is a
+	single row in a set of typed arrays, shared by the src and dst views of the
+	flowset. Accessors return the same [mac, {peer: [bytes, offset]}, datetime]
+	structures as dpctl.Flows; these are built on demand, so get_*_flows_by_ip
+	returns a detached copy rather than a live reference. Since both views
+	share one byte counter, flows are only updated through update_flows.
+
+	Resets are epoch based, as in dpctl.Flows: resetting an IP address's
+	flows advances its epoch in that view, and a row whose epoch lags is
+	taken to have an offset of -bytes until its next update writes it.
+
+	Aging works as in dpctl.Flows, with the least-recently-updated list held
+	in per-row columns. An IP address no longer named by any row releases its
+	index for reuse.
+
+	Rates work as in dpctl.Flows, with each row's rate state held in a
+	per-row column.
+
+	save_state and load_state convert the flowset to and from a
+	flow_store.FlowState, as in dpctl.Flows.
+	"""
+
+	def __init__(self, ttl=None, max_entries=None, rate_windows=None):
+		"""
+		Initialise an empty flowset.
+
+		param ttl:			Seconds after its last update that a flow is
+							evicted by expire(); None to keep idle flows.
+		param max_entries:	Number of flows above which expire() evicts the
+							least recently updated; None for no limit.
+		param rate_windows:	Time constants, in seconds, of the rates to keep
+							per flow; None to keep no rates.
+		"""
+		# Per-IP columns, indexed by interned IP index.
+		self._ips = []
+		self._ip_index = dict()
+		self._src_mac = []
+		self._dst_mac = []
+		self._src_time = array('d')
+		self._dst_time = array('d')
+		self._ip_rows = array('I')
+		self._src_epoch = array('L')
+		self._dst_epoch = array('L')
+		self._macs = dict()
+		# Per-IP adjacency: IP index -> array of rows in the src/dst view.
+		self._src = dict()
+		self._dst = dict()
+		# Per-row columns; rows are keyed by (src index << 32 | dst index).
+		self._edges = dict()
+		self._edge_src = array('I')
+		self._edge_dst = array('I')
+		self._bytes = array('l')
+		self._src_offset = array('l')
+		self._dst_offset = array('l')
+		self._live = array('B')
+		# Epoch of the owning IP address each row's offsets are relative to.
+		self._src_seen = array('L')
+		self._dst_seen = array('L')
+		# Position of each row in the adjacency array of its src and dst IP,
+		# so that a row is removed by moving the last row into its place.
+		self._src_pos = array('I')
+		self._dst_pos = array('I')
+		self._free = []
+		self._free_ips = []
+		# Aging: per-row time of last update (-1 when not in the list) and
+		# links of the least-recently-updated list, by row; -1 ends the list.
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.now = time.time()
+		self.evicted_idle = 0
+		self.evicted_lru = 0
+		self._stamp = None
+		if ttl is not None or max_entries is not None:
+			self._stamp = array('d')
+			self._lru_prev = array('l')
+			self._lru_next = array('l')
+			self._lru_head = -1
+			self._lru_tail = -1
+		# Rates: per-row rate state (see flow_rates).
+		self.rate_windows = rate_windows
+		self._rates = None
+		if rate_windows is not None:
+			self._rates = []
+
+	def __len__(self):
+		"""
+		return:	Number of (src, dst) rows held.
+		"""
+		return len(self._edges)
+
+	def _intern(self, ipaddr):
+		"""
+		Get the index of an IP address, allocating one if it is new.
+
+		param ipaddr:	IP address to intern.
+		return:			Integer index of the IP address.
+		"""
+		idx = self._ip_index.get(ipaddr)
+		if idx is None:
+			if self._free_ips:
+				idx = self._free_ips.pop()
+				self._ips[idx] = ipaddr
+				self._ip_index[ipaddr] = idx
+				return idx
+			idx = len(self._ips)
+			self._ips.append(ipaddr)
+			self._ip_index[ipaddr] = idx
+			self._src_mac.append(None)
+			self._dst_mac.append(None)
+			self._src_time.append(0.0)
+			self._dst_time.append(0.0)
+			self._ip_rows.append(0)
+			self._src_epoch.append(0)
+			self._dst_epoch.append(0)
+		return idx
+
+	def _release_ip(self, idx):
+		"""
+		Release the index of an IP address no longer named by any row.
+		"""
+		del self._ip_index[self._ips[idx]]
+		self._ips[idx] = None
+		self._free_ips.append(idx)
+
+	def _side(self, side):
+		"""
+		Get the columns making up one view of the flowset.
+
+		param side:	SRC or DST.
+		return:		Tuple of (adjacency, MACs, timestamps, offsets, peer column).
+		"""
+		if side == SRC:
+			return self._src, self._src_mac, self._src_time, self._src_offset, self._edge_dst
+		return self._dst, self._dst_mac, self._dst_time, self._dst_offset, self._edge_src
+
+	def _epochs(self, side):
+		"""
+		Get the reset epochs of one view of the flowset.
+
+		param side:	SRC or DST.
+		return:		Tuple of (epochs by IP index, epochs seen by row).
+		"""
+		if side == SRC:
+			return self._src_epoch, self._src_seen
+		return self._dst_epoch, self._dst_seen
+
+	def _positions(self, side):
+		"""
+		Get the positions of rows in the adjacency arrays of one view.
+
+		param side:	SRC or DST.
+		return:		Positions by row.
+		"""
+		if side == SRC:
+			return self._src_pos
+		return self._dst_pos
+
+	def _row(self, srcIp, dstIp, side):
+		"""
+		Find the row for a pair, if it is present in the given view.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		param side:		SRC or DST.
+		return:			Row number; None if no such flow exists in that view.
+		"""
+		src = self._ip_index.get(srcIp)
+		dst = self._ip_index.get(dstIp)
+		if src is None or dst is None:
+			return None
+		row = self._edges.get(src << 32 | dst)
+		if row is None or not self._live[row] & side:
+			return None
+		return row
+
+	def _new_row(self, key, src, dst):
+		"""
+		Allocate a row for a new (src, dst) pair, reusing a free one if possible.
+
+		return:	Row number.
+		"""
+		if self._free:
+			row = self._free.pop()
+			self._edge_src[row] = src
+			self._edge_dst[row] = dst
+			self._bytes[row] = 0
+			self._live[row] = 0
+			if self._rates is not None:
+				self._rates[row] = flow_rates.new_rates(self.rate_windows, self.now)
+		else:
+			row = len(self._live)
+			self._edge_src.append(src)
+			self._edge_dst.append(dst)
+			self._bytes.append(0)
+			self._src_offset.append(0)
+			self._dst_offset.append(0)
+			self._live.append(0)
+			self._src_seen.append(0)
+			self._dst_seen.append(0)
+			self._src_pos.append(0)
+			self._dst_pos.append(0)
+			if self._stamp is not None:
+				self._stamp.append(-1.0)
+				self._lru_prev.append(-1)
+				self._lru_next.append(-1)
+			if self._rates is not None:
+				self._rates.append(flow_rates.new_rates(self.rate_windows, self.now))
+		self._edges[key] = row
+		self._ip_rows[src] += 1
+		self._ip_rows[dst] += 1
+		return row
+
+	def _attach(self, row, idx, mac, side):
+		"""
+		Add a row to one view of the flowset, creating the IP's entry if needed.
+
+		param row:	Row to attach.
+		param idx:	Index of the IP owning the view.
+		param mac:	MAC address of the IP, recorded if the entry is new.
+		param side:	SRC or DST.
+		"""
+		index, macs, times, offsets, peers = self._side(side)
+		rows = index.get(idx)
+		if rows is None:
+			rows = index[idx] = array('I')
+			macs[idx] = self._macs.setdefault(mac, mac)
+			times[idx] = time.time()
+		self._positions(side)[row] = len(rows)
+		rows.append(row)
+		offsets[row] = 0
+		epochs, seen = self._epochs(side)
+		seen[row] = epochs[idx]
+		self._live[row] |= side
+
+	def _free_row(self, row):
+		"""
+		Release a row that is no longer part of either view.
+		"""
+		src = self._edge_src[row]
+		dst = self._edge_dst[row]
+		del self._edges[src << 32 | dst]
+		self._free.append(row)
+		for idx in (src, dst):
+			self._ip_rows[idx] -= 1
+			if not self._ip_rows[idx]:
+				self._release_ip(idx)
+		if self._stamp is not None and self._stamp[row] >= 0:
+			self._unlink(row)
+			self._stamp[row] = -1.0
+
+	def _unlink(self, row):
+		"""
+		Take a row out of the least-recently-updated list.
+		"""
+		prev = self._lru_prev[row]
+		next = self._lru_next[row]
+		if prev < 0:
+			self._lru_head = next
+		else:
+			self._lru_next[prev] = next
+		if next < 0:
+			self._lru_tail = prev
+		else:
+			self._lru_prev[next] = prev
+
+	def _touch(self, row):
+		"""
+		Mark a row as updated now, moving it to the most recently updated end
+		of the aging list.
+		"""
+		now = self.now
+		stamp = self._stamp
+		if stamp[row] == now:
+			return
+		if stamp[row] >= 0:
+			self._unlink(row)
+		stamp[row] = now
+		tail = self._lru_tail
+		self._lru_prev[row] = tail
+		self._lru_next[row] = -1
+		if tail < 0:
+			self._lru_head = row
+		else:
+			self._lru_next[tail] = row
+		self._lru_tail = row
+
+	def _evict_row(self, row):
+		"""
+		Remove a row from both views, along with any IP address entry left
+		without flows.
+		"""
+		live = self._live[row]
+		for side, idx in ((SRC, self._edge_src[row]), (DST, self._edge_dst[row])):
+			if live & side:
+				index, macs, times, offsets, peers = self._side(side)
+				rows = index[idx]
+				last = rows.pop()
+				if last != row:
+					positions = self._positions(side)
+					rows[positions[row]] = last
+					positions[last] = positions[row]
+				if not rows:
+					del index[idx]
+					macs[idx] = None
+		self._live[row] = 0
+		self._free_row(row)
+
+	def tick(self, now=None):
+		"""
+		Set the time at which subsequent updates are taken to happen.
+
+		param now:	Time in seconds since the epoch; the current time if None.
+		"""
+		if now is None:
+			now = time.time()
+		self.now = now
+
+	def expire(self, budget=EXPIRE_BUDGET, ips=None):
+		"""
+		Evict flows not updated within ttl seconds of the last tick, then the
+		least recently updated flows while more than max_entries are held.
+
+		param budget:	Most flows to evict.
+		param ips:		Set to add the IP addresses of evicted flows to.
+		return:			Number of flows evicted; less than budget once there
+						is nothing left to evict.
+		"""
+		if self._stamp is None:
+			return 0
+		oldest = None
+		if self.ttl is not None:
+			oldest = self.now - self.ttl
+		evicted = 0
+		while evicted < budget:
+			row = self._lru_head
+			if row < 0:
+				break
+			if oldest is not None and self._stamp[row] < oldest:
+				self.evicted_idle += 1
+			elif self.max_entries is not None and len(self._edges) > self.max_entries:
+				self.evicted_lru += 1
+			else:
+				break
+			if ips is not None:
+				ips.add(self._ips[self._edge_src[row]])
+				ips.add(self._ips[self._edge_dst[row]])
+			self._evict_row(row)
+			evicted += 1
+		return evicted
+
+	def get_eviction_stats(self):
+		"""
+		Get counts of flows held and evicted.
+
+		return:	Dictionary of resident flows and src/dst IP addresses, and of
+				flows evicted for being idle or for exceeding max_entries.
+		"""
+		return {'resident_flows': len(self._edges),
+				'resident_src_ips': len(self._src),
+				'resident_dst_ips': len(self._dst),
+				'evicted_idle': self.evicted_idle,
+				'evicted_lru': self.evicted_lru}
+
+	def has_flow_history(self, ipaddr, flowset):
+		"""
+		Check if there are any existing flow entries for the given IP address.
+
+		param ipaddr:	IP address to query.
+		param flowset:	The src or dst flowset (self._src or self._dst).
+		return:			True if an entry already exists for the given IP address,
+						False otherwise.
+		"""
+		return self._ip_index.get(ipaddr) in flowset
+
+	def has_src_flow_history(self, ipaddr):
+		"""
+		Check if there are any existing src flow entries for the given IP address.
+
+		param ipaddr:	IP address to query against src flows.
+		return:			True if an entry already exists for the given IP address,
+						False otherwise.
+		"""
+		return self.has_flow_history(ipaddr, self._src)
+
+	def has_dst_flow_history(self, ipaddr):
+		"""
+		Check if there are any existing dst flow entries for the given IP address.
+
+		param ipaddr:	IP address to query against dst flows.
+		return:			True if an entry already exists for the given IP address,
+						False otherwise.
+		"""
+		return self.has_flow_history(ipaddr, self._dst)
+
+	def has_src_flow_dst_entry(self, srcIp, dstIp):
+		"""
+		Check if there are any existing flows from srcIp to dstIp.
+
+		param srcIp:	IP address to query against src flows.
+		param dstIp:	IP address to query as a src flow end-point.
+		return:			True if an entry already exists for the given IP addresses,
+						False otherwise.
+		"""
+		return self._row(srcIp, dstIp, SRC) is not None
+
+	def has_dst_flow_src_entry(self, dstIp, srcIp):
+		"""
+		Check if there are any existing flows from srcIp to dstIp.
+
+		param dstIp:	IP address to query against dst flows.
+		param srcIp:	IP address to query as a dst flow end-point.
+		return:			True if an entry already exists for the given IP addresses,
+						False otherwise.
+		"""
+		return self._row(srcIp, dstIp, DST) is not None
+
+	def update_flows(self, entry):
+		"""
+		Update both the src and dst flow entries, using the given flow entry.
+
+		param entry:	Flow entry containing flow data.
+		"""
+		src = self._intern(entry.srcIp)
+		dst = self._intern(entry.dstIp)
+		key = src << 32 | dst
+		row = self._edges.get(key)
+		if row is None:
+			row = self._new_row(key, src, dst)
+		old = self._bytes[row]
+		live = self._live[row]
+		if old != entry.bytes:
+			# Write the offsets of resets this row has not seen yet before
+			# its byte count moves on.
+			if live & SRC and self._src_seen[row] != self._src_epoch[src]:
+				self._src_offset[row] = 0 - old
+				self._src_seen[row] = self._src_epoch[src]
+			if live & DST and self._dst_seen[row] != self._dst_epoch[dst]:
+				self._dst_offset[row] = 0 - old
+				self._dst_seen[row] = self._dst_epoch[dst]
+		if not live & SRC:
+			self._attach(row, src, entry.srcMac, SRC)
+		elif old > entry.bytes:
+			# A new flow has been started but a previous flow exists; offset
+			# by the previous tally to account for it.
+			self._src_offset[row] += old
+		if not live & DST:
+			self._attach(row, dst, entry.dstMac, DST)
+		elif old > entry.bytes:
+			self._dst_offset[row] += old
+		self._bytes[row] = entry.bytes
+		if self._stamp is not None:
+			self._touch(row)
+		if self._rates is not None:
+			# The entry's own delta, as the row's tally is shared by every
+			# datapath flow of the pair; see Flows.add_rates.
+			seen = entry.delta
+			if seen is None:
+				if old > entry.bytes:
+					seen = entry.bytes
+				else:
+					seen = entry.bytes - old
+			if seen:
+				flow_rates.add_bytes(self._rates[row], self.rate_windows, self.now, seen)
+
+	def reset_src_flow(self, srcIp, dstIp):
+		"""
+		Reset a src flow so that further updates will be calculated against the
+		value at the most recent reading.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		"""
+		row = self._row(srcIp, dstIp, SRC)
+		if row is not None:
+			self._src_offset[row] = 0 - self._bytes[row]
+			self._src_seen[row] = self._src_epoch[self._edge_src[row]]
+
+	def reset_dst_flow(self, dstIp, srcIp):
+		"""
+		Reset a dst flow so that further updates will be calculated against the
+		value at the most recent reading.
+
+		param dstIp:	Destination IP address of the flow.
+		param srcIp:	Source IP address of the flow.
+		"""
+		row = self._row(srcIp, dstIp, DST)
+		if row is not None:
+			self._dst_offset[row] = 0 - self._bytes[row]
+			self._dst_seen[row] = self._dst_epoch[self._edge_dst[row]]
+
+	def _reset_flows(self, ipaddr, side):
+		"""
+		Reset every flow in one view of the given IP address, by advancing
+		its epoch.
+		"""
+		index, macs, times, offsets, peers = self._side(side)
+		idx = self._ip_index.get(ipaddr)
+		if idx in index:
+			epochs, seen = self._epochs(side)
+			epochs[idx] += 1
+			times[idx] = time.time()
+
+	def reset_src_flows(self, srcIp):
+		"""
+		Reset all flows for a src IP address so that further updates will be
+		calculated against the value at the most recent reading.
+
+		param srcIp:	Source IP address of the flow.
+		"""
+		self._reset_flows(srcIp, SRC)
+
+	def reset_dst_flows(self, dstIp):
+		"""
+		Reset all flows for a dst IP address so that further updates will be
+		calculated against the value at the most recent reading.
+
+		param dstIp:	Destination IP address of the flow.
+		"""
+		self._reset_flows(dstIp, DST)
+
+	def _copy_flows(self, ipaddr, side):
+		"""
+		Build the [mac, {peer: [bytes, offset]}, datetime] entry of one view.
+
+		return:	The entry; None if no such flows exist.
+		"""
+		index, macs, times, offsets, peers = self._side(side)
+		idx = self._ip_index.get(ipaddr)
+		rows = index.get(idx)
+		if rows is None:
+			return None
+		ips = self._ips
+		bytes = self._bytes
+		epochs, seen = self._epochs(side)
+		epoch = epochs[idx]
+		flows = dict()
+		for row in rows:
+			if seen[row] == epoch:
+				flows[ips[peers[row]]] = [bytes[row], offsets[row]]
+			else:
+				flows[ips[peers[row]]] = [bytes[row], 0 - bytes[row]]
+		return [macs[idx], flows, datetime.fromtimestamp(times[idx])]
+
+	def get_src_flows_by_ip(self, srcIp):
+		"""
+		Get src flows corresponding to the given src IP address.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			Flow entries with this IP address as the source;
+						None if no such flows exist.
+		"""
+		return self._copy_flows(srcIp, SRC)
+
+	def get_dst_flows_by_ip(self, dstIp):
+		"""
+		Get dst flows corresponding to the given dst IP address.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			Flow entries with this IP address as the destination;
+						None if no such flows exist.
+		"""
+		return self._copy_flows(dstIp, DST)
+
+	def copy_flows_by_ip(self, ipaddr, flowset):
+		"""
+		Copy flows corresponding to the given IP address into new data structures.
+
+		param ipaddr:	IP address of flows to retrieve.
+		param flowset:	src or dst flowset (self._src or self._dst).
+		return:			A copy of the flow entries with this IP address;
+						None if no such flows exist.
+		"""
+		if flowset is self._src:
+			return self._copy_flows(ipaddr, SRC)
+		return self._copy_flows(ipaddr, DST)
+
+	def copy_src_flows_by_ip(self, srcIp):
+		"""
+		Copy src flows corresponding to the given src IP address.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			A copy of the flow entries with this IP address as the
+						source; None if no such flows exist.
+		"""
+		return self._copy_flows(srcIp, SRC)
+
+	def copy_dst_flows_by_ip(self, dstIp):
+		"""
+		Copy dst flows corresponding to the given dst IP address.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			A copy of the flow entries with this IP address as the
+						destination; None if no such flows exist.
+		"""
+		return self._copy_flows(dstIp, DST)
+
+	def copy_and_reset_flows_by_ip(self, ipaddr, flowset):
+		"""
+		Copy flows corresponding to the given IP address and reset them.
+
+		param ipaddr:	IP address of flows to retrieve.
+		param flowset:	src or dst flowset (self._src or self._dst).
+		return:			A copy of the flow entries with this IP address;
+						None if no such flows exist.
+		"""
+		if flowset is self._src:
+			return self.copy_and_reset_src_flows_by_ip(ipaddr)
+		return self.copy_and_reset_dst_flows_by_ip(ipaddr)
+
+	def copy_and_reset_src_flows_by_ip(self, srcIp):
+		"""
+		Copy src flows corresponding to the given src IP address and reset them.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			A copy of the flow entries with this IP address as the
+						source; None if no such flows exist.
+		"""
+		entries = self._copy_flows(srcIp, SRC)
+		self._reset_flows(srcIp, SRC)
+		return entries
+
+	def copy_and_reset_dst_flows_by_ip(self, dstIp):
+		"""
+		Copy dst flows corresponding to the given dst IP address and reset them.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			A copy of the flow entries with this IP address as the
+						destination; None if no such flows exist.
+		"""
+		entries = self._copy_flows(dstIp, DST)
+		self._reset_flows(dstIp, DST)
+		return entries
+
+	def _del_flows(self, ipaddr, side):
+		"""
+		Remove one view of the given IP address, freeing rows left in neither.
+		"""
+		index, macs, times, offsets, peers = self._side(side)
+		idx = self._ip_index.get(ipaddr)
+		rows = index.pop(idx, None)
+		if rows is not None:
+			live = self._live
+			for row in rows:
+				live[row] &= ~side
+				if not live[row]:
+					self._free_row(row)
+			macs[idx] = None
+
+	def del_src_flows_by_ip(self, srcIp):
+		"""
+		Delete src flows corresponding to the given src IP address.
+
+		param srcIp:	Source IP address of flows to delete.
+		"""
+		self._del_flows(srcIp, SRC)
+
+	def del_dst_flows_by_ip(self, dstIp):
+		"""
+		Delete dst flows corresponding to the given dst IP address.
+
+		param dstIp:	Destination IP address of flows to delete.
+		"""
+		self._del_flows(dstIp, DST)
+
+	def get_flow_bytes(self, srcIp, dstIp):
+		"""
+		Get the byte count last read for the flow from srcIp to dstIp.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		return:			Byte count; None if no such flow exists.
+		"""
+		row = self._row(srcIp, dstIp, SRC | DST)
+		if row is None:
+			return None
+		return self._bytes[row]
+
+	def get_flow_rates(self, srcIp, dstIp):
+		"""
+		Get the throughput rates of the flow from srcIp to dstIp.
+
+		param srcIp:	Source IP address of the flow.
+		param dstIp:	Destination IP address of the flow.
+		return:			Tuple of rates in bytes/sec as of the last tick, one per
+						rate window; None if no such flow exists or no rates
+						are kept.
+		"""
+		if self._rates is None:
+			return None
+		row = self._row(srcIp, dstIp, SRC | DST)
+		if row is None:
+			return None
+		return flow_rates.current_rates(self._rates[row], self.rate_windows, self.now)
+
+	def _view_rates(self, ipaddr, side):
+		"""
+		Get the throughput rates of each flow in one view of an IP address.
+
+		return:	{peer ip: tuple of rates in bytes/sec}; None if no such flows
+				exist or no rates are kept.
+		"""
+		if self._rates is None:
+			return None
+		index, macs, times, offsets, peers = self._side(side)
+		rows = index.get(self._ip_index.get(ipaddr))
+		if rows is None:
+			return None
+		ips = self._ips
+		windows = self.rate_windows
+		now = self.now
+		rates = dict()
+		for row in rows:
+			rates[ips[peers[row]]] = flow_rates.current_rates(self._rates[row], windows, now)
+		return rates
+
+	def get_src_rates_by_ip(self, srcIp):
+		"""
+		Get the throughput rates of the flows from the given src IP address.
+
+		param srcIp:	Source IP address of flows to retrieve.
+		return:			{dst ip: tuple of rates in bytes/sec} as of the last
+						tick; None if no such flows exist or no rates are kept.
+		"""
+		return self._view_rates(srcIp, SRC)
+
+	def get_dst_rates_by_ip(self, dstIp):
+		"""
+		Get the throughput rates of the flows to the given dst IP address.
+
+		param dstIp:	Destination IP address of flows to retrieve.
+		return:			{src ip: tuple of rates in bytes/sec} as of the last
+						tick; None if no such flows exist or no rates are kept.
+		"""
+		return self._view_rates(dstIp, DST)
+
+	def _matrix_row(self, idx, window):
+		"""
+		Get the values of the flows from an IP index for a traffic matrix.
+
+		return:	Generator of (peer ip, value).
+		"""
+		ips = self._ips
+		peers = self._edge_dst
+		rows = self._src[idx]
+		if window is None:
+			bytes = self._bytes
+			offsets = self._src_offset
+			epoch = self._src_epoch[idx]
+			seen = self._src_seen
+			for row in rows:
+				if seen[row] == epoch:
+					yield ips[peers[row]], bytes[row] + offsets[row]
+				else:
+					yield ips[peers[row]], 0
+		else:
+			windows = self.rate_windows
+			now = self.now
+			for row in rows:
+				yield ips[peers[row]], flow_rates.current_rates(self._rates[row], windows, now)[window]
+
+	def export_matrix(self, window=None):
+		"""
+		Export the flows of the src view as a sparse traffic matrix.
+
+		param window:	Index of the rate window whose rates (bytes/sec) to
+						export; None to export the bytes counted since each
+						flow was last reset.
+		return:			traffic_matrix.TrafficMatrix; None if a rate window
+						is asked for and no rates are kept.
+		"""
+		if window is not None and self._rates is None:
+			return None
+		return traffic_matrix.build_matrix([(self._ips[idx], self._matrix_row(idx, window))
+											for idx in self._src])
+
+	def save_state(self):
+		"""
+		Take the state of the flowset as columns, for flow_store to write.
+		Offsets are taken as seen since each IP address's last reset, and IP
+		indexes are renumbered without gaps.
+
+		return:	flow_store.FlowState.
+		"""
+		state = flow_store.FlowState(self.now, self.rate_windows)
+		number = dict()
+		for side in (SRC, DST):
+			index, macs, times, offsets, peers = self._side(side)
+			if side == SRC:
+				state_macs, state_times = state.src_macs, state.src_times
+			else:
+				state_macs, state_times = state.dst_macs, state.dst_times
+			for idx in index:
+				n = number.get(idx)
+				if n is None:
+					n = number[idx] = state.add_ip(self._ips[idx])
+				state_macs[n] = macs[idx]
+				state_times[n] = times[idx]
+		if self._stamp is not None:
+			rows = []
+			row = self._lru_head
+			while row >= 0:
+				rows.append(row)
+				row = self._lru_next[row]
+		else:
+			rows = self._edges.itervalues()
+		for row in rows:
+			stamp = -1.0
+			if self._stamp is not None:
+				stamp = self._stamp[row]
+			rates = None
+			if self._rates is not None:
+				rates = self._rates[row]
+			state.add_edge(number[self._edge_src[row]], number[self._edge_dst[row]],
+						   self._bytes[row], self._state_offset(row, SRC),
+						   self._state_offset(row, DST), self._live[row], stamp, rates)
+		return state
+
+	def _state_offset(self, row, side):
+		"""
+		Get the offset of a row in a view as seen since the last reset of the
+		IP address holding it there.
+
+		param row:	Row number.
+		param side:	SRC or DST.
+		return:		The offset; zero if the view does not hold the row.
+		"""
+		if not self._live[row] & side:
+			return 0
+		index, macs, times, offsets, peers = self._side(side)
+		epochs, seen = self._epochs(side)
+		if side == SRC:
+			owner = self._edge_src[row]
+		else:
+			owner = self._edge_dst[row]
+		if seen[row] == epochs[owner]:
+			return offsets[row]
+		return 0 - self._bytes[row]
+
+	def get_ips(self):
+		"""
+		return:	(IP addresses with src flows, IP addresses with dst flows), as
+				lists.
+		"""
+		return ([self._ips[idx] for idx in self._src],
+				[self._ips[idx] for idx in self._dst])
+
+	def add_to_state(self, state, numbers, saved, ips, side, budget=None):
+		"""
+		Add the entries of some IP addresses in one view, and their rows, to a
+		state being taken a batch at a time; see dpctl.Flows.add_to_state.
+		"""
+		index, macs, times, offsets, peers = self._side(side)
+		if side == SRC:
+			state_macs, state_times, state_offsets = state.src_macs, state.src_times, state.src_offsets
+		else:
+			state_macs, state_times, state_offsets = state.dst_macs, state.dst_times, state.dst_offsets
+		added = 0
+		for ipaddr in ips:
+			idx = self._ip_index.get(ipaddr)
+			rows = index.get(idx)
+			if rows is None:
+				continue
+			n = state.number_ip(numbers, ipaddr)
+			state_macs[n] = macs[idx]
+			state_times[n] = times[idx]
+			for row in rows:
+				offset = self._state_offset(row, side)
+				pair = (self._ips[self._edge_src[row]], self._ips[self._edge_dst[row]])
+				i = saved.get(pair)
+				if i is not None:
+					state.views[i] |= side
+					state_offsets[i] = offset
+					continue
+				saved[pair] = len(state)
+				stamp = -1.0
+				if self._stamp is not None:
+					stamp = self._stamp[row]
+				rates = None
+				if self._rates is not None:
+					rates = self._rates[row]
+				if side == SRC:
+					state.add_edge(n, state.number_ip(numbers, pair[1]), self._bytes[row],
+								   offset, 0, side, stamp, rates)
+				else:
+					state.add_edge(state.number_ip(numbers, pair[0]), n, self._bytes[row],
+								   0, offset, side, stamp, rates)
+			added += len(rows)
+			if budget is not None and added >= budget:
+				return True
+		return False
+
+	def load_state(self, state):
+		"""
+		Replace the flows held with those of a saved state. Rates are restored
+		if the state's rate windows are the flowset's, and otherwise restart.
+
+		param state:	flow_store.FlowState, from either backend.
+		"""
+		evicted_idle, evicted_lru = self.evicted_idle, self.evicted_lru
+		self.__init__(self.ttl, self.max_entries, self.rate_windows)
+		self.evicted_idle, self.evicted_lru = evicted_idle, evicted_lru
+		self.now = state.now
+		windows = self.rate_windows
+		same_windows = windows is not None and state.windows == tuple([float(window) for window in windows])
+		idxs = [self._intern(ipaddr) for ipaddr in state.ips]
+		for i in xrange(len(state)):
+			src = idxs[state.edge_src[i]]
+			dst = idxs[state.edge_dst[i]]
+			row = self._new_row(src << 32 | dst, src, dst)
+			self._bytes[row] = state.bytes[i]
+			live = state.views[i]
+			if live & SRC:
+				self._attach(row, src, state.src_macs[state.edge_src[i]], SRC)
+				self._src_time[src] = state.src_times[state.edge_src[i]]
+				self._src_offset[row] = state.src_offsets[i]
+			if live & DST:
+				self._attach(row, dst, state.dst_macs[state.edge_dst[i]], DST)
+				self._dst_time[dst] = state.dst_times[state.edge_dst[i]]
+				self._dst_offset[row] = state.dst_offsets[i]
+			if same_windows:
+				self._rates[row] = state.get_rates(i)
+			if self._stamp is not None:
+				# Saved least recently updated first, so each goes to the tail.
+				stamp = state.stamps[i]
+				if stamp >= 0:
+					self.now = stamp
+				self._touch(row)
+				self.now = state.now
+
+	def get_src_mac_by_ip(self, srcIp):
+		"""
+		Retrieve the MAC address corresponding to the given src IP address.
+
+		param srcIp:	Source IP address linked to the desired MAC address.
+		return:			The MAC address linked to the given IP address;
+						None otherwise.
+		"""
+		idx = self._ip_index.get(srcIp)
+		if idx is None:
+			return None
+		return self._src_mac[idx]
+
+	def get_dst_mac_by_ip(self, dstIp):
+		"""
+		Retrieve the MAC address corresponding to the given dst IP address.
+
+		param dstIp:	Destination IP address linked to the desired MAC address.
+		return:			The MAC address linked to the given IP address;
+						None otherwise.
+		"""
+		idx = self._ip_index.get(dstIp)
+		if idx is None:
+			return None
+		return self._dst_mac[idx]
+
+	def get_mac_by_ip(self, ipaddr):
+		"""
+		Retrieve the MAC address corresponding to the given IP address.
+
+		param ipaddr:	IP address linked to the desired MAC address.
+		return:			The MAC address linked to the given IP address;
+						None otherwise.
+		"""
+		mac = self.get_src_mac_by_ip(ipaddr)
+		if mac is None:
+			mac = self.get_dst_mac_by_ip(ipaddr)
+		return mac
@@ -0,0 +1,268 @@
+from array import array
+import heapq
+import math
+
+"""
+Fixed-memory tracking of the (src, dst) pairs carrying the most traffic; an
+optional companion to the exact flowset.
+
+Counts are exponentially decayed, so that they rank pairs by recent rate
+rather than by bytes since start: bytes seen at time t are counted with
+weight exp((t - landmark) / window), and a count c reads as a rate of
+c * exp(-(now - landmark) / window) / window bytes/sec. When weights grow
+large, every count is scaled down and the landmark moved to the present.
+"""
+
+# Peers tracked per IP address.
+PEERS = 16
+# IP addresses tracked.
+IPS = 1024
+# Counters per row, and rows, of the count-min sketch.
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+# Time constant of the decay, in seconds.
+WINDOW = 60.0
+# Exponent of the weight above which counts are scaled down.
+RESCALE = 200
+
+class SpaceSaving(object):
+	"""
+	Class representing a space-saving summary: the heaviest keys of a stream,
+	in a fixed number of counters.
+
+	A key not held takes over the smallest counter, inheriting its count as
+	an overestimate, so any key heavier than total/capacity is held. Counts
+	are {key: [count, overestimate]}; a heap of (count, key) pairs, which may
+	lag the counts, finds the smallest.
+	"""
+
+	def __init__(self, capacity):
+		"""
+		Initialise an empty summary.
+
+		param capacity:	Number of keys held.
+		"""
+		self.capacity = capacity
+		self.counts = dict()
+		self._heap = []
+
+	def __len__(self):
+		return len(self.counts)
+
+	def add(self, key, weight):
+		"""
+		Add weight to a key.
+
+		param key:		Key to count.
+		param weight:	Weight to add.
+		return:			The key evicted to make room; None if none was.
+		"""
+		counter = self.counts.get(key)
+		if counter is not None:
+			counter[0] += weight
+			return None
+		victim = None
+		floor = 0
+		if len(self.counts) >= self.capacity:
+			victim, floor = self._pop_smallest()
+		self.counts[key] = [floor + weight, floor]
+		heapq.heappush(self._heap, (floor + weight, key))
+		return victim
+
+	def _pop_smallest(self):
+		"""
+		Remove the key with the smallest count.
+
+		return:	(key, count).
+		"""
+		heap = self._heap
+		while True:
+			count, key = heapq.heappop(heap)
+			current = self.counts[key][0]
+			if current == count:
+				del self.counts[key]
+				return key, count
+			# Grown since it was pushed; requeue at its current count.
+			heapq.heappush(heap, (current, key))
+
+	def get(self, key):
+		"""
+		return:	[count, overestimate] of a key; None if it is not held.
+		"""
+		return self.counts.get(key)
+
+	def top(self, n):
+		"""
+		return:	Up to n (key, count) pairs, heaviest first.
+		"""
+		return heapq.nlargest(n, [(key, counter[0]) for key, counter in self.counts.iteritems()],
+							  key=lambda item: item[1])
+
+	def scale(self, factor):
+		"""
+		Multiply every count by a factor.
+
+		param factor:	Positive factor.
+		"""
+		for counter in self.counts.itervalues():
+			counter[0] *= factor
+			counter[1] *= factor
+		self._rebuild()
+
+	def _rebuild(self):
+		self._heap = [(counter[0], key) for key, counter in self.counts.iteritems()]
+		heapq.heapify(self._heap)
+
+class CountMinSketch(object):
+	"""
+	Class representing a count-min sketch: an overestimate of the count of
+	any key, in a fixed number of counters.
+	"""
+
+	def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+		"""
+		Initialise an empty sketch.
+
+		param width:	Counters per row; the overestimate is within
+						total/width with high probability.
+		param depth:	Rows, each hashed independently.
+		"""
+		self.width = width
+		self.depth = depth
+		self.rows = [array('d', [0.0]) * width for i in range(depth)]
+
+	def _cells(self, key):
+		width = self.width
+		return [(row, hash((i, key)) % width) for i, row in enumerate(self.rows)]
+
+	def add(self, key, weight):
+		"""
+		Add weight to a key, raising only the cells below the key's new
+		estimate (conservative update).
+
+		param key:		Key to count.
+		param weight:	Weight to add.
+		"""
+		cells = self._cells(key)
+		target = min([row[col] for row, col in cells]) + weight
+		for row, col in cells:
+			if row[col] < target:
+				row[col] = target
+
+	def estimate(self, key):
+		"""
+		return:	The estimated count of a key; never below its true count.
+		"""
+		return min([row[col] for row, col in self._cells(key)])
+
+	def scale(self, factor):
+		"""
+		Multiply every count by a factor.
+
+		param factor:	Positive factor.
+		"""
+		for row in self.rows:
+			for col in xrange(self.width):
+				row[col] *= factor
+
+class HeavyHitters(object):
+	"""
+	Class tracking, per IP address, the peers it exchanges the most traffic
+	with (in either direction), and estimating the rate of any pair.
+
+	IP addresses are themselves held in a space-saving summary of their
+	total traffic, so that memory is bounded by ips * peers counters plus the
+	sketch, however many flows are seen.
+	"""
+
+	def __init__(self, peers=PEERS, ips=IPS, width=SKETCH_WIDTH, depth=SKETCH_DEPTH,
+				 window=WINDOW):
+		"""
+		Initialise an empty tracker.
+
+		param peers:	Peers tracked per IP address.
+		param ips:		IP addresses tracked.
+		param width:	Counters per row of the count-min sketch.
+		param depth:	Rows of the count-min sketch.
+		param window:	Time constant of the decay, in seconds.
+		"""
+		self.peers = peers
+		self.window = float(window)
+		self.ips = SpaceSaving(ips)
+		self.peer_counts = dict()
+		self.sketch = CountMinSketch(width, depth)
+		self.now = None
+		self.landmark = None
+		self.weight = 1.0
+
+	def tick(self, now):
+		"""
+		Set the time at which subsequent traffic is taken to be seen.
+
+		param now:	Time in seconds since the epoch.
+		"""
+		if self.landmark is None:
+			self.landmark = now
+		self.now = now
+		exponent = (now - self.landmark) / self.window
+		if exponent <= RESCALE:
+			self.weight = math.exp(exponent)
+		else:
+			factor = math.exp(0 - exponent)
+			self.ips.scale(factor)
+			for summary in self.peer_counts.itervalues():
+				summary.scale(factor)
+			self.sketch.scale(factor)
+			self.landmark = now
+			self.weight = 1.0
+
+	def add(self, srcIp, dstIp, bytes):
+		"""
+		Count bytes sent from srcIp to dstIp since the last reading.
+
+		param srcIp:	Source IP address.
+		param dstIp:	Destination IP address.
+		param bytes:	Number of bytes.
+		"""
+		weight = bytes * self.weight
+		self.sketch.add((srcIp, dstIp), weight)
+		for ipaddr, peer in ((srcIp, dstIp), (dstIp, srcIp)):
+			victim = self.ips.add(ipaddr, weight)
+			if victim is not None:
+				del self.peer_counts[victim]
+			summary = self.peer_counts.get(ipaddr)
+			if summary is None:
+				summary = self.peer_counts[ipaddr] = SpaceSaving(self.peers)
+			summary.add(peer, weight)
+
+	def rate(self, count):
+		"""
+		return:	The rate in bytes/sec that a decayed count reads as now.
+		"""
+		return count / self.weight / self.window
+
+	def top_peers(self, ipaddr, n):
+		"""
+		Get the peers an IP address exchanges the most traffic with.
+
+		param ipaddr:	IP address.
+		param n:		Most peers to return; at most the peers tracked.
+		return:			List of (peer, bytes/sec), highest rate first; empty if
+						the IP address is not tracked. Rates may be
+						overestimated by up to the smallest rate tracked.
+		"""
+		summary = self.peer_counts.get(ipaddr)
+		if summary is None:
+			return []
+		return [(peer, self.rate(count)) for peer, count in summary.top(n)]
+
+	def estimate_rate(self, srcIp, dstIp):
+		"""
+		Estimate the rate of traffic from srcIp to dstIp, whether or not the
+		pair is among the heaviest.
+
+		param srcIp:	Source IP address.
+		param dstIp:	Destination IP address.
+		return:			Bytes/sec; never an underestimate.
+		"""
+		return self.rate(self.sketch.estimate((srcIp, dstIp)))
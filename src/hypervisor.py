@@ -0,0 +1,259 @@
+import subprocess
+import threading
+import xml.etree.ElementTree as ElementTree
+
+"""
+Backends querying and controlling the hypervisor of this host. Each returns
+structured data and keeps no state shared between calls beyond what it
+guards itself, so queries may be made from several threads at once.
+
+A backend has:
+
+	list_domains()						List of Domain, Domain-0 included.
+	get_macs(domid)						List of the MAC addresses of a domain.
+	migrate(domid, host, port=None)		Live-migrate a domain to another host.
+
+XmBackend and XlBackend run the xm and xl toolstacks as subprocesses,
+LibvirtBackend talks to libvirtd, and FakeBackend holds domains in memory,
+for tests and for running without a hypervisor.
+"""
+
+# VIR_CONNECT_LIST_DOMAINS_ACTIVE and VIR_MIGRATE_LIVE, so that libvirt need
+# not be imported when given a connection.
+LIBVIRT_LIST_ACTIVE = 1
+LIBVIRT_MIGRATE_LIVE = 1
+
+class HypervisorError(Exception):
+	"""
+	Raised when the hypervisor fails or refuses a command.
+	"""
+	pass
+
+class Domain(object):
+	"""
+	Class describing a domain.
+	"""
+	__slots__ = ('domid', 'name', 'memory')
+
+	def __init__(self, domid, name, memory):
+		"""
+		param domid:	Domain ID; 0 for Domain-0.
+		param name:		Domain name.
+		param memory:	Memory in MB.
+		"""
+		self.domid = domid
+		self.name = name
+		self.memory = memory
+
+	def __eq__(self, other):
+		return isinstance(other, Domain) and \
+			(self.domid, self.name, self.memory) == (other.domid, other.name, other.memory)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __repr__(self):
+		return 'Domain(%d, %r, %d)' % (self.domid, self.name, self.memory)
+
+def parse_list(lines):
+	"""
+	Parse the output of 'xm list' or 'xl list'.
+
+	param lines:	Lines of output.
+	return:			List of Domain.
+	"""
+	domains = []
+	for line in lines:
+		fields = line.split()
+		if len(fields) < 3 or fields[0] == 'Name':
+			continue
+		domains.append(Domain(int(fields[1]), fields[0], int(fields[2])))
+	return domains
+
+def parse_network_list(lines):
+	"""
+	Parse the output of 'xm network-list' or 'xl network-list'.
+
+	param lines:	Lines of output.
+	return:			List of MAC addresses.
+	"""
+	macs = []
+	for line in lines:
+		fields = line.split()
+		if len(fields) < 3 or fields[0] == 'Idx':
+			continue
+		macs.append(fields[2])
+	return macs
+
+class CommandBackend(object):
+	"""
+	Class running a toolstack command per query; see XmBackend and
+	XlBackend.
+	"""
+	command = None
+
+	def run(self, args):
+		"""
+		Run the toolstack.
+
+		param args:	Arguments of the command.
+		return:		List of lines of its output.
+		"""
+		try:
+			proc = subprocess.Popen([self.command] + args, stdout=subprocess.PIPE,
+									stderr=subprocess.PIPE)
+		except OSError, e:
+			raise HypervisorError('cannot run %s: %s' % (self.command, e))
+		out, err = proc.communicate()
+		if proc.returncode != 0:
+			raise HypervisorError('%s %s failed: %s' % (self.command, ' '.join(args),
+														err.strip()))
+		return out.splitlines()
+
+	def list_domains(self):
+		return parse_list(self.run(['list']))
+
+	def get_macs(self, domid):
+		return parse_network_list(self.run(['network-list', str(domid)]))
+
+	def migrate(self, domid, host, port=None):
+		self.run(self.migrate_args(domid, host, port))
+
+class XmBackend(CommandBackend):
+	"""
+	Backend running the xm toolstack.
+	"""
+	command = 'xm'
+
+	def migrate_args(self, domid, host, port):
+		args = ['migrate', str(domid), host, '-l']
+		if port is not None:
+			args += ['-p', str(port)]
+		return args
+
+class XlBackend(CommandBackend):
+	"""
+	Backend running the xl toolstack. xl migrates over ssh, so the port is
+	not used.
+	"""
+	command = 'xl'
+
+	def migrate_args(self, domid, host, port):
+		return ['migrate', str(domid), host]
+
+class LibvirtBackend(object):
+	"""
+	Backend talking to libvirtd. libvirt connections may be shared between
+	threads; errors are raised as libvirt.libvirtError.
+	"""
+
+	def __init__(self, uri='xen:///system', conn=None, migrate_uri='xen+ssh://%s/system'):
+		"""
+		Connect to libvirtd.
+
+		param uri:			URI of the hypervisor.
+		param conn:			libvirt connection to use instead of opening one.
+		param migrate_uri:	URI of another host, with %s for its address; the
+							port of a migration is not used.
+		"""
+		if conn is None:
+			import libvirt
+			conn = libvirt.open(uri)
+		self.conn = conn
+		self.migrate_uri = migrate_uri
+
+	def list_domains(self):
+		domains = []
+		for dom in self.conn.listAllDomains(LIBVIRT_LIST_ACTIVE):
+			# info() gives the memory in use in KB.
+			domains.append(Domain(dom.ID(), dom.name(), dom.info()[2] // 1024))
+		return domains
+
+	def get_macs(self, domid):
+		desc = ElementTree.fromstring(self.conn.lookupByID(domid).XMLDesc(0))
+		return [mac.get('address') for mac in desc.findall('devices/interface/mac')]
+
+	def migrate(self, domid, host, port=None):
+		dom = self.conn.lookupByID(domid)
+		dom.migrateToURI(self.migrate_uri % host, LIBVIRT_MIGRATE_LIVE, None, 0)
+
+class FakeBackend(object):
+	"""
+	Backend holding domains in memory. Migrating a domain removes it and
+	records the migration.
+	"""
+
+	def __init__(self, memory=4096):
+		"""
+		Create a host with only Domain-0.
+
+		param memory:	Memory of Domain-0 in MB.
+		"""
+		self.lock = threading.Lock()
+		# {domid: (name, memory, [MAC address])}
+		self.domains = {0: ('Domain-0', memory, [])}
+		# (domid, host, port) of each migration.
+		self.migrations = []
+
+	def add_domain(self, domid, name, memory, macs=()):
+		"""
+		Add a domain, or replace the one with the same ID.
+		"""
+		self.lock.acquire()
+		try:
+			self.domains[domid] = (name, memory, list(macs))
+		finally:
+			self.lock.release()
+
+	def remove_domain(self, domid):
+		"""
+		Remove a domain.
+		"""
+		self.lock.acquire()
+		try:
+			del self.domains[domid]
+		finally:
+			self.lock.release()
+
+	def list_domains(self):
+		self.lock.acquire()
+		try:
+			return [Domain(domid, name, memory)
+					for domid, (name, memory, macs) in sorted(self.domains.iteritems())]
+		finally:
+			self.lock.release()
+
+	def get_macs(self, domid):
+		self.lock.acquire()
+		try:
+			if domid not in self.domains:
+				raise HypervisorError('no domain %d' % domid)
+			return list(self.domains[domid][2])
+		finally:
+			self.lock.release()
+
+	def migrate(self, domid, host, port=None):
+		self.lock.acquire()
+		try:
+			if domid not in self.domains:
+				raise HypervisorError('no domain %d' % domid)
+			del self.domains[domid]
+			self.migrations.append((domid, host, port))
+		finally:
+			self.lock.release()
+
+# Backends by name, for get_backend.
+BACKENDS = {'xm': XmBackend, 'xl': XlBackend, 'libvirt': LibvirtBackend, 'fake': FakeBackend}
+
+def get_backend(name='xm'):
+	"""
+	Create a backend by name.
+
+	param name:	'xm', 'xl', 'libvirt' or 'fake'.
+	return:		A new backend.
+	"""
+	try:
+		backend = BACKENDS[name]
+	except KeyError:
+		raise ValueError('unknown hypervisor backend %r' % name)
+	return backend()
@@ -15,16 +15,20 @@ class LocationLookupServer():
 	"""
 	BUFF_SIZE = 1024
 
-	def __init__(self, host, port, bridge):
+	def __init__(self, host, port, bridge, inventory=None):
 		"""
 		Initialise the server.
 
 		param host: Address this server should bind to.
 		param port: Port this server should bind to.
 		param bridge: dom0-to-domU bridge with an IP address assigned.
+		param inventory: xen_utils.DomainInventory of the domains on this host; a new one if None.
 		"""
 		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.bridge = bridge
+		if inventory is None:
+			inventory = xen.DomainInventory()
+		self.inventory = inventory
 		self.socket.bind((host, port))
 
 	def listen(self):
@@ -64,8 +68,8 @@ class LocationLookupServer():
 
 		param connection: The connection established by a client after the listen() call.
 		"""
-		num_doms = xen.xm_get_num_doms()
-		mem = xen.xm_get_avail_mem()
+		num_doms = self.inventory.get_num_doms()
+		mem = self.inventory.get_avail_mem()
 		connection.sendall('hypervisor_capacity_response ' + str(num_doms) + ' ' + str(mem))
 
 	def respond(self, connection):
@@ -10,24 +10,39 @@ class MigrationDecision(object):
 	suitability of a VM for migration.
 	"""
 
-	def __init__(self, dpthread, lookup):
+	def __init__(self, dpthread, lookup, rate_window=None, inventory=None):
 		"""
 		Initialise the migration decision class.
 
-		param dpctl: 	dpctl thread for taking measurements.
-		param lookup:	A pre-computed lookup table for communication costs.
+		param dpctl: 		dpctl thread for taking measurements.
+		param lookup:		A pre-computed lookup table for communication costs.
+		param rate_window:	Index of the rate window (see flow_rates) to take
+							throughput from, if the thread's flowset keeps
+							rates; None to derive throughput from the bytes
+							counted since the last reset.
+		param inventory:	xen_utils.DomainInventory of the domains on this
+							host; a new one if None.
 		"""
 		self.dpthread = dpthread
 		self.lookup = lookup
+		self.rate_window = rate_window
+		if (inventory is None):
+			inventory = xen.DomainInventory()
+		self.inventory = inventory
 
-	def round_robin(self, ipaddr):
+	def round_robin(self, ipaddr, entries=None):
 		"""
 		Perform a round-robin decision process for the VM with given IP address.
 
 		param ipaddr:	The IP address of the VM to consider for migration.
+		param entries:	Src and dst flow entries, MAC address and rates of the
+							VM, as returned by get_entries_and_macs; fetched
+							if None.
 		return:			IP address of server to migrate to, None otherwise.
 		"""
-		src, dst, mac = self.get_entries_and_mac(ipaddr)
+		if (entries is None):
+			entries = self.get_entries_and_mac(ipaddr)
+		src, dst, mac, rates = entries
 		values = dict()
 		total_cost = 0
 		total_cost_new = 0
@@ -51,6 +66,12 @@ class MigrationDecision(object):
 					if (hypervisor is None and cost is None):
 						# Can't find hypervisor and associated cost, so can't migrate here.
 						del values[ip]
+					elif (rates is not None):
+						values[ip][0] = rates.get(ip, 0)
+						values[ip][1] = cost
+						values[ip][2] = 2*values[ip][0]*values[ip][1]
+						total_cost = total_cost + values[ip][2]
+						values[ip][3] = hypervisor
 					else:
 						values[ip][1] = cost
 						values[ip][2] = 2*values[ip][0]*values[ip][1] / (current - src[2]).total_seconds()
@@ -60,7 +81,10 @@ class MigrationDecision(object):
 				for ip in dst[1].keys():
 					if not (values.has_key(ip)):
 						if (ip.startswith('')):#192.168.1.')):
-							values[ip] = ([dst[1][ip][0]+dst[1][ip][1], 0, 0, '']) / (current - src[2]).total_seconds()
+							if (rates is not None):
+								values[ip] = [rates.get(ip, 0), 0, 0, '']
+							else:
+								values[ip] = ([dst[1][ip][0]+dst[1][ip][1], 0, 0, '']) / (current - src[2]).total_seconds()
 							### EVALUATION ###
 							hypervisor, cost = self.lookup.communication_cost('192.168.1.4')
 							#hypervisor, cost = self.lookup.communication_cost(ip)
@@ -68,7 +92,7 @@ class MigrationDecision(object):
 							values[ip][2] = 2*values[ip][0]*values[ip][1]
 							total_cost = total_cost + values[ip][2]
 							values[ip][3] = hypervisor
-					else:
+					elif (rates is None):
 						# Cost should already exist - save doing another lookup.
 						values[ip][0] = (values[ip][0] + dst[1][ip][0]+dst[1][ip][1]) / (current - src[2]).total_seconds()
 						values[ip][2] = 2*values[ip][0]*values[ip][1]
@@ -84,15 +108,12 @@ class MigrationDecision(object):
 					capacity = self.lookup.capacity_request(hypervisor)
 					#capacity = self.lookup.capacity_request(hypervisor)
 					if (capacity is not None):
-						doms = xen.xm_get_parsed_doms()
+						dom = self.inventory.get_dom_by_mac(mac)
 						print capacity
-						#print doms
-						for dom in doms:
-							#print dom, mac
-							#print xen.xm_get_mac(dom)
-							if (xen.xm_get_mac(dom) == mac):
-								if (capacity[0] < MAX_DOMS and capacity[1] > xen.xm_get_mem_vmid(dom)):
-									return (mac, hypervisor)
+						#print dom, mac
+						if (dom is not None):
+							if (capacity[0] < MAX_DOMS and capacity[1] > self.inventory.get_mem(dom)):
+								return (mac, hypervisor)
 			return None
 
 			# Calculate new communication cost if migration takes place.
@@ -108,6 +129,20 @@ class MigrationDecision(object):
 			return None
 		return None
 
+	def round_robin_all(self, ipaddrs):
+		"""
+		Perform the round-robin decision process for each of a number of VMs,
+		fetching the flow entries of all of them at once.
+
+		param ipaddrs:	The IP addresses of the VMs to consider for migration.
+		return:			{IP address: decision}, as returned by round_robin.
+		"""
+		entries = self.get_entries_and_macs(ipaddrs)
+		decisions = dict()
+		for ipaddr in ipaddrs:
+			decisions[ipaddr] = self.round_robin(ipaddr, entries[ipaddr])
+		return decisions
+
 	def distributed(self, ipaddr, token):
 		"""
 		Perform a distributed decision process for the VM with given IP address.
@@ -120,22 +155,81 @@ class MigrationDecision(object):
 	def get_entries_and_mac(self, ipaddr):
 		"""
 		Get src and dst entries of the VM with the given IP address, along with
-		its MAC address.
+		its MAC address and rates.
 
 		param ipaddr:	The IP address of the VM to consider for migration.
-		return:			Src and dst flow entries, and MAC address, of the VM,
-							None if no traffic exists.
-		"""
-		src = self.dpthread.copy_and_reset_entries_by_src_ip(ipaddr)
-		dst = self.dpthread.copy_and_reset_entries_by_dst_ip(ipaddr)
-		mac = ""
-		if (src is not None or dst is not None):
-			mac = self.dpthread.get_mac_by_ip(ipaddr)
-		else:
-			# There is no network traffic from the given host; no migration
-			# should take place.
-			return None, None, None
-		return src, dst, mac
+		return:			Src and dst flow entries, MAC address and rates of the
+							VM, as returned by get_entries_and_macs.
+		"""
+		return self.get_entries_and_macs([ipaddr])[ipaddr]
+
+	def get_entries_and_macs(self, ipaddrs):
+		"""
+		Get src and dst entries of each of the VMs with the given IP addresses,
+		along with their MAC addresses and, if a rate window is configured,
+		rates, taking the dpctl thread's lock once.
+
+		param ipaddrs:	The IP addresses of the VMs to consider for migration.
+		return:			{IP address: (src entries, dst entries, MAC address,
+							rates)}, rates as returned by get_rates, or None
+							without a rate window; (None, None, None, None)
+							for a VM with no traffic.
+		"""
+		with_rates = self.rate_window is not None
+		results = self.dpthread.copy_and_reset_entries_by_ips(ipaddrs, with_rates)
+		for ipaddr, entries in results.items():
+			src, dst, mac = entries[:3]
+			if (src is None and dst is None):
+				# There is no network traffic from the given host; no migration
+				# should take place.
+				results[ipaddr] = (None, None, None, None)
+			elif (with_rates):
+				results[ipaddr] = (src, dst, mac, self.merge_rates(*entries[3:]))
+			else:
+				results[ipaddr] = (src, dst, mac, None)
+		return results
+
+	def get_rates(self, ipaddr):
+		"""
+		Get the throughput between the VM with the given IP address and each of
+		its neighbours, in both directions, at the configured rate window.
+
+		param ipaddr:	The IP address of the VM to consider for migration.
+		return:			{neighbour IP address: bytes/sec}; None if the flowset
+							keeps no rates.
+		"""
+		return self.merge_rates(self.dpthread.get_rates_by_src_ip(ipaddr),
+								self.dpthread.get_rates_by_dst_ip(ipaddr))
+
+	def merge_rates(self, src, dst):
+		"""
+		Combine the rates of a VM's src and dst flows at the configured rate
+		window.
+
+		param src:	{dst IP address: rates} of the VM's src flows, or None.
+		param dst:	{src IP address: rates} of the VM's dst flows, or None.
+		return:		{neighbour IP address: bytes/sec}; None if both are None.
+		"""
+		if (src is None and dst is None):
+			return None
+		rates = dict()
+		for peers in (src, dst):
+			if (peers is not None):
+				for ip, values in peers.iteritems():
+					rates[ip] = rates.get(ip, 0) + values[self.rate_window]
+		return rates
+
+	def get_top_peers(self, ipaddr, n):
+		"""
+		Get the neighbours the VM with the given IP address exchanges the most
+		traffic with, from the thread's heavy-hitter tracker.
+
+		param ipaddr:	The IP address of the VM to consider for migration.
+		param n:		Most neighbours to return.
+		return:			List of (neighbour IP address, bytes/sec), highest rate
+							first; None if no heavy hitters are tracked.
+		"""
+		return self.dpthread.get_top_peers(ipaddr, n)
 
 	def get_highest_cost_hypervisor(self, values, cost_ceil):
 		"""
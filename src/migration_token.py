@@ -3,7 +3,6 @@ import migration_decision as migration
 import netaddr
 import socket
 import struct
-import xen_utils as xen
 
 RECV_BUF_SIZE = 1024
 TOKEN_PORT = 8011
@@ -161,11 +160,13 @@ class TokenServer(object):
 			return False
 		mac = hypervisor[0]
 		dst = hypervisor[1]
-		doms = xen.xm_get_parsed_doms()
-		for dom in doms:
-			if (xen.xm_get_mac(dom) == mac):
-				live_migrate(dom, dst, None)
-				return True
+		inventory = self.migration.inventory
+		dom = inventory.get_dom_by_mac(mac)
+		if (dom is not None):
+			inventory.backend.migrate(dom, dst)
+			# The domain has left this host.
+			inventory.invalidate()
+			return True
 
 	def forward_token(self, host, port, token):
 		"""
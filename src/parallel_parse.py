@@ -0,0 +1,103 @@
+import collections
+import dpctl
+import itertools
+import multiprocessing
+
+"""
+Parsing of the changed lines of large flow dumps in a pool of processes; an
+optional companion to DpCtl (see DpCtl's parser).
+
+Lines are sent to the workers in chunks, and each worker returns the fields
+of each line as a tuple (see dpctl.parse_dp_record), from which the parent
+builds FlowEntry objects in order. Lines are read a chunk at a time and
+results are taken chunk by chunk, so the parent applies the first chunks
+while the workers are still parsing later ones, and only a bounded number
+of chunks is ever held. Pickling lines and records costs about as much as
+a third of parsing them, so small dumps are parsed in the parent.
+"""
+
+# Lines sent to a worker at a time.
+CHUNK_SIZE = 4096
+# Fewest changed lines in a dump for the pool to be used.
+MIN_LINES = 20000
+
+def parse_chunk(lines):
+	"""
+	Parse a chunk of lines in a worker.
+
+	param lines:	List of lines of 'ovs-dpctl dump-flows' output.
+	return:			List of dpctl.parse_dp_record results, one per line.
+	"""
+	parse = dpctl.parse_dp_record
+	return [parse(line) for line in lines]
+
+def build_entries(records):
+	"""
+	Build the entries of a chunk parsed by a worker.
+
+	param records:	List returned by parse_chunk.
+	return:			Generator of a FlowEntry, or None, per record.
+	"""
+	FlowEntry = dpctl.FlowEntry
+	for record in records:
+		if record is None:
+			yield None
+		else:
+			yield FlowEntry(*record)
+
+class ParallelParser(object):
+	"""
+	Class parsing lines of flow dumps in a multiprocessing pool. The pool is
+	started when the parser is created, which should be before any threads
+	are, as the workers are forked from the creating process.
+	"""
+
+	def __init__(self, processes=None, chunk_size=CHUNK_SIZE, min_lines=MIN_LINES,
+				 max_chunks=None):
+		"""
+		Initialise the parser, starting its worker processes.
+
+		param processes:	Number of workers; one per CPU if None.
+		param chunk_size:	Lines sent to a worker at a time.
+		param min_lines:	Fewest lines for the pool to be used; fewer are
+							parsed in the calling process.
+		param max_chunks:	Most chunks sent to the workers and not yet taken
+							back; two per worker if None.
+		"""
+		self.processes = processes or multiprocessing.cpu_count()
+		self.chunk_size = chunk_size
+		self.min_lines = min_lines
+		self.max_chunks = max_chunks or 2 * self.processes
+		self.pool = multiprocessing.Pool(self.processes)
+
+	def parse(self, lines):
+		"""
+		Parse lines of a flow dump, reading them as they are needed: up to
+		min_lines to choose where to parse them, then a chunk at a time, at
+		most max_chunks ahead of the entries taken.
+
+		param lines:	Iterable over lines of 'ovs-dpctl dump-flows' output.
+		return:			Generator of a FlowEntry, or None, per line, in order.
+		"""
+		lines = iter(lines)
+		head = list(itertools.islice(lines, self.min_lines))
+		if len(head) < self.min_lines:
+			for line in head:
+				yield dpctl.parse_dp_flow(line)
+			return
+		pending = collections.deque()
+		for chunk in dpctl.batched(itertools.chain(head, lines), self.chunk_size):
+			pending.append(self.pool.apply_async(parse_chunk, (chunk,)))
+			if len(pending) >= self.max_chunks:
+				for entry in build_entries(pending.popleft().get()):
+					yield entry
+		while pending:
+			for entry in build_entries(pending.popleft().get()):
+				yield entry
+
+	def close(self):
+		"""
+		Stop the worker processes.
+		"""
+		self.pool.terminate()
+		self.pool.join()
@@ -0,0 +1,236 @@
+import itertools
+import math
+import time
+
+"""
+Instrumentation of the flow poller; an optional companion to DpReadClass
+(see its metrics), which costs nothing beyond a test per poll and per
+batch of flows when not given.
+
+Per poll it times the dump (starting it and waiting for its lines), the
+parsing, the waits for and holds of the lock, and the poll as a whole, each
+into a Histogram, counts the lines read, parsed and skipped, and keeps the
+resident flow counts. Parse time is what is left of the time spent taking
+in a dump once the other three are taken out, so nothing is timed per line.
+
+The counters are written only by the polling thread; get_stats copies
+them, so it may be called from any thread while the poller runs.
+"""
+
+# Lines of a dump read from its source at a time, to time the reading.
+DUMP_CHUNK = 512
+# Upper bound of the lowest histogram bucket, in seconds; each further
+# bucket doubles it, and the last takes everything above.
+BUCKET_BASE = 1e-6
+BUCKETS = 28
+
+class Histogram(object):
+	"""
+	Class counting durations in buckets of doubling width, for percentiles
+	that are exact to within a factor of two, in fixed memory.
+	"""
+	__slots__ = ('counts', 'count', 'total', 'max')
+
+	def __init__(self):
+		self.counts = [0] * BUCKETS
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, seconds):
+		"""
+		Count a duration.
+
+		param seconds:	The duration.
+		"""
+		if seconds <= BUCKET_BASE:
+			index = 0
+		else:
+			index = min(BUCKETS - 1, int(math.ceil(math.log(seconds / BUCKET_BASE, 2))))
+		self.counts[index] += 1
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	def percentile(self, fraction):
+		"""
+		Get the upper bound of the bucket holding a percentile.
+
+		param fraction:	Fraction of durations at or below the percentile.
+		return:			Seconds; no more than the longest duration, and 0.0
+						if none was counted.
+		"""
+		rank = fraction * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if count and seen >= rank:
+				return min(BUCKET_BASE * 2 ** index, self.max)
+		return self.max
+
+	def as_dict(self):
+		"""
+		return:	Dictionary of the count, total, mean, p50, p99 and longest
+				duration, in seconds.
+		"""
+		mean = 0.0
+		if self.count:
+			mean = self.total / self.count
+		return {'count': self.count,
+				'total': self.total,
+				'mean': mean,
+				'p50': self.percentile(0.5),
+				'p99': self.percentile(0.99),
+				'max': self.max}
+
+class TimedDump(object):
+	"""
+	Class wrapping the lines of a dump, timing how long is spent starting
+	the dump and waiting for its lines, and counting them. Lines are read
+	from the source DUMP_CHUNK at a time, so only each chunk is timed.
+	"""
+	__slots__ = ('lines', 'seconds', 'count')
+
+	def __init__(self, dump):
+		"""
+		Start a dump.
+
+		param dump:	Function starting a dump and returning its lines (e.g.
+					dpctl.DpCtl.iter_dp_flows).
+		"""
+		start = time.time()
+		self.lines = iter(dump())
+		self.seconds = time.time() - start
+		self.count = 0
+
+	def __iter__(self):
+		return itertools.chain.from_iterable(self.chunks())
+
+	def chunks(self):
+		"""
+		return:	Generator of lists of lines.
+		"""
+		lines = self.lines
+		while True:
+			start = time.time()
+			chunk = list(itertools.islice(lines, DUMP_CHUNK))
+			self.seconds += time.time() - start
+			if not chunk:
+				return
+			self.count += len(chunk)
+			yield chunk
+
+class PollMetrics(object):
+	"""
+	Class holding the counters and histograms of a poller.
+	"""
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		"""
+		Clear every counter and histogram.
+		"""
+		self.polls = 0
+		self.dump = Histogram()
+		self.parse = Histogram()
+		self.lock_wait = Histogram()
+		self.lock_hold = Histogram()
+		self.poll = Histogram()
+		self.lines = 0
+		self.parsed = 0
+		self.unchanged = 0
+		self.skipped = 0
+		self.resident = dict()
+		# Lock time taken by the ingest in progress, and when it and the
+		# poll in progress started, and when the lock was last acquired.
+		self.ingest_lock = 0.0
+		self.ingest_start = None
+		self.poll_start = None
+		self.acquired = None
+
+	def begin_poll(self):
+		"""
+		Start timing a poll.
+		"""
+		self.poll_start = time.time()
+
+	def end_poll(self, eviction_stats):
+		"""
+		Complete a poll.
+
+		param eviction_stats:	Counts of flows held, as
+								dpctl.Flows.get_eviction_stats.
+		"""
+		self.polls += 1
+		self.poll.add(time.time() - self.poll_start)
+		self.resident = eviction_stats
+
+	def begin_ingest(self):
+		"""
+		Start timing the parsing and applying of a dump.
+		"""
+		self.ingest_lock = 0.0
+		self.ingest_start = time.time()
+
+	def end_ingest(self, lines, stats):
+		"""
+		Complete the parsing and applying of a dump.
+
+		param lines:	The lines of the dump; a TimedDump if the dump was
+						timed.
+		param stats:	dpctl.PollStats of the dump.
+		"""
+		elapsed = time.time() - self.ingest_start
+		dump = getattr(lines, 'seconds', 0.0)
+		self.dump.add(dump)
+		self.parse.add(max(0.0, elapsed - dump - self.ingest_lock))
+		parsed = stats.new + stats.changed
+		self.parsed += parsed
+		self.unchanged += stats.unchanged
+		count = getattr(lines, 'count', None)
+		if count is not None:
+			self.lines += count
+			self.skipped += count - parsed - stats.unchanged
+
+	def acquire(self, lock):
+		"""
+		Acquire a lock, timing the wait for it.
+		"""
+		start = time.time()
+		lock.acquire()
+		self.acquired = time.time()
+		wait = self.acquired - start
+		self.lock_wait.add(wait)
+		self.ingest_lock += wait
+
+	def release(self, lock):
+		"""
+		Release a lock taken by acquire, timing how long it was held.
+		"""
+		lock.release()
+		hold = time.time() - self.acquired
+		self.lock_hold.add(hold)
+		self.ingest_lock += hold
+
+	def get_stats(self):
+		"""
+		Get a copy of the counters.
+
+		return:	Dictionary of polls taken; lines read, parsed (new or
+				changed flows), unchanged and skipped (not IPv4 flows); the
+				resident flow counts of the last poll; and of the dump,
+				parse, lock_wait, lock_hold and poll histograms, as
+				Histogram.as_dict.
+		"""
+		stats = {'polls': self.polls,
+				 'lines': self.lines,
+				 'parsed': self.parsed,
+				 'unchanged': self.unchanged,
+				 'skipped': self.skipped,
+				 'resident': dict(self.resident)}
+		for name in ('dump', 'parse', 'lock_wait', 'lock_hold', 'poll'):
+			stats[name] = getattr(self, name).as_dict()
+		return stats
@@ -0,0 +1,103 @@
+from array import array
+
+"""
+Export of the traffic between all pairs of IP addresses as a sparse matrix.
+"""
+
+class TrafficMatrix(object):
+	"""
+	Class representing the traffic between IP addresses as a square sparse
+	matrix in compressed sparse row (CSR) form. The flows from ips[i] go to
+	ips[indices[k]] and carry data[k], for k in indptr[i]:indptr[i + 1].
+
+	indptr and indices are arrays of C longs and data of doubles, so NumPy can
+	wrap them without copying (see to_numpy).
+	"""
+
+	def __init__(self, ips, indptr, indices, data):
+		"""
+		Initialise a matrix.
+
+		param ips:		IP address of each row and column index.
+		param indptr:	array('l') of len(ips) + 1 row offsets into indices.
+		param indices:	array('l') of column indexes.
+		param data:		array('d') of values.
+		"""
+		self.ips = ips
+		self.indptr = indptr
+		self.indices = indices
+		self.data = data
+
+	def __len__(self):
+		"""
+		return:	Number of (src, dst) pairs held.
+		"""
+		return len(self.data)
+
+	def row(self, srcIp):
+		"""
+		Get the flows from one IP address.
+
+		param srcIp:	Source IP address.
+		return:			{dst ip: value}; empty if srcIp has no flows.
+		"""
+		flows = dict()
+		try:
+			i = self.ips.index(srcIp)
+		except ValueError:
+			return flows
+		ips = self.ips
+		for k in xrange(self.indptr[i], self.indptr[i + 1]):
+			flows[ips[self.indices[k]]] = self.data[k]
+		return flows
+
+	def to_numpy(self):
+		"""
+		Wrap the arrays as NumPy arrays, without copying. Requires NumPy.
+
+		return:	(indptr, indices, data) NumPy arrays.
+		"""
+		import numpy
+		return (numpy.frombuffer(self.indptr, dtype=numpy.dtype('l')),
+				numpy.frombuffer(self.indices, dtype=numpy.dtype('l')),
+				numpy.frombuffer(self.data, dtype=numpy.float64))
+
+	def to_scipy(self):
+		"""
+		Build a SciPy sparse matrix over the arrays. Requires SciPy.
+
+		return:	scipy.sparse.csr_matrix of shape (len(ips), len(ips)).
+		"""
+		import scipy.sparse
+		indptr, indices, data = self.to_numpy()
+		return scipy.sparse.csr_matrix((data, indices, indptr),
+									   shape=(len(self.ips), len(self.ips)))
+
+def build_matrix(rows):
+	"""
+	Build a TrafficMatrix. Rows take the first indexes, in the order given;
+	IP addresses seen only as peers follow.
+
+	param rows:	List of (src ip, iterable of (dst ip, value)); each iterable
+				is consumed once.
+	return:		The TrafficMatrix.
+	"""
+	ips = [ipaddr for ipaddr, flows in rows]
+	index = dict()
+	for i, ipaddr in enumerate(ips):
+		index[ipaddr] = i
+	indptr = array('l', [0])
+	indices = array('l')
+	data = array('d')
+	for ipaddr, flows in rows:
+		for peer, value in flows:
+			col = index.get(peer)
+			if col is None:
+				col = index[peer] = len(ips)
+				ips.append(peer)
+			indices.append(col)
+			data.append(value)
+		indptr.append(len(data))
+	# Peers without flows of their own have empty rows.
+	indptr.extend([len(data)] * (len(ips) + 1 - len(indptr)))
+	return TrafficMatrix(ips, indptr, indices, data)
@@ -1,9 +1,21 @@
 #!/usr/bin/python
 import sys
 sys.path.insert(1, '/usr/lib/xen-default/lib/python/')
-import subprocess as sub
-from xen.xm import main 
-from xen.xm import migrate
+import hypervisor
+import logging
+import threading
+import time
+
+# Seconds a DomainInventory is trusted for before it is refreshed.
+INVENTORY_TTL = 10.0
+# Xenstore directory of the domains, watched by XenstoreInventory, and the
+# token its watch is registered with.
+DOMAIN_PATH = '/local/domain'
+WATCH_TOKEN = 'plan-inventory'
+# Seconds between attempts to re-register a failed xenstore watch.
+WATCH_RETRY = 1.0
+
+log = logging.getLogger(__name__)
 
 class OutputBuffer:
     def __init__(self):
@@ -13,15 +25,23 @@ class OutputBuffer:
     def __str__(self):
 	return ''.join(self.value).strip()
 
-def xm_get_doms():
+def xm_run(args):
+	"""
+	Run xm in a subprocess, rather than capturing what xm's own module
+	prints, which would swap sys.stdout under every other thread.
+
+	param args:	Arguments of the command.
+	return:		OutputBuffer of its output, a line per write.
+	"""
 	out = OutputBuffer()
-	stdout_old = sys.stdout
-	sys.stdout = out
-	args = []
-	main._run_cmd(main.xm_list, 'list', args)
-	sys.stdout = stdout_old
+	for line in hypervisor.XmBackend().run(args):
+		if line:
+			out.write(line + '\n')
 	return out
 
+def xm_get_doms():
+	return xm_run(['list'])
+
 def xm_get_parsed_doms():
 	out = xm_get_doms()
 	return xm_parse_doms(out)
@@ -37,13 +57,7 @@ def xm_parse_doms(buffer):
 	return domus
 
 def xm_get_mac(vmid):
-	out = OutputBuffer()
-	stdout_old = sys.stdout
-	sys.stdout = out
-	args = [str(vmid)]
-	main._run_cmd(main.xm_network_list, 'network-list', args)
-	sys.stdout = stdout_old
-	return xm_parse_mac(out)
+	return xm_parse_mac(xm_run(['network-list', str(vmid)]))
 
 def xm_parse_mac(buffer):
 	mac = ''
@@ -93,27 +107,365 @@ def xm_get_avail_mem():
 		mem_used = mem_used + domus[1][key]
 	return mem_avail-mem_used
 
-def live_migrate(vmid, dstIp, port):
-	#out = OutputBuffer()
-	#stdout_old = sys.stdout
-	#args = [str(vmid), dstIp, '-l']
-	#if port is not None:
-	#	args.append('-p')
-	#	args.append(str(port))
-	#cmd = main.xm_lookup_cmd('migrate')
-	#main._run_cmd(cmd, 'migrate', args)
-	#sys.stdout = stdout_old
-	#return out
-	cmd = 'xm migrate ' + str(vmid) + ' ' + dstIp + ' -l'
-	if port is not None:
-		cmd = cmd + ' -p ' + str(port)
-	proc = sub.Popen(cmd, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
-	lines = proc.stderr.readlines()
-	return lines
+class DomainInventory(object):
+	"""
+	Class caching the domains of this host, indexed by MAC address and by
+	domain ID, so that lookups made while deciding on a migration make no
+	hypervisor queries. A refresh lists the domains once and their network
+	interfaces once per domain; it happens on the first lookup made more
+	than ttl seconds after the last refresh, or after invalidate.
+	"""
+
+	def __init__(self, ttl=INVENTORY_TTL, backend=None, clock=time.time):
+		"""
+		Initialise an empty inventory; nothing is listed until a lookup.
+
+		param ttl:		Seconds a refresh is trusted for; None to trust it
+						until invalidated.
+		param backend:	hypervisor backend to list domains with, also used
+						to migrate them; the default backend if None.
+		param clock:	Function returning the current time in seconds.
+		"""
+		if backend is None:
+			backend = hypervisor.get_backend()
+		self.ttl = ttl
+		self.backend = backend
+		self.clock = clock
+		self.lock = threading.Lock()
+		self.refreshed = None
+		self.refreshes = 0
+		self.total_mem = 0
+		# {domid: memory in MB}, {domid: [MAC address]} and {MAC address: domid}.
+		self.mems = dict()
+		self.macs = dict()
+		self.doms_by_mac = dict()
+
+	def invalidate(self):
+		"""
+		Have the next lookup refresh the inventory, e.g. after a domain has
+		been migrated away or started.
+		"""
+		self.lock.acquire()
+		self.refreshed = None
+		self.lock.release()
+
+	def refresh(self):
+		"""
+		List the domains and their network interfaces.
+		"""
+		self.lock.acquire()
+		try:
+			self._refresh()
+		finally:
+			self.lock.release()
+
+	def _refresh(self):
+		"""
+		As refresh; called with the lock held.
+		"""
+		total_mem = 0
+		mems = dict()
+		for domain in self.backend.list_domains():
+			if domain.domid == 0:
+				total_mem = domain.memory
+			else:
+				mems[domain.domid] = domain.memory
+		macs = dict()
+		doms_by_mac = dict()
+		for domid in mems.keys():
+			try:
+				macs[domid] = [mac.lower() for mac in self.backend.get_macs(domid)]
+			except hypervisor.HypervisorError:
+				# The domain went away after it was listed.
+				del mems[domid]
+				continue
+			for mac in macs[domid]:
+				doms_by_mac[mac] = domid
+		self.total_mem = total_mem
+		self.mems = mems
+		self.macs = macs
+		self.doms_by_mac = doms_by_mac
+		self.refreshed = self.clock()
+		self.refreshes += 1
+
+	def _fresh(self):
+		"""
+		Refresh the inventory if it is stale; called with the lock held.
+		"""
+		if self.refreshed is None or \
+				(self.ttl is not None and self.clock() - self.refreshed >= self.ttl):
+			self._refresh()
+
+	def get_dom_by_mac(self, mac):
+		"""
+		Get the domain with a network interface of the given MAC address.
+
+		param mac:	MAC address.
+		return:		Domain ID; None if no domain has the address.
+		"""
+		self.lock.acquire()
+		try:
+			self._fresh()
+			return self.doms_by_mac.get(mac.lower())
+		finally:
+			self.lock.release()
+
+	def get_macs(self, domid):
+		"""
+		Get the MAC addresses of a domain.
+
+		param domid:	Domain ID.
+		return:			List of MAC addresses; None if there is no such domain.
+		"""
+		self.lock.acquire()
+		try:
+			self._fresh()
+			return self.macs.get(domid)
+		finally:
+			self.lock.release()
+
+	def get_mem(self, domid):
+		"""
+		Get the memory of a domain.
+
+		param domid:	Domain ID.
+		return:			Memory in MB; None if there is no such domain.
+		"""
+		self.lock.acquire()
+		try:
+			self._fresh()
+			return self.mems.get(domid)
+		finally:
+			self.lock.release()
+
+	def get_doms(self):
+		"""
+		return:	List of the IDs of the domains other than Domain-0.
+		"""
+		self.lock.acquire()
+		try:
+			self._fresh()
+			return self.mems.keys()
+		finally:
+			self.lock.release()
+
+	def get_num_doms(self):
+		"""
+		return:	Number of domains other than Domain-0.
+		"""
+		return len(self.get_doms())
+
+	def get_avail_mem(self):
+		"""
+		return:	Memory of Domain-0 less that of the other domains, in MB, as
+				xm_get_avail_mem.
+		"""
+		self.lock.acquire()
+		try:
+			self._fresh()
+			return self.total_mem - sum(self.mems.itervalues())
+		finally:
+			self.lock.release()
+
+class XenstoreInventory(DomainInventory):
+	"""
+	DomainInventory kept current by a watch on the domains' xenstore
+	entries rather than by listing them with xm. The domains are read from
+	xenstore once, and after that a thread reads only the domain named by
+	each change to its memory target or network interfaces, and drops a
+	domain when its directory is removed, so lookups never wait on xenstore.
+
+	Memory is the domain's memory target, in MB as 'xm list' gives it.
+
+	Should reading the watch fail, the error is logged and counted in
+	errors, and the watch is registered again, which re-reads every domain,
+	so that changes made while it was failing are not missed.
+	"""
+
+	def __init__(self, xs=None, watch=True, backend=None):
+		"""
+		Read the domains from xenstore and start watching for changes.
+
+		param xs:		Xenstore handle, as xen.lowlevel.xs.xs(); a new one if
+						None.
+		param watch:	Whether to start the thread handling watch events; if
+						not, they must be passed to handle.
+		param backend:	hypervisor backend to migrate domains with; the
+						default backend if None.
+		"""
+		super(XenstoreInventory, self).__init__(ttl=None, backend=backend)
+		if xs is None:
+			from xen.lowlevel import xs as xenstore
+			xs = xenstore.xs()
+		self.xs = xs
+		self.events = 0
+		self.errors = 0
+		self.closed = False
+		# Watch before reading, so that no change is missed in between.
+		xs.watch(DOMAIN_PATH, WATCH_TOKEN)
+		self.refresh()
+		self.thread = None
+		if watch:
+			self.thread = threading.Thread(target=self.run)
+			self.thread.daemon = True
+			self.thread.start()
+
+	def _fresh(self):
+		"""
+		The inventory is always current; nothing to do.
+		"""
+		pass
+
+	def invalidate(self):
+		"""
+		Read every domain from xenstore again.
+		"""
+		self.refresh()
+
+	def read_domain(self, domid):
+		"""
+		Read a domain's memory target and MAC addresses from xenstore.
+
+		param domid:	Domain ID.
+		return:			(memory in MB, [MAC address]); None if the domain's
+						directory is gone.
+		"""
+		xs = self.xs
+		base = '%s/%d' % (DOMAIN_PATH, domid)
+		if xs.ls('', base) is None:
+			return None
+		target = xs.read('', base + '/memory/target')
+		mem = 0
+		if target:
+			mem = int(target) // 1024
+		macs = []
+		for vif in xs.ls('', base + '/device/vif') or []:
+			mac = xs.read('', '%s/device/vif/%s/mac' % (base, vif))
+			if mac:
+				macs.append(mac.lower())
+		return mem, macs
+
+	def _refresh(self):
+		"""
+		Read every domain from xenstore; called with the lock held.
+		"""
+		total_mem = 0
+		mems = dict()
+		macs = dict()
+		doms_by_mac = dict()
+		for name in self.xs.ls('', DOMAIN_PATH) or []:
+			domid = int(name)
+			domain = self.read_domain(domid)
+			if domain is None:
+				continue
+			if domid == 0:
+				total_mem = domain[0]
+				continue
+			mems[domid], macs[domid] = domain
+			for mac in macs[domid]:
+				doms_by_mac[mac] = domid
+		self.total_mem = total_mem
+		self.mems = mems
+		self.macs = macs
+		self.doms_by_mac = doms_by_mac
+		self.refreshed = self.clock()
+		self.refreshes += 1
+
+	def update_domain(self, domid):
+		"""
+		Read one domain from xenstore again, adding, updating or dropping it.
+
+		param domid:	Domain ID.
+		"""
+		domain = self.read_domain(domid)
+		self.lock.acquire()
+		try:
+			if domid == 0:
+				if domain is not None:
+					self.total_mem = domain[0]
+				return
+			for mac in self.macs.pop(domid, ()):
+				if self.doms_by_mac.get(mac) == domid:
+					del self.doms_by_mac[mac]
+			self.mems.pop(domid, None)
+			if domain is not None:
+				self.mems[domid], self.macs[domid] = domain
+				for mac in domain[1]:
+					self.doms_by_mac[mac] = domid
+		finally:
+			self.lock.release()
+
+	def handle(self, path):
+		"""
+		Handle a watch event: changes to a domain's directory, memory or
+		network interfaces update that domain, and others are ignored.
+
+		param path:	Xenstore path the event is for.
+		"""
+		try:
+			if path == DOMAIN_PATH:
+				# The watch fires on the domains' directory when registered.
+				self.refresh()
+				return
+			parts = path[len(DOMAIN_PATH) + 1:].split('/')
+			try:
+				domid = int(parts[0])
+			except ValueError:
+				return
+			if len(parts) == 1 or parts[1] == 'memory' or parts[1:3] == ['device', 'vif']:
+				self.update_domain(domid)
+		finally:
+			# Counted once handled, so that callers can wait on the count.
+			self.events += 1
+
+	def run(self):
+		"""
+		Handle watch events until closed, re-registering the watch after an
+		error.
+		"""
+		while not self.closed:
+			try:
+				path, token = self.xs.read_watch()
+				if token == WATCH_TOKEN:
+					self.handle(path)
+			except Exception:
+				if self.closed:
+					return
+				self.errors += 1
+				log.exception('xenstore watch failed; re-registering it')
+				self.rewatch()
+
+	def rewatch(self):
+		"""
+		Register the watch again, retrying every WATCH_RETRY seconds until it
+		succeeds or the inventory is closed. Registering fires the watch on
+		the domains' directory, which re-reads every domain.
+		"""
+		while not self.closed:
+			try:
+				self.xs.unwatch(DOMAIN_PATH, WATCH_TOKEN)
+			except Exception:
+				pass
+			try:
+				self.xs.watch(DOMAIN_PATH, WATCH_TOKEN)
+				return
+			except Exception:
+				if self.closed:
+					return
+				self.errors += 1
+				log.exception('cannot re-register the xenstore watch')
+				time.sleep(WATCH_RETRY)
+
+	def close(self):
+		"""
+		Stop watching xenstore and release the handle.
+		"""
+		self.closed = True
+		self.xs.unwatch(DOMAIN_PATH, WATCH_TOKEN)
+		self.xs.close()
 
 #print 'Num doms: ' + str(xm_get_num_doms())
 #print 'Mem: ' + str(xm_get_mem())
 #print 'Mem VMID 4: ' + str(xm_get_mem_vmid(4))
 #print 'Avail mem: ' + str(xm_get_avail_mem())
-#print str(live_migrate(5, '192.168.1.4', None))
 
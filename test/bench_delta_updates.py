@@ -0,0 +1,77 @@
+import add_to_sys_path
+import bench_dpctl_parse
+import dpctl
+import random
+import re
+import sys
+import time
+
+"""
+Benchmark of steady-state polls: re-applying every flow of each dump (as
+DpCtl.update_entries used to) against skipping datapath flows whose byte
+count is unchanged since the previous poll.
+
+Usage: python bench_delta_updates.py [flows [changed fraction [polls]]]
+       (default: 100000 0.05 10)
+"""
+
+BYTES_RE = re.compile(r'bytes:(\d+)')
+
+def next_dump(lines, fraction, rand):
+	"""
+	Build the next poll's dump, with a fraction of the flows having moved.
+
+	param lines:	The previous dump.
+	param fraction:	Fraction of lines whose byte count grows.
+	param rand:		Random generator.
+	return:			List of dump lines.
+	"""
+	grow = lambda m: 'bytes:%d' % (int(m.group(1)) + rand.randint(1, 1500))
+	return [BYTES_RE.sub(grow, line, 1) if rand.random() < fraction else line
+			for line in lines]
+
+def full_poll(ctl, lines):
+	"""
+	Apply every flow of a dump.
+	"""
+	ctl.apply_entries(dpctl.iter_dp_flow_entries(lines))
+
+def delta_poll(ctl, lines):
+	"""
+	Apply only the new and changed flows of a dump.
+	"""
+	ctl.update_entries(lines)
+
+def time_polls(poll, dumps):
+	"""
+	Time a series of polls after a first, warm-up poll.
+
+	return:	Seconds per poll.
+	"""
+	ctl = dpctl.DpCtl('xenbr0', source=object())
+	poll(ctl, dumps[0])
+	start = time.time()
+	for lines in dumps[1:]:
+		poll(ctl, lines)
+	return (time.time() - start) / (len(dumps) - 1), ctl
+
+def main(num_flows, fraction, polls):
+	rand = random.Random(1)
+	dumps = [bench_dpctl_parse.make_dump(num_flows)]
+	for i in range(polls):
+		dumps.append(next_dump(dumps[-1], fraction, rand))
+	print '%d flows, %.0f%% changed per poll, %d polls' % (num_flows, fraction * 100, polls)
+	print '%-8s %12s %16s' % ('mode', 'ms/poll', 'updates/poll')
+	full, ctl = time_polls(full_poll, dumps)
+	updates = len(list(dpctl.iter_dp_flow_entries(dumps[-1])))
+	print '%-8s %12.1f %16d' % ('full', full * 1000, updates)
+	delta, ctl = time_polls(delta_poll, dumps)
+	stats = ctl.poll_stats
+	print '%-8s %12.1f %16d   %r' % ('delta', delta * 1000, stats.new + stats.changed, stats)
+	print 'speed-up: %.1fx' % (full / delta)
+
+if (__name__ == '__main__'):
+	args = sys.argv[1:]
+	defaults = [100000, 0.05, 10]
+	types = [int, float, int]
+	main(*[types[i](arg) for i, arg in enumerate(args)] + defaults[len(args):])
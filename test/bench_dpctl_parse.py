@@ -0,0 +1,103 @@
+import add_to_sys_path
+import dpctl
+import random
+import sys
+import time
+
+"""
+Benchmark of 'ovs-dpctl dump-flows' parsing: the field-keyed parser in dpctl
+against the positional split(',') parser it replaced.
+
+Usage: python bench_dpctl_parse.py [flows ...]   (default: 10000 100000)
+"""
+
+L4 = {6: 'tcp(src=%d,dst=%d)', 17: 'udp(src=%d,dst=%d)'}
+
+def make_dump(num_flows, seed=1):
+	"""
+	Build a synthetic dump with a mix of TCP, UDP, IGMP and ARP flows.
+
+	param num_flows:	Number of lines to generate.
+	param seed:			Seed for the random generator.
+	return:				List of dump lines.
+	"""
+	rand = random.Random(seed)
+	lines = []
+	for i in range(num_flows):
+		src = rand.randint(1, 254)
+		dst = rand.randint(1, 254)
+		eth = 'in_port(%d),eth(src=00:16:3e:00:00:%02x,dst=00:16:3e:00:01:%02x),' % (src % 8, src, dst)
+		stats = ', packets:%d, bytes:%d, used:0.%03ds, actions:%d\n' % (i, i * 90, i % 1000, dst % 8)
+		kind = i % 20
+		if kind == 0:
+			lines.append(eth + 'eth_type(0x0806),arp(sip=10.0.0.%d,tip=10.0.1.%d,op=1,'
+						 'sha=00:16:3e:00:00:%02x,tha=00:00:00:00:00:00)' % (src, dst, src) + stats)
+		elif kind == 1:
+			lines.append(eth + 'eth_type(0x0800),ipv4(src=10.0.0.%d,dst=224.0.0.22,proto=2,'
+						 'tos=0xc0,ttl=1,frag=no)' % src + stats)
+		else:
+			proto = 6 if kind % 2 else 17
+			lines.append(eth + 'eth_type(0x0800),ipv4(src=10.0.0.%d,dst=10.0.1.%d,proto=%d,'
+						 'tos=0,ttl=64,frag=no),' % (src, dst, proto)
+						 + L4[proto] % (rand.randint(1024, 65535), 80) + stats)
+	return lines
+
+def legacy_parse(line):
+	"""
+	The positional parser previously used by DpCtl.update_entries.
+	"""
+	line = line.split(',')
+	if (line[3] == 'eth_type(0x0800)'):
+		srcMac = line[1][8:]
+		dstMac = line[2][4:-1]
+		srcIp = line[4][9:]
+		dstIp = line[5][4:]
+		if not (line[13].strip().startswith('bytes')):
+			bytes = int(line[11].strip()[6:])
+		else:
+			bytes = int(line[13].strip()[6:])
+		return dpctl.FlowEntry(srcMac, dstMac, srcIp, dstIp, bytes)
+	return None
+
+def time_parser(parse, lines, repeat=3):
+	"""
+	Time a parser over a dump, keeping the best of several runs.
+
+	return:	Lines parsed per second.
+	"""
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		for line in lines:
+			parse(line)
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return len(lines) / best
+
+def time_update_entries(lines, parse):
+	"""
+	Time a full DpCtl.update_entries pass using the given parser.
+
+	return:	Lines ingested per second.
+	"""
+	saved = dpctl.parse_dp_flow
+	dpctl.parse_dp_flow = parse
+	try:
+		ctl = dpctl.DpCtl('xenbr0')
+		start = time.time()
+		ctl.update_entries(lines)
+		return len(lines) / (time.time() - start)
+	finally:
+		dpctl.parse_dp_flow = saved
+
+def main(sizes):
+	print '%-8s %-14s %14s %14s' % ('flows', 'parser', 'parse lines/s', 'ingest lines/s')
+	for size in sizes:
+		lines = make_dump(size)
+		for name, parse in (('positional', legacy_parse), ('field-keyed', dpctl.parse_dp_flow)):
+			print '%-8d %-14s %14.0f %14.0f' % (size, name, time_parser(parse, lines),
+											 time_update_entries(lines, parse))
+
+if (__name__ == '__main__'):
+	main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,74 @@
+import add_to_sys_path
+import bench_dpctl_parse
+import flow_source
+import os
+import resource
+import shutil
+import subprocess as sub
+import sys
+import tempfile
+import time
+
+"""
+Benchmark of flow sources: a dump per poll through a forked shell (the old
+get_dp_flows), a forked command without a shell, and a persistent unixctl
+connection. ovs-dpctl and ovs-vswitchd are stood in for by 'cat' and by
+fake_unixctl.py running in a child process.
+
+Usage: python bench_flow_source.py [flows [dumps]]   (default: 1000 200)
+"""
+
+def cpu_times():
+	"""
+	return:	(CPU seconds of this process, CPU seconds of reaped children).
+	"""
+	own = resource.getrusage(resource.RUSAGE_SELF)
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+def time_source(source, dumps):
+	"""
+	Take a number of dumps from a source.
+
+	return:	(seconds per dump, agent CPU per dump, child CPU per dump).
+	"""
+	list(source.dump())
+	own, children = cpu_times()
+	start = time.time()
+	for i in range(dumps):
+		list(source.dump())
+	elapsed = time.time() - start
+	own_end, children_end = cpu_times()
+	return elapsed / dumps, (own_end - own) / dumps, (children_end - children) / dumps
+
+def main(num_flows, dumps):
+	tmpdir = tempfile.mkdtemp()
+	try:
+		dump_file = os.path.join(tmpdir, 'dump.txt')
+		f = open(dump_file, 'w')
+		f.writelines(bench_dpctl_parse.make_dump(num_flows))
+		f.close()
+		path = os.path.join(tmpdir, 'ovs-vswitchd.ctl')
+		server = sub.Popen([sys.executable, os.path.join(os.path.dirname(__file__) or '.',
+						   'fake_unixctl.py'), path, dump_file])
+		while not os.path.exists(path):
+			time.sleep(0.01)
+		sources = (
+			('shell+fork', flow_source.SubprocessFlowSource('xenbr0', ['sh', '-c', 'cat ' + dump_file])),
+			('fork', flow_source.SubprocessFlowSource('xenbr0', ['cat', dump_file])),
+			('unixctl', flow_source.UnixctlFlowSource('xenbr0', path)),
+		)
+		print '%d flows, %d dumps' % (num_flows, dumps)
+		print '%-12s %12s %14s %14s' % ('source', 'ms/dump', 'agent CPU ms', 'child CPU ms')
+		for name, source in sources:
+			wall, own, children = time_source(source, dumps)
+			print '%-12s %12.2f %14.2f %14.2f' % (name, wall * 1000, own * 1000, children * 1000)
+			source.close()
+		server.terminate()
+		server.wait()
+	finally:
+		shutil.rmtree(tmpdir)
+
+if (__name__ == '__main__'):
+	args = [int(arg) for arg in sys.argv[1:]]
+	main(*(args + [1000, 200][len(args):]))
@@ -0,0 +1,82 @@
+import add_to_sys_path
+import array
+import datetime
+import dpctl
+import flowtable
+import random
+import sys
+
+"""
+Memory comparison of the flowset backends: dpctl.Flows (nested dicts and
+lists) against flowtable.ColumnarFlows (interned IPs and typed arrays).
+
+Usage: python bench_flowtable_memory.py [vms peers ...]   (default: 40 250 40 2500)
+"""
+
+def deep_sizeof(obj, seen=None):
+	"""
+	Sum sys.getsizeof over an object and everything reachable from it, counting
+	shared objects (interned strings, small ints) once.
+
+	param obj:	Object to measure.
+	return:		Size in bytes.
+	"""
+	if seen is None:
+		seen = set()
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		for key, value in obj.iteritems():
+			size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+	elif isinstance(obj, (list, tuple, set, frozenset)):
+		for item in obj:
+			size += deep_sizeof(item, seen)
+	elif isinstance(obj, (str, unicode, int, long, float, array.array,
+						  datetime.datetime)):
+		pass
+	elif hasattr(obj, '__dict__'):
+		size += deep_sizeof(obj.__dict__, seen)
+	return size
+
+def populate(flows, vms, peers, seed=1):
+	"""
+	Fill a flowset with traffic from each local VM to a set of peers.
+
+	param flows:	Flowset to fill.
+	param vms:		Number of local VMs.
+	param peers:	Number of peers per VM.
+	return:			Number of distinct (src, dst) pairs added.
+	"""
+	rand = random.Random(seed)
+	pairs = set()
+	for vm in range(vms):
+		src = '10.0.%d.%d' % (vm >> 8, vm & 0xff)
+		for i in range(peers):
+			peer = rand.randint(0, 1 << 16)
+			dst = '10.1.%d.%d' % (peer >> 8, peer & 0xff)
+			entry = dpctl.FlowEntry('00:16:3e:00:%02x:%02x' % (vm >> 8, vm & 0xff),
+									'00:16:3e:01:%02x:%02x' % (peer >> 8, peer & 0xff),
+									src, dst, rand.randint(0, 1 << 30))
+			flows.update_flows(entry)
+			# Traffic is seen in both directions.
+			flows.update_flows(dpctl.FlowEntry(entry.dstMac, entry.srcMac, dst, src,
+											   rand.randint(0, 1 << 30)))
+			pairs.add((src, dst))
+			pairs.add((dst, src))
+	return len(pairs)
+
+def main(sizes):
+	print '%-6s %-7s %-9s %-10s %12s %14s' % ('vms', 'peers', 'pairs', 'backend', 'bytes', 'bytes/pair')
+	for vms, peers in sizes:
+		for name, backend in (('dict', dpctl.Flows), ('columnar', flowtable.ColumnarFlows)):
+			flows = backend()
+			pairs = populate(flows, vms, peers)
+			size = deep_sizeof(flows)
+			print '%-6d %-7d %-9d %-10s %12d %14.1f' % (vms, peers, pairs, name, size,
+													   float(size) / pairs)
+
+if (__name__ == '__main__'):
+	args = [int(arg) for arg in sys.argv[1:]] or [40, 250, 40, 2500]
+	main(zip(args[0::2], args[1::2]))
@@ -0,0 +1,256 @@
+import add_to_sys_path
+import bench_rcu_reads
+import datetime
+import dpctl
+import dpctl_thread
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import synthetic_dumps
+import time
+
+"""
+Benchmark suite for the ingest path, for tracking performance between
+versions. For each dump size it measures:
+
+  update_entries.first	DpCtl.update_entries of a first poll (every line new).
+  update_entries.steady	DpCtl.update_entries of later polls (some lines moved).
+  update_flows			Flows.update_flows of parsed entries, new then existing.
+  copy_and_reset		Flows.copy_and_reset_{src,dst}_flows_by_ip of every IP.
+  query.locked			DpReadClass.get_entries_by_src_ip while polling.
+  query.rcu				As query.locked, in read-copy-update mode.
+
+Dumps come from synthetic_dumps.SyntheticDatacentre. Each benchmark runs in
+a process of its own, so its peak RSS is its own. Throughput is in lines,
+calls or queries per second, as the unit says; latencies are per poll, per
+call or per query.
+
+The results are written as JSON. Given an earlier results file, each
+benchmark is compared with it and the exit status is 1 if any throughput
+fell, or p99 latency rose, by more than REGRESSION.
+
+Usage: python bench_ingest.py [--output results.json] [--compare old.json]
+                              [flows ...]
+       (default: --output bench_ingest.json 1000 10000 100000)
+"""
+
+BENCHMARKS = ('update_entries.first', 'update_entries.steady', 'update_flows',
+			  'copy_and_reset', 'query.locked', 'query.rcu')
+# Fractional change in throughput or p99 latency reported as a regression;
+# runs on a shared machine commonly differ by 15%.
+REGRESSION = 0.25
+# Calls of Flows.update_flows timed together, as one is too quick to time.
+CALL_BATCH = 1000
+# Seconds of querying per query benchmark.
+QUERY_SECONDS = 2.0
+
+def make_datacentre(num_flows):
+	"""
+	Create a data centre whose dumps are about num_flows lines long.
+	"""
+	peers = 8
+	flows_per_peer = 2
+	vms = max(peers + 1, int(num_flows / (peers * flows_per_peer * 1.05)))
+	return synthetic_dumps.SyntheticDatacentre(vms, peers, flows_per_peer)
+
+def summarise(name, num_lines, unit, ops, seconds, latencies):
+	"""
+	Summarise one benchmark.
+
+	param num_lines:	Lines per dump.
+	param ops:			Lines, calls or queries done.
+	param seconds:		Seconds taken by them.
+	param latencies:	Seconds per poll, call or query.
+	return:				Dictionary of results.
+	"""
+	latencies = sorted(latencies)
+	return {
+		'benchmark': name,
+		'lines': num_lines,
+		'unit': unit,
+		'ops': ops,
+		'seconds': seconds,
+		'throughput': ops / seconds if seconds else 0.0,
+		'p50_ms': bench_rcu_reads.percentile(latencies, 0.5) * 1000,
+		'p99_ms': bench_rcu_reads.percentile(latencies, 0.99) * 1000,
+		'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+	}
+
+def bench_first_poll(name, datacentre):
+	""" Time first polls of one dump, each into a new DpCtl. """
+	lines = datacentre.dump()
+	latencies = []
+	for i in range(3):
+		ctl = dpctl.DpCtl('xenbr0', source=datacentre)
+		start = time.time()
+		ctl.update_entries(lines)
+		latencies.append(time.time() - start)
+	return summarise(name, len(lines), 'lines/s', len(lines) * 3, sum(latencies), latencies)
+
+def bench_steady_poll(name, datacentre):
+	""" Time successive polls after the first. """
+	ctl = dpctl.DpCtl('xenbr0', source=datacentre)
+	lines = datacentre.dump()
+	ctl.update_entries(lines)
+	polls = max(5, min(50, 1000000 // len(lines)))
+	latencies = []
+	for i in range(polls):
+		lines = datacentre.dump()
+		start = time.time()
+		ctl.update_entries(lines)
+		latencies.append(time.time() - start)
+	return summarise(name, len(lines), 'lines/s', len(lines) * polls, sum(latencies), latencies)
+
+def bench_update_flows(name, datacentre):
+	""" Time applying parsed entries to a flowset, in batches of calls. """
+	lines = datacentre.dump()
+	entries = filter(None, map(dpctl.parse_dp_flow, lines))
+	flows = dpctl.Flows()
+	update_flows = flows.update_flows
+	latencies = []
+	seconds = 0.0
+	for i in range(2):
+		for j in xrange(0, len(entries), CALL_BATCH):
+			batch = entries[j:j + CALL_BATCH]
+			start = time.time()
+			for entry in batch:
+				update_flows(entry)
+			elapsed = time.time() - start
+			latencies.append(elapsed / len(batch))
+			seconds += elapsed
+	return summarise(name, len(lines), 'calls/s', len(entries) * 2, seconds, latencies)
+
+def bench_copy_and_reset(name, datacentre):
+	""" Time resetting the flows of each source, then each destination. """
+	lines = datacentre.dump()
+	ctl = dpctl.DpCtl('xenbr0', source=datacentre)
+	ctl.update_entries(lines)
+	flows = ctl.flows
+	latencies = []
+	for reset, ips in ((flows.copy_and_reset_src_flows_by_ip, list(flows._src)),
+					   (flows.copy_and_reset_dst_flows_by_ip, list(flows._dst))):
+		for ip in ips:
+			start = time.time()
+			reset(ip)
+			latencies.append(time.time() - start)
+	return summarise(name, len(lines), 'calls/s', len(latencies), sum(latencies), latencies)
+
+def bench_queries(name, datacentre):
+	""" Time queries while a DpReadClass polls (see bench_rcu_reads). """
+	dumps = [datacentre.dump() for i in range(3)]
+	latencies, polls = bench_rcu_reads.run(dumps, QUERY_SECONDS, dpctl_thread.BATCH_SIZE,
+										   name == 'query.rcu')
+	result = summarise(name, len(dumps[0]), 'queries/s', len(latencies), sum(latencies),
+					   latencies)
+	result['polls'] = polls
+	return result
+
+RUNNERS = {
+	'update_entries.first': bench_first_poll,
+	'update_entries.steady': bench_steady_poll,
+	'update_flows': bench_update_flows,
+	'copy_and_reset': bench_copy_and_reset,
+	'query.locked': bench_queries,
+	'query.rcu': bench_queries,
+}
+
+def run_one(name, num_flows):
+	"""
+	Run one benchmark in this process.
+
+	return:	Dictionary of results.
+	"""
+	result = RUNNERS[name](name, make_datacentre(num_flows))
+	result['flows'] = num_flows
+	return result
+
+def run_isolated(name, num_flows):
+	"""
+	Run one benchmark in a new process.
+
+	return:	Dictionary of results.
+	"""
+	output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+									  '--run', name, str(num_flows)])
+	return json.loads(output)
+
+def get_version():
+	"""
+	return:	'git describe' of the tree benchmarked, or None outside a checkout.
+	"""
+	try:
+		with open(os.devnull, 'w') as null:
+			return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+										   cwd=os.path.dirname(os.path.abspath(__file__)),
+										   stderr=null).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def compare(old, new):
+	"""
+	Print how each benchmark changed since an earlier run.
+
+	return:	Whether any benchmark regressed.
+	"""
+	before = dict(((r['benchmark'], r['flows']), r) for r in old['results'])
+	regressed = False
+	print 'against %s (%s)' % (old.get('version'), old.get('time'))
+	print '%-22s %8s %10s %10s' % ('benchmark', 'flows', 'throughput', 'p99')
+	for result in new['results']:
+		previous = before.get((result['benchmark'], result['flows']))
+		if previous is None:
+			continue
+		throughput = result['throughput'] / previous['throughput'] - 1
+		p99 = result['p99_ms'] / previous['p99_ms'] - 1 if previous['p99_ms'] else 0.0
+		flag = ''
+		if throughput < -REGRESSION or p99 > REGRESSION:
+			flag = 'REGRESSION'
+			regressed = True
+		print '%-22s %8d %+9.1f%% %+9.1f%%  %s' % (result['benchmark'], result['flows'],
+												 throughput * 100, p99 * 100, flag)
+	return regressed
+
+def main(sizes, output, previous):
+	results = {
+		'version': get_version(),
+		'time': datetime.datetime.utcnow().isoformat() + 'Z',
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'cpus': multiprocessing.cpu_count(),
+		'results': [],
+	}
+	print '%-22s %8s %14s %10s %10s %10s' % ('benchmark', 'flows', 'throughput', 'p50 ms',
+											 'p99 ms', 'rss MB')
+	for size in sizes:
+		for name in BENCHMARKS:
+			result = run_isolated(name, size)
+			results['results'].append(result)
+			print '%-22s %8d %14s %10.3f %10.3f %10.1f' % (name, result['flows'],
+				'%.0f %s' % (result['throughput'], result['unit']), result['p50_ms'],
+				result['p99_ms'], result['peak_rss_kb'] / 1024.0)
+	with open(output, 'w') as f:
+		json.dump(results, f, indent=1, sort_keys=True)
+	print 'results written to %s' % output
+	if previous is not None:
+		with open(previous) as f:
+			if compare(json.load(f), results):
+				sys.exit(1)
+
+if (__name__ == '__main__'):
+	args = sys.argv[1:]
+	if args[:1] == ['--run']:
+		print json.dumps(run_one(args[1], int(args[2])))
+		sys.exit(0)
+	output = 'bench_ingest.json'
+	previous = None
+	while args[:1] in (['--output'], ['--compare']):
+		if args[0] == '--output':
+			output = args[1]
+		else:
+			previous = args[1]
+		args = args[2:]
+	main([int(arg) for arg in args] or [1000, 10000, 100000], output, previous)
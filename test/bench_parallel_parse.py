@@ -0,0 +1,63 @@
+import add_to_sys_path
+import bench_dpctl_parse
+import dpctl
+import multiprocessing
+import parallel_parse
+import sys
+import time
+
+"""
+Benchmark of parsing flow dumps in a process pool against parsing them in
+the polling process. Each run is a first poll, in which every line is new
+and so parsed, into a fresh DpCtl; applying the flows is serial either way.
+The crossover is the smallest dump from which the pool is faster at every
+larger size run.
+
+Usage: python bench_parallel_parse.py [flows ...]
+       (default: 5000 10000 20000 50000 100000 200000)
+"""
+
+def time_poll(lines, parser=None, repeat=3):
+	"""
+	Time a first poll of a dump.
+
+	return:	Best seconds of repeat polls.
+	"""
+	best = None
+	for i in range(repeat):
+		ctl = dpctl.DpCtl('xenbr0', source=object(), parser=parser)
+		start = time.time()
+		ctl.update_entries(lines)
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def main(sizes):
+	cpus = multiprocessing.cpu_count()
+	counts = sorted(set([1, 2, 4, cpus]))
+	parsers = [(n, parallel_parse.ParallelParser(n, min_lines=0)) for n in counts]
+	print '%d CPUs' % cpus
+	print '%8s %10s' % ('flows', 'serial ms') + ''.join(['%10s' % ('%d proc' % n) for n in counts])
+	crossover = None
+	try:
+		for size in sizes:
+			lines = bench_dpctl_parse.make_dump(size)
+			serial = time_poll(lines)
+			row = [time_poll(lines, parser) for n, parser in parsers]
+			print '%8d %10.1f' % (size, serial * 1000) + ''.join(['%10.1f' % (t * 1000) for t in row])
+			if min(row) >= serial:
+				crossover = None
+			elif crossover is None:
+				crossover = size
+	finally:
+		for n, parser in parsers:
+			parser.close()
+	if crossover is None:
+		print 'the pool did not beat the serial path at any size'
+	else:
+		print 'crossover: %d flows' % crossover
+
+if (__name__ == '__main__'):
+	sizes = [int(arg) for arg in sys.argv[1:]] or [5000, 10000, 20000, 50000, 100000, 200000]
+	main(sizes)
@@ -0,0 +1,49 @@
+import add_to_sys_path
+import dpctl_thread
+import poll_metrics
+import sys
+import synthetic_dumps
+import time
+
+"""
+Benchmark of the cost of instrumenting the poller: steady polls of the same
+synthetic dumps by a DpReadClass without metrics and with them, and what
+the instrumented poller reports.
+
+Usage: python bench_poll_metrics.py [flows [polls]]   (default: 50000 10)
+"""
+
+def run(num_flows, polls, metrics):
+	"""
+	Poll a data centre, timing the polls after the first.
+
+	return:	Best seconds per poll.
+	"""
+	datacentre = synthetic_dumps.SyntheticDatacentre(max(9, num_flows // 17), 8)
+	thread = dpctl_thread.DpReadClass(source=datacentre, metrics=metrics)
+	thread.poll()
+	best = None
+	for i in range(polls):
+		start = time.time()
+		thread.poll()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def main(num_flows, polls):
+	off = run(num_flows, polls, None)
+	metrics = poll_metrics.PollMetrics()
+	on = run(num_flows, polls, metrics)
+	print '%d flows: %.1f ms/poll without metrics, %.1f ms with (%+.1f%%)' % (
+		num_flows, off * 1000, on * 1000, (on / off - 1) * 100)
+	stats = metrics.get_stats()
+	for name in ('poll', 'dump', 'parse', 'lock_wait', 'lock_hold'):
+		histogram = stats[name]
+		print '%-10s %6d  mean %9.3f ms  p99 %9.3f ms' % (name, histogram['count'],
+			histogram['mean'] * 1000, histogram['p99'] * 1000)
+	print 'lines %(lines)d, parsed %(parsed)d, unchanged %(unchanged)d, skipped %(skipped)d' % stats
+
+if (__name__ == '__main__'):
+	args = [int(arg) for arg in sys.argv[1:]]
+	main(*(args + [50000, 10][len(args):]))
@@ -0,0 +1,84 @@
+import add_to_sys_path
+import bench_delta_updates
+import bench_dpctl_parse
+import dpctl_thread
+import random
+import sys
+import time
+
+"""
+Benchmark of query latency while DpReadClass polls continuously: the lock
+held for a whole dump (as DpReadClass.run used to), the lock held per batch,
+and read-copy-update mode, where queries read a published snapshot.
+
+Usage: python bench_rcu_reads.py [flows [seconds]]   (default: 50000 5)
+"""
+
+class CyclingSource(object):
+	"""
+	Flow source returning each of a list of dumps in turn.
+	"""
+
+	def __init__(self, dumps):
+		self.dumps = dumps
+		self.polls = 0
+
+	def dump(self):
+		self.polls += 1
+		return iter(self.dumps[self.polls % len(self.dumps)])
+
+	def close(self):
+		pass
+
+def percentile(values, fraction):
+	"""
+	return:	The value below which the given fraction of sorted values fall.
+	"""
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run(dumps, seconds, batch_size, rcu):
+	"""
+	Poll continuously in one thread while querying in another.
+
+	return:	(sorted query latencies in seconds, polls completed).
+	"""
+	source = CyclingSource(dumps)
+	thread = dpctl_thread.DpReadClass(interval=0, source=source, batch_size=batch_size,
+									  rcu=rcu)
+	thread.poll()
+	ips = thread.dpctl.flows._src.keys()
+	rand = random.Random(1)
+	polls = source.polls
+	thread.start()
+	latencies = []
+	end = time.time() + seconds
+	while time.time() < end:
+		ip = rand.choice(ips)
+		start = time.time()
+		thread.get_entries_by_src_ip(ip)
+		latencies.append(time.time() - start)
+		# Leave the poller time between queries, as a decision loop would.
+		time.sleep(0.001)
+	thread.terminate()
+	thread.join()
+	latencies.sort()
+	return latencies, source.polls - polls
+
+def main(num_flows, seconds):
+	rand = random.Random(1)
+	dumps = [bench_dpctl_parse.make_dump(num_flows)]
+	for i in range(3):
+		dumps.append(bench_delta_updates.next_dump(dumps[-1], 0.2, rand))
+	print '%d flows, 20%% changed per poll, %d s per mode' % (num_flows, seconds)
+	print '%-12s %8s %10s %10s %10s %8s' % ('mode', 'queries', 'p50 ms', 'p99 ms', 'max ms', 'polls')
+	for name, batch_size, rcu in (('whole dump', sys.maxint, False),
+								  ('batched', dpctl_thread.BATCH_SIZE, False),
+								  ('rcu', dpctl_thread.BATCH_SIZE, True)):
+		latencies, polls = run(dumps, seconds, batch_size, rcu)
+		print '%-12s %8d %10.3f %10.3f %10.3f %8d' % (name, len(latencies),
+			percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+			latencies[-1] * 1000, polls)
+
+if (__name__ == '__main__'):
+	args = [int(arg) for arg in sys.argv[1:]]
+	main(*(args + [50000, 5][len(args):]))
@@ -0,0 +1,89 @@
+import add_to_sys_path
+import bench_delta_updates
+import bench_dpctl_parse
+import dpctl
+import dpctl_thread
+import flow_rates
+import flow_source
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from fake_flow_source import StaticFlowSource
+
+"""
+Benchmark of ingest from a recorded trace: each dump is replayed through
+DpReadClass.poll as fast as it is taken, into a flowset keeping rates. The
+flowset is ticked with the recorded times, so the rates it ends with, and
+their total printed at the end, are the same on every run.
+
+Given no trace, one is synthesised: dumps of bench_dpctl_parse.make_dump
+one second apart, with 5% of the flows moving per dump.
+
+Usage: python bench_replay.py [trace]
+       python bench_replay.py --synthesise flows dumps trace
+"""
+
+def synthesise(path, num_flows, dumps):
+	"""
+	Record a synthetic trace.
+
+	param path:			Path of the trace file.
+	param num_flows:	Lines per dump.
+	param dumps:		Number of dumps.
+	"""
+	rand = random.Random(1)
+	lines = bench_dpctl_parse.make_dump(num_flows)
+	clock = [1000.0]
+	source = StaticFlowSource(lines)
+	recorder = flow_source.RecordingFlowSource(source, path, lambda: clock[0])
+	for i in range(dumps):
+		for line in recorder.dump():
+			pass
+		source.lines = bench_delta_updates.next_dump(source.lines, 0.05, rand)
+		clock[0] += 1.0
+	recorder.close()
+
+def replay(path):
+	"""
+	Replay a trace through a polling thread, as fast as possible.
+
+	return:	(seconds per poll, polls, the thread).
+	"""
+	source = flow_source.ReplayFlowSource(path)
+	thread = dpctl_thread.DpReadClass(source=source,
+									  flows=dpctl.Flows(rate_windows=flow_rates.RATE_WINDOWS))
+	polls = 0
+	start = time.time()
+	while True:
+		thread.poll()
+		if source.finished:
+			break
+		polls += 1
+	return (time.time() - start) / max(polls, 1), polls, thread
+
+def main(path):
+	elapsed, polls, thread = replay(path)
+	flows = thread.dpctl.flows
+	matrix = flows.export_matrix(0)
+	print '%d polls, %.1f ms/poll, %d flows held' % (polls, elapsed * 1000, len(flows))
+	print 'total %gs rate at end of trace: %.3f bytes/sec' % (flow_rates.RATE_WINDOWS[0],
+															 sum(matrix.data))
+
+if (__name__ == '__main__'):
+	args = sys.argv[1:]
+	if args and args[0] == '--synthesise':
+		synthesise(args[3], int(args[1]), int(args[2]))
+	elif args:
+		main(args[0])
+	else:
+		tmpdir = tempfile.mkdtemp()
+		try:
+			trace = os.path.join(tmpdir, 'trace.gz')
+			synthesise(trace, 10000, 30)
+			print 'trace: %d KB' % (os.path.getsize(trace) // 1024)
+			main(trace)
+		finally:
+			shutil.rmtree(tmpdir)
@@ -0,0 +1,50 @@
+import add_to_sys_path
+import dpctl
+import flowtable
+import sys
+import time
+
+"""
+Benchmark of resetting the flows of one chatty IP address, as done under the
+DpReadClass lock on each migration decision: reset_src_flows alone, and
+copy_and_reset_src_flows_by_ip.
+
+Usage: python bench_reset.py [peers ...]   (default: 100 1000 10000)
+"""
+
+def populate(flows, peers):
+	"""
+	Give one source IP address a number of peers.
+	"""
+	for i in range(peers):
+		flows.update_flows(dpctl.FlowEntry('00:16:3e:00:00:01', '00:16:3e:01:00:01',
+										   '10.0.0.1', '10.1.%d.%d' % (i >> 8, i & 0xff),
+										   1000 + i))
+
+def time_call(call, repeat=50):
+	"""
+	Time a call, keeping the best of several runs.
+
+	return:	Seconds per call.
+	"""
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		call()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def main(sizes):
+	print '%-8s %-10s %12s %16s' % ('peers', 'backend', 'reset us', 'copy+reset us')
+	for peers in sizes:
+		for name, backend in (('dict', dpctl.Flows), ('columnar', flowtable.ColumnarFlows)):
+			flows = backend()
+			populate(flows, peers)
+			reset = time_call(lambda: flows.reset_src_flows('10.0.0.1'))
+			copy = time_call(lambda: flows.copy_and_reset_src_flows_by_ip('10.0.0.1'))
+			print '%-8d %-10s %12.1f %16.1f' % (peers, name, reset * 1e6, copy * 1e6)
+
+if (__name__ == '__main__'):
+	main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000])
@@ -0,0 +1,98 @@
+import add_to_sys_path
+import bench_dpctl_parse
+import dpctl_thread
+import flow_source
+import os
+import resource
+import shutil
+import subprocess as sub
+import sys
+import tempfile
+import threading
+import time
+
+"""
+Benchmark of dump ingestion: reading the whole dump into a list and applying
+it under one lock acquisition (the old DpReadClass.run) against streaming it
+from the pipe and applying it in bounded batches (DpReadClass.poll). Each mode
+runs in its own child process so peak RSS can be compared. ovs-dpctl is stood
+in for by 'cat'.
+
+Usage: python bench_streaming.py [flows [batch size]]   (default: 100000 512)
+"""
+
+class TimingLock(object):
+	"""
+	Lock recording how long it is held for.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.held = []
+
+	def acquire(self):
+		self.lock.acquire()
+		self.start = time.time()
+
+	def release(self):
+		self.held.append(time.time() - self.start)
+		self.lock.release()
+
+def run_whole(thread):
+	"""
+	Ingest one dump the way DpReadClass.run used to.
+	"""
+	lines = thread.dpctl.source.dump().readlines()
+	thread.lock.acquire()
+	thread.dpctl.update_entries(lines)
+	thread.lock.release()
+
+def run_stream(thread):
+	"""
+	Ingest one dump with DpReadClass.poll.
+	"""
+	thread.poll()
+
+MODES = (('whole', run_whole), ('stream', run_stream))
+
+def child(mode, dump_file, batch_size):
+	"""
+	Ingest the dump once in the given mode and print the results on one line.
+	"""
+	source = flow_source.SubprocessFlowSource('xenbr0', ['cat', dump_file])
+	if mode == 'whole':
+		# readlines() on the pipe, as get_dp_flows did.
+		source.dump = lambda: sub.Popen(['cat', dump_file], stdout=sub.PIPE).stdout
+	thread = dpctl_thread.DpReadClass(bridge='xenbr0', source=source, batch_size=batch_size)
+	thread.lock = TimingLock()
+	start = time.time()
+	dict(MODES)[mode](thread)
+	elapsed = time.time() - start
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	print elapsed, max(thread.lock.held), len(thread.lock.held), rss
+
+def main(num_flows, batch_size):
+	tmpdir = tempfile.mkdtemp()
+	try:
+		dump_file = os.path.join(tmpdir, 'dump.txt')
+		f = open(dump_file, 'w')
+		f.writelines(bench_dpctl_parse.make_dump(num_flows))
+		f.close()
+		print '%d flows, batch size %d' % (num_flows, batch_size)
+		print '%-8s %10s %16s %10s %14s' % ('mode', 'total s', 'max lock hold ms',
+											'locks', 'peak RSS KiB')
+		for mode, run in MODES:
+			out = sub.Popen([sys.executable, __file__, '--child', mode, dump_file,
+							 str(batch_size)], stdout=sub.PIPE).communicate()[0]
+			elapsed, held, locks, rss = out.split()
+			print '%-8s %10.2f %16.2f %10s %14s' % (mode, float(elapsed), float(held) * 1000,
+													locks, rss)
+	finally:
+		shutil.rmtree(tmpdir)
+
+if (__name__ == '__main__'):
+	if sys.argv[1:2] == ['--child']:
+		child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+	else:
+		args = [int(arg) for arg in sys.argv[1:]]
+		main(*(args + [100000, 512][len(args):]))
@@ -0,0 +1,22 @@
+"""
+Stand-in for a flow source, returning whatever dump it is given. Used by the
+tests and benchmarks of the pollers.
+"""
+
+class StaticFlowSource(object):
+	"""
+	Source returning a fixed dump, which may be changed between dumps by
+	setting lines. Counts the dumps taken and records being closed.
+	"""
+
+	def __init__(self, lines):
+		self.lines = lines
+		self.dumps = 0
+		self.closed = False
+
+	def dump(self):
+		self.dumps += 1
+		return self.lines
+
+	def close(self):
+		self.closed = True
@@ -0,0 +1,133 @@
+import json
+import os
+import socket
+import sys
+import threading
+
+"""
+Stand-in for the ovs-vswitchd unixctl socket, answering 'dpctl/dump-flows'
+with a canned dump. Used by the flow source tests and benchmarks.
+
+Usage: python fake_unixctl.py <socket path> <dump file>
+"""
+
+class FakeUnixctlServer(object):
+	"""
+	JSON-RPC server on a unix socket, serving each connection in a thread.
+	"""
+
+	def __init__(self, path, flows=''):
+		"""
+		Create the socket and start accepting connections.
+
+		param path:		Path to bind the unix socket to.
+		param flows:	Text returned for 'dpctl/dump-flows'.
+		"""
+		self.path = path
+		self.flows = flows
+		# Event the second half of each reply waits for, if set.
+		self.hold = None
+		self.connections = []
+		self.requests = []
+		if os.path.exists(path):
+			os.unlink(path)
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.bind(path)
+		self.sock.listen(4)
+		self.thread = threading.Thread(target=self.serve)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def serve(self):
+		"""
+		Accept connections until the server is closed.
+		"""
+		while True:
+			try:
+				connection, client = self.sock.accept()
+			except socket.error:
+				return
+			self.connections.append(connection)
+			thread = threading.Thread(target=self.handle, args=(connection,))
+			thread.daemon = True
+			thread.start()
+
+	def handle(self, connection):
+		"""
+		Answer requests on one connection until the client closes it.
+		"""
+		decoder = json.JSONDecoder()
+		buf = ''
+		try:
+			while True:
+				data = connection.recv(65536)
+				if not data:
+					break
+				buf = buf + data
+				while buf:
+					try:
+						msg, end = decoder.raw_decode(buf)
+					except ValueError:
+						break
+					buf = buf[end:].lstrip()
+					self.requests.append(msg)
+					self.send(connection, json.dumps(self.respond(msg)))
+		except socket.error:
+			pass
+		finally:
+			connection.close()
+
+	def send(self, connection, reply):
+		"""
+		Send a reply, holding back its second half until hold is set.
+		"""
+		if self.hold is None:
+			connection.sendall(reply)
+			return
+		half = len(reply) // 2
+		connection.sendall(reply[:half])
+		self.hold.wait(10)
+		connection.sendall(reply[half:])
+
+	def respond(self, msg):
+		"""
+		Build the reply to a request.
+
+		param msg:	Decoded JSON-RPC request.
+		return:		Reply object.
+		"""
+		if msg.get('method') == 'dpctl/dump-flows':
+			return {'id': msg.get('id'), 'result': self.flows, 'error': None}
+		return {'id': msg.get('id'), 'result': None,
+				'error': '"%s" is not a valid command' % msg.get('method')}
+
+	def drop_connections(self):
+		"""
+		Close every client connection, as a restarting ovs-vswitchd would.
+		"""
+		for connection in self.connections:
+			try:
+				connection.shutdown(socket.SHUT_RDWR)
+			except socket.error:
+				pass
+		self.connections = []
+
+	def close(self):
+		"""
+		Stop accepting connections and remove the socket.
+		"""
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except socket.error:
+			pass
+		self.sock.close()
+		self.thread.join(1)
+		self.drop_connections()
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+
+if (__name__ == '__main__'):
+	f = open(sys.argv[2], 'r')
+	server = FakeUnixctlServer(sys.argv[1], f.read())
+	f.close()
+	server.thread.join()
@@ -0,0 +1,106 @@
+import Queue
+import threading
+
+"""
+Stand-in for a xenstore handle (xen.lowlevel.xs.xs), holding the store in
+memory and firing watches as it is written. Used by the inventory tests.
+"""
+
+class FakeXenstore(object):
+	"""
+	Xenstore handle over a dictionary of {path: value}, with the methods of
+	xen.lowlevel.xs.xs that the inventory uses. Transactions are accepted
+	and ignored.
+	"""
+
+	def __init__(self):
+		self.store = {'/local': '', '/local/domain': ''}
+		self.watches = []
+		self.events = Queue.Queue()
+		self.lock = threading.Lock()
+		self.fired = 0
+		self.closed = False
+
+	def read(self, th, path):
+		return self.store.get(path)
+
+	def ls(self, th, path):
+		if path not in self.store:
+			return None
+		prefix = path + '/'
+		return [key[len(prefix):] for key in self.store
+				if key.startswith(prefix) and '/' not in key[len(prefix):]]
+
+	def write(self, th, path, value):
+		self.lock.acquire()
+		try:
+			parts = path.split('/')
+			for i in range(2, len(parts)):
+				self.store.setdefault('/'.join(parts[:i]), '')
+			self.store[path] = value
+		finally:
+			self.lock.release()
+		self.fire(path)
+
+	def rm(self, th, path):
+		self.lock.acquire()
+		try:
+			for key in self.store.keys():
+				if key == path or key.startswith(path + '/'):
+					del self.store[key]
+		finally:
+			self.lock.release()
+		self.fire(path)
+
+	def watch(self, path, token):
+		self.watches.append((path, token))
+		self.fire_one(path, token)
+
+	def unwatch(self, path, token):
+		self.watches.remove((path, token))
+
+	def fire(self, path):
+		for watched, token in self.watches:
+			if path == watched or path.startswith(watched + '/'):
+				self.fire_one(path, token)
+
+	def fire_one(self, path, token):
+		self.fired += 1
+		self.events.put((path, token))
+
+	def read_watch(self):
+		event = self.events.get()
+		if event is None:
+			raise IOError('xenstore handle closed')
+		if isinstance(event, Exception):
+			raise event
+		return event
+
+	def fail_watch(self, error):
+		"""
+		Make the next read_watch raise an error, as when xenstored restarts.
+		"""
+		self.events.put(error)
+
+	def close(self):
+		self.closed = True
+		self.events.put(None)
+
+	def add_domain(self, domid, name, memory, macs):
+		"""
+		Write a domain's entries as the toolstack does when creating it.
+
+		param memory:	Memory target in MB.
+		param macs:		MAC addresses of its network interfaces.
+		"""
+		base = '/local/domain/%d' % domid
+		self.write('', base + '/name', name)
+		self.write('', base + '/memory/target', str(memory * 1024))
+		for i, mac in enumerate(macs):
+			self.write('', '%s/device/vif/%d/mac' % (base, i), mac)
+
+	def remove_domain(self, domid):
+		"""
+		Remove a domain's entries as the toolstack does when destroying it.
+		"""
+		self.rm('', '/local/domain/%d' % domid)
@@ -0,0 +1,225 @@
+import random
+import sys
+
+"""
+Generator of synthetic 'ovs-dpctl dump-flows' output for a data centre of
+VMs, for tests and benchmarks that need realistic input at any scale. Each
+VM talks to a number of peers, favouring popular ones, over a few TCP and
+UDP flows per peer. Flow rates are heavy tailed (Pareto), only some flows
+move in each poll, and a fraction of the flows is replaced by new ones
+every poll. ARP, IGMP and IPv6 flows are mixed in, as the ingest has to
+skip or tolerate them on real hosts. The same arguments and seed always
+give the same dumps.
+
+Usage: python synthetic_dumps.py [vms [peers [polls]]]
+       (default: 100 8 1; dumps are written to stdout, separated by blank
+       lines)
+"""
+
+# Mean size of packets, for packet counts derived from byte counts.
+MEAN_PACKET = 900
+# Kinds of noise flow, with the relative frequency of each.
+NOISE_KINDS = ('arp', 'arp', 'igmp', 'ipv6')
+# Datapath ports per host; VMs are spread across them round robin.
+PORTS = 32
+
+class SyntheticDatacentre(object):
+	"""
+	Class generating successive dumps of a data centre's datapath flows; a
+	flow source (see flow_source), so it can be given to DpCtl directly.
+	"""
+
+	def __init__(self, vms=100, peers=8, flows_per_peer=2, mean_rate=100000.0,
+				 alpha=1.2, active=0.3, churn=0.02, noise=0.05, interval=1.0,
+				 ufids=False, seed=1):
+		"""
+		Initialise the data centre. No traffic has moved until the first dump.
+
+		param vms:				Number of VMs.
+		param peers:			Peers each VM sends to.
+		param flows_per_peer:	Flows from a VM to each of its peers.
+		param mean_rate:		Mean rate of a flow in bytes/sec.
+		param alpha:			Shape of the Pareto distribution of flow rates;
+								smaller is heavier tailed, and must be above 1.
+		param active:			Chance of a flow moving in each poll.
+		param churn:			Fraction of flows replaced by new flows in each
+								poll.
+		param noise:			Noise flows per IPv4 flow between VMs.
+		param interval:			Seconds between dumps.
+		param ufids:			Whether lines carry datapath flow IDs.
+		param seed:				Seed for the random generator.
+		"""
+		if alpha <= 1:
+			raise ValueError('alpha must be above 1, not %r' % alpha)
+		self.rand = random.Random(seed)
+		self.vms = vms
+		self.flows_per_peer = flows_per_peer
+		self.mean_rate = mean_rate
+		self.alpha = alpha
+		self.active = active
+		self.churn = churn
+		self.interval = interval
+		self.ufids = ufids
+		self.polls = 0
+		# Peers of each VM, by index.
+		self.peers = [self.pick_peers(vm, min(peers, vms - 1)) for vm in range(vms)]
+		# Each flow is a list of [match, bytes/sec, bytes, packets, seconds
+		# since last used or None if never, ufid].
+		self.flows = []
+		for vm in range(vms):
+			for peer in self.peers[vm]:
+				for i in range(flows_per_peer):
+					self.flows.append(self.new_flow(self.ip_match(vm, peer)))
+		for i in range(int(len(self.flows) * noise)):
+			self.flows.append(self.new_flow(self.noise_match()))
+
+	def pick_peers(self, vm, count):
+		"""
+		Pick the peers of a VM, favouring VMs with low indices, so that some
+		VMs are far more popular than others.
+		"""
+		rand = self.rand
+		peers = []
+		while len(peers) < count:
+			peer = int(self.vms * rand.random() ** 2)
+			if peer != vm and peer not in peers:
+				peers.append(peer)
+		return peers
+
+	def mac(self, vm):
+		""" Get the MAC address of a VM. """
+		return '00:16:3e:%02x:%02x:%02x' % ((vm >> 16) & 255, (vm >> 8) & 255, vm & 255)
+
+	def ip(self, vm):
+		""" Get the IP address of a VM. """
+		vm += 1
+		return '10.%d.%d.%d' % ((vm >> 16) & 255, (vm >> 8) & 255, vm & 255)
+
+	def port(self, vm):
+		""" Get the datapath port of a VM. """
+		return vm % PORTS + 1
+
+	def ip_match(self, vm, peer):
+		"""
+		Build the match and actions of a TCP or UDP flow from one VM to another.
+
+		return:	(text before the statistics, text after them).
+		"""
+		rand = self.rand
+		proto = rand.choice((6, 6, 6, 17))
+		l4 = '%s(src=%d,dst=%d)' % (proto == 6 and 'tcp' or 'udp', rand.randint(32768, 60999),
+									rand.choice((80, 443, 3306, 5432, 6379, 8080)))
+		match = ('recirc_id(0),in_port(%d),eth(src=%s,dst=%s),eth_type(0x0800),'
+				 'ipv4(src=%s,dst=%s,proto=%d,tos=0,ttl=64,frag=no),%s' %
+				 (self.port(vm), self.mac(vm), self.mac(peer), self.ip(vm), self.ip(peer),
+				  proto, l4))
+		flags = proto == 6 and ', flags:P.' or ''
+		return match, '%s, actions:%d' % (flags, self.port(peer))
+
+	def noise_match(self):
+		"""
+		Build the match and actions of an ARP, IGMP or IPv6 flow.
+
+		return:	(text before the statistics, text after them).
+		"""
+		rand = self.rand
+		kind = rand.choice(NOISE_KINDS)
+		vm = rand.randrange(self.vms)
+		peer = rand.randrange(self.vms)
+		head = 'recirc_id(0),in_port(%d),eth(src=%s,' % (self.port(vm), self.mac(vm))
+		if kind == 'arp':
+			match = head + ('dst=ff:ff:ff:ff:ff:ff),eth_type(0x0806),arp(sip=%s,tip=%s,op=1,'
+							'sha=%s,tha=00:00:00:00:00:00)' %
+							(self.ip(vm), self.ip(peer), self.mac(vm)))
+		elif kind == 'igmp':
+			match = head + ('dst=01:00:5e:00:00:16),eth_type(0x0800),ipv4(src=%s,'
+							'dst=224.0.0.22,proto=2,tos=0xc0,ttl=1,frag=no)' % self.ip(vm))
+		else:
+			match = head + ('dst=33:33:ff:%02x:%02x:%02x),eth_type(0x86dd),'
+							'ipv6(src=fe80::216:3eff:fe%02x:%02x%02x,dst=ff02::1:ff%02x:%02x%02x,'
+							'label=0,proto=58,tclass=0,hlimit=255,frag=no),icmpv6(type=135,code=0)' %
+							((peer >> 16) & 255, (peer >> 8) & 255, peer & 255,
+							 (vm >> 16) & 255, (vm >> 8) & 255, vm & 255,
+							 (peer >> 16) & 255, (peer >> 8) & 255, peer & 255))
+		return match, ', actions:1,2,3,4' if kind != 'ipv6' else ', actions:1'
+
+	def new_flow(self, match):
+		"""
+		Create a flow that has not moved yet, with a Pareto distributed rate.
+		"""
+		rand = self.rand
+		alpha = self.alpha
+		rate = self.mean_rate * rand.paretovariate(alpha) * (alpha - 1) / alpha
+		ufid = None
+		if self.ufids:
+			ufid = '%08x-%04x-%04x-%04x-%012x' % (rand.getrandbits(32), rand.getrandbits(16),
+												  rand.getrandbits(16), rand.getrandbits(16),
+												  rand.getrandbits(48))
+		return [match, rate, 0, 0, None, ufid]
+
+	def advance(self):
+		"""
+		Move the data centre on by one interval: replace churned flows, then
+		add traffic to the flows that moved.
+		"""
+		rand = self.rand
+		interval = self.interval
+		flows = self.flows
+		if self.polls:
+			for i in range(int(len(flows) * self.churn)):
+				index = rand.randrange(len(flows))
+				match = flows[index][0]
+				if 'ipv4(' in match[0] and 'proto=2,' not in match[0]:
+					vm = rand.randrange(self.vms)
+					match = self.ip_match(vm, rand.choice(self.peers[vm]))
+				flows[index] = self.new_flow(match)
+		for flow in flows:
+			if rand.random() < self.active or flow[4] is None:
+				bytes = int(flow[1] * interval * rand.uniform(0.5, 1.5)) + 64
+				flow[2] += bytes
+				flow[3] += bytes // MEAN_PACKET + 1
+				flow[4] = rand.uniform(0, interval)
+			else:
+				flow[4] += interval
+		self.polls += 1
+
+	def lines(self):
+		"""
+		Get the current state of the flows as a dump.
+
+		return:	List of lines of 'ovs-dpctl dump-flows' output.
+		"""
+		lines = []
+		append = lines.append
+		for (match, tail), rate, bytes, packets, used, ufid in self.flows:
+			if used is None:
+				stats = ', packets:0, bytes:0, used:never'
+			else:
+				stats = ', packets:%d, bytes:%d, used:%.3fs' % (packets, bytes, used)
+			if ufid is None:
+				append(match + stats + tail + '\n')
+			else:
+				append('ufid:' + ufid + ', ' + match + stats + tail + '\n')
+		return lines
+
+	def dump(self):
+		"""
+		Advance by one interval and dump the flows.
+
+		return:	List of lines of 'ovs-dpctl dump-flows' output.
+		"""
+		self.advance()
+		return self.lines()
+
+	def close(self):
+		""" Nothing to release. """
+		pass
+
+if (__name__ == '__main__'):
+	args = [int(arg) for arg in sys.argv[1:]]
+	vms, peers, polls = (args + [100, 8, 1][len(args):])[:3]
+	datacentre = SyntheticDatacentre(vms, peers)
+	for i in range(polls):
+		if i:
+			sys.stdout.write('\n')
+		sys.stdout.writelines(datacentre.dump())
@@ -1,5 +1,8 @@
 import add_to_sys_path
 import dpctl
+import flow_history
+import flowtable
+import heavy_hitters
 import unittest
 
 class TestFlowEntry(unittest.TestCase):
@@ -47,7 +50,7 @@ class TestFlowsAdd(unittest.TestCase):
 		bytes = self.entry.bytes
 		date = self.flows._src[srcIp][2]
 		self.assertTrue(self.flows._src.has_key(srcIp))
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [bytes, 0]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [bytes, 0]}, date])
 
 	def test_add_dst_flow(self):
 		self.flows.add_new_dst_flow(self.entry)
@@ -57,7 +60,7 @@ class TestFlowsAdd(unittest.TestCase):
 		bytes = self.entry.bytes
 		date = self.flows._dst[dstIp][2]
 		self.assertTrue(self.flows._dst.has_key(dstIp))
-		self.assertEquals(self.flows._dst[dstIp], [dstMac, {srcIp: [bytes, 0]}, date])
+		self.assertEquals(self.flows.get_dst_flows_by_ip(dstIp), [dstMac, {srcIp: [bytes, 0]}, date])
 
 class TestFlowsHasEntry(unittest.TestCase):
 	""" Test that flow entry lookups return expected results. """
@@ -149,7 +152,7 @@ class TestFlowsUpdate(unittest.TestCase):
 		bytes = self.entry.bytes
 		date = self.flows._src[srcIp][2]
 		self.assertTrue(self.flows._src.has_key(srcIp))
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [bytes, 0]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [bytes, 0]}, date])
 
 	def test_update_src_flow_increment(self):
 		self.flows.update_src_flow(self.entry)
@@ -161,7 +164,7 @@ class TestFlowsUpdate(unittest.TestCase):
 		bytes = self.entry.bytes
 		date = self.flows._src[srcIp][2]
 		self.assertTrue(self.flows._src.has_key(srcIp))
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [bytes, 0]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [bytes, 0]}, date])
 
 	def test_update_src_flow_new_start(self):
 		self.flows.update_src_flow(self.entry)
@@ -173,7 +176,7 @@ class TestFlowsUpdate(unittest.TestCase):
 		bytes = self.entry.bytes
 		date = self.flows._src[srcIp][2]
 		self.assertTrue(self.flows._src.has_key(srcIp))
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [bytes, 96]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [bytes, 96]}, date])
 
 	def test_update_src_flow_new_dst(self):
 		self.flows.update_src_flow(self.entry)
@@ -187,7 +190,7 @@ class TestFlowsUpdate(unittest.TestCase):
 		bytes = self.entry.bytes
 		date = self.flows._src[srcIp][2]
 		self.assertTrue(self.flows._src.has_key(srcIp))
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {oldDstIp: [bytes, 0], dstIp: [bytes, 0]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {oldDstIp: [bytes, 0], dstIp: [bytes, 0]}, date])
 
 	def test_update_src_flow_new_flow(self):
 		self.flows.update_src_flow(self.entry)
@@ -206,8 +209,8 @@ class TestFlowsUpdate(unittest.TestCase):
 		bytes = self.entry.bytes
 		date = self.flows._src[srcIp][2]
 		self.assertTrue(self.flows._src.has_key(srcIp))
-		self.assertEquals(self.flows._src[oldSrcIp], [oldSrcMac, {oldDstIp: [bytes, 0]}, oldDate])
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [bytes, 0]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(oldSrcIp), [oldSrcMac, {oldDstIp: [bytes, 0]}, oldDate])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [bytes, 0]}, date])
 
 class TestFlowsReset(unittest.TestCase):
 	""" Test the ability to reset byte counters for individual flows. """
@@ -224,7 +227,7 @@ class TestFlowsReset(unittest.TestCase):
 		srcMac = self.entry.srcMac
 		dstIp = self.entry.dstIp
 		date = self.flows._src[srcIp][2]
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [96, -96]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [96, -96]}, date])
 
 	def test_reset_src_flows_update_same(self):
 		self.flows.update_src_flow(self.entry)
@@ -235,7 +238,7 @@ class TestFlowsReset(unittest.TestCase):
 		srcMac = self.entry.srcMac
 		dstIp = self.entry.dstIp
 		date = self.flows._src[srcIp][2]
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [96, -96]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [96, -96]}, date])
 
 	def test_reset_src_flows_update(self):
 		self.flows.update_src_flow(self.entry)
@@ -246,7 +249,7 @@ class TestFlowsReset(unittest.TestCase):
 		srcMac = self.entry.srcMac
 		dstIp = self.entry.dstIp
 		date = self.flows._src[srcIp][2]
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [128, -96]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [128, -96]}, date])
 
 	def test_reset_src_flows_update_new_start(self):
 		self.flows.update_src_flow(self.entry)
@@ -257,7 +260,231 @@ class TestFlowsReset(unittest.TestCase):
 		srcMac = self.entry.srcMac
 		dstIp = self.entry.dstIp
 		date = self.flows._src[srcIp][2]
-		self.assertEquals(self.flows._src[srcIp], [srcMac, {dstIp: [48, 0]}, date])
+		self.assertEquals(self.flows.get_src_flows_by_ip(srcIp), [srcMac, {dstIp: [48, 0]}, date])
+
+class TestParseDpFlow(unittest.TestCase):
+	""" Test parsing of individual 'ovs-dpctl dump-flows' lines. """
+
+	TCP_LINE = ('in_port(2),eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+				'eth_type(0x0800),ipv4(src=192.168.1.1,dst=192.168.1.2,proto=6,'
+				'tos=0,ttl=64,frag=no),tcp(src=5001,dst=41234), packets:10, '
+				'bytes:1500, used:0.004s, flags:P., actions:3\n')
+	IGMP_LINE = ('in_port(2),eth(src=00:16:3e:00:00:01,dst=01:00:5e:00:00:16),'
+				 'eth_type(0x0800),ipv4(src=192.168.1.1,dst=224.0.0.22,proto=2,'
+				 'tos=0xc0,ttl=1,frag=no), packets:1, bytes:60, used:never, '
+				 'actions:1,3\n')
+	ARP_LINE = ('in_port(2),eth(src=00:16:3e:00:00:01,dst=ff:ff:ff:ff:ff:ff),'
+				'eth_type(0x0806),arp(sip=192.168.1.1,tip=192.168.1.2,op=1,'
+				'sha=00:16:3e:00:00:01,tha=00:00:00:00:00:00), packets:1, '
+				'bytes:42, used:1.204s, actions:1,3\n')
+	IPV6_LINE = ('in_port(2),eth(src=00:16:3e:00:00:01,dst=33:33:00:00:00:16),'
+				 'eth_type(0x86dd),ipv6(src=fe80::216:3eff:fe00:1,dst=ff02::16,'
+				 'label=0,proto=58,tclass=0,hlimit=1,frag=no),icmpv6(type=143,'
+				 'code=0), packets:2, bytes:180, used:3.1s, actions:1,3\n')
+	MEGAFLOW_LINE = ('recirc_id(0),in_port(2),skb_mark(0/0),'
+					 'eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+					 'eth_type(0x0800),ipv4(src=192.168.1.1/255.255.255.255,'
+					 'dst=192.168.1.2/255.255.255.0,proto=17/0,tos=0/0,ttl=64/0,'
+					 'frag=no), packets:3, bytes:270, used:0.520s, actions:3\n')
+
+	def test_tcp(self):
+		""" Test all fields of a TCP flow are extracted. """
+		entry = dpctl.parse_dp_flow(self.TCP_LINE)
+		self.assertEqual(entry.srcMac, '00:16:3e:00:00:01')
+		self.assertEqual(entry.dstMac, '00:16:3e:00:00:02')
+		self.assertEqual(entry.srcIp, '192.168.1.1')
+		self.assertEqual(entry.dstIp, '192.168.1.2')
+		self.assertEqual(entry.packets, 10)
+		self.assertEqual(entry.bytes, 1500)
+		self.assertEqual(entry.used, 0.004)
+
+	def test_igmp(self):
+		""" Test a flow without L4 fields still yields its byte count. """
+		entry = dpctl.parse_dp_flow(self.IGMP_LINE)
+		self.assertEqual(entry.dstIp, '224.0.0.22')
+		self.assertEqual(entry.bytes, 60)
+		self.assertEqual(entry.used, None)
+
+	def test_arp_skipped(self):
+		""" Test ARP flows are skipped. """
+		self.assertEqual(dpctl.parse_dp_flow(self.ARP_LINE), None)
+
+	def test_ipv6_skipped(self):
+		""" Test IPv6 flows are skipped. """
+		self.assertEqual(dpctl.parse_dp_flow(self.IPV6_LINE), None)
+
+	def test_megaflow(self):
+		""" Test extra keys and masked values do not shift the fields. """
+		entry = dpctl.parse_dp_flow(self.MEGAFLOW_LINE)
+		self.assertEqual(entry.srcIp, '192.168.1.1')
+		self.assertEqual(entry.dstIp, '192.168.1.2')
+		self.assertEqual(entry.packets, 3)
+		self.assertEqual(entry.bytes, 270)
+
+	def test_blank_line(self):
+		""" Test an empty line is skipped. """
+		self.assertEqual(dpctl.parse_dp_flow('\n'), None)
+
+	def test_update_entries(self):
+		""" Test only the IPv4 lines of a dump reach the flowset. """
+		ctl = dpctl.DpCtl('xenbr0')
+		ctl.update_entries([self.ARP_LINE, self.TCP_LINE, self.IPV6_LINE,
+							self.IGMP_LINE])
+		self.assertEqual(ctl.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [1500, 0], '224.0.0.22': [60, 0]})
+		self.assertEqual(ctl.get_mac_by_ip('192.168.1.2'), '00:16:3e:00:00:02')
+
+	def test_iter_entries(self):
+		""" Test a dump is parsed lazily, one entry per IPv4 line. """
+		lines = iter([self.ARP_LINE, self.TCP_LINE, self.IGMP_LINE])
+		entries = dpctl.iter_dp_flow_entries(lines)
+		self.assertEqual(entries.next().dstIp, '192.168.1.2')
+		self.assertEqual(list(lines), [self.IGMP_LINE])
+
+	def test_batched(self):
+		""" Test batches are bounded and cover every item in order. """
+		self.assertEqual(list(dpctl.batched(xrange(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+		self.assertEqual(list(dpctl.batched([], 3)), [])
+
+class TestDeltaUpdates(unittest.TestCase):
+	""" Test that each poll only applies new and changed datapath flows. """
+
+	LINE = ('in_port(2),eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+			'eth_type(0x0800),ipv4(src=192.168.1.1,dst=192.168.1.%d,proto=6,'
+			'tos=0,ttl=64,frag=no),tcp(src=5001,dst=80), packets:1, '
+			'bytes:%d, used:%s, actions:3\n')
+
+	def setUp(self):
+		self.ctl = dpctl.DpCtl('xenbr0')
+		self.applied = []
+		update_flows = self.ctl.flows.update_flows
+		def recording_update_flows(entry):
+			self.applied.append((entry.dstIp, entry.bytes))
+			update_flows(entry)
+		self.ctl.flows.update_flows = recording_update_flows
+
+	def assertStats(self, new, changed, unchanged, vanished):
+		stats = self.ctl.poll_stats
+		self.assertEqual((stats.new, stats.changed, stats.unchanged, stats.vanished),
+						 (new, changed, unchanged, vanished))
+
+	def test_first_poll(self):
+		""" Test every flow of the first poll is new and applied. """
+		self.ctl.update_entries([self.LINE % (2, 100, '0.1s'), self.LINE % (3, 200, '0.1s')])
+		self.assertStats(2, 0, 0, 0)
+		self.assertEqual(self.applied, [('192.168.1.2', 100), ('192.168.1.3', 200)])
+
+	def test_unchanged_skipped(self):
+		""" Test a flow whose byte count has not moved is not applied again,
+		even though its 'used' time has. """
+		self.ctl.update_entries([self.LINE % (2, 100, '0.1s'), self.LINE % (3, 200, '0.1s')])
+		self.applied = []
+		self.ctl.update_entries([self.LINE % (2, 100, '1.1s'), self.LINE % (3, 250, '0.1s')])
+		self.assertStats(0, 1, 1, 0)
+		self.assertEqual(self.applied, [('192.168.1.3', 250)])
+		self.assertEqual(self.ctl.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [100, 0], '192.168.1.3': [250, 0]})
+
+	def test_vanished(self):
+		""" Test flows missing from a dump are counted and then forgotten. """
+		self.ctl.update_entries([self.LINE % (2, 100, '0.1s'), self.LINE % (3, 200, '0.1s')])
+		self.ctl.update_entries([self.LINE % (3, 200, '0.1s'), self.LINE % (4, 10, '0.1s')])
+		self.assertStats(1, 0, 1, 1)
+		self.ctl.update_entries([self.LINE % (2, 100, '0.1s')])
+		self.assertStats(1, 0, 0, 2)
+
+	def test_ufid(self):
+		""" Test flows are told apart by ufid when the dump carries one. """
+		line = self.LINE % (2, 100, '0.1s')
+		self.ctl.update_entries(['ufid:1, ' + line, 'ufid:2, ' + line])
+		self.assertStats(2, 0, 0, 0)
+		self.ctl.update_entries(['ufid:2, ' + line])
+		self.assertStats(0, 0, 1, 1)
+
+	def test_poll_stats_returned(self):
+		""" Test end_poll returns the counts of the poll it completes. """
+		self.ctl.begin_poll()
+		list(self.ctl.changed_entries([self.LINE % (2, 100, '0.1s')]))
+		stats = self.ctl.end_poll()
+		self.assertEqual((stats.new, stats.vanished), (1, 0))
+		self.assertTrue(stats is self.ctl.poll_stats)
+
+	def test_deltas(self):
+		""" Test entries carry the bytes moved since the previous poll, except
+		in the first poll, and are counted into the heavy-hitter tracker. """
+		self.ctl = dpctl.DpCtl('xenbr0', heavy_hitters=heavy_hitters.HeavyHitters(window=1))
+		self.ctl.flows.tick = lambda now=None: dpctl.Flows.tick(self.ctl.flows, 0)
+		deltas = []
+		def poll(lines):
+			self.ctl.begin_poll()
+			entries = list(self.ctl.changed_entries(lines))
+			deltas.append([entry.delta for entry in entries])
+			self.ctl.apply_entries(entries)
+			self.ctl.end_poll()
+		poll([self.LINE % (2, 100, '0.1s')])
+		poll([self.LINE % (2, 150, '0.1s'), self.LINE % (3, 20, '0.1s')])
+		poll([self.LINE % (2, 40, '0.1s'), self.LINE % (3, 20, '0.1s')])
+		self.assertEqual(deltas, [[None], [50, 20], [40]])
+		self.assertEqual(self.ctl.get_top_peers('192.168.1.1', 2),
+						 [('192.168.1.2', 90.0), ('192.168.1.3', 20.0)])
+
+	def test_history(self):
+		""" Test the bytes of each poll are recorded in the history. """
+		self.ctl = dpctl.DpCtl('xenbr0', history=flow_history.FlowHistory())
+		for now, bytes in ((100, 1000), (101, 1500), (102, 1500), (103, 2500)):
+			self.ctl.flows.tick = lambda now=now: dpctl.Flows.tick(self.ctl.flows, now)
+			self.ctl.update_entries([self.LINE % (2, bytes, '0.1s')])
+		self.assertEqual(self.ctl.get_history_samples('192.168.1.1', '192.168.1.2', 0, 4),
+						 [0, 500, 0, 1000])
+		self.assertEqual(self.ctl.get_history_rate('192.168.1.1', '192.168.1.2', 3), 500.0)
+		self.assertEqual(dpctl.DpCtl('xenbr0').get_history_rate('192.168.1.1', '192.168.1.2', 3),
+						 None)
+
+	def test_rates_several_flows(self):
+		""" Test the rate of a pair carried by several datapath flows is the
+		sum of theirs, with either backend. """
+		for flows in (dpctl.Flows(rate_windows=(10, 60)),
+					  flowtable.ColumnarFlows(rate_windows=(10, 60))):
+			self.ctl = dpctl.DpCtl('xenbr0', flows=flows)
+			for now in range(6):
+				self.ctl.flows.tick = lambda now=now: flows.__class__.tick(flows, now)
+				self.ctl.update_entries(['ufid:1, ' + self.LINE % (2, 1000 + 1000 * now, '0.1s'),
+										 'ufid:2, ' + self.LINE % (2, 10 + 10 * now, '0.1s')])
+			for rate in self.ctl.get_flow_rates('192.168.1.1', '192.168.1.2'):
+				self.assertAlmostEqual(rate, 1010)
+
+class TestFlowsEdges(unittest.TestCase):
+	""" Test that each (src, dst) pair is stored once and shared by both indexes. """
+
+	def setUp(self):
+		self.flows = dpctl.Flows()
+		self.entry = dpctl.FlowEntry('00:00:00:00:00:01', '00:00:00:00:00:02',
+						  '192.168.1.1', '192.168.1.2', 96)
+
+	def test_shared_edge(self):
+		self.flows.update_flows(self.entry)
+		edge = self.flows._src['192.168.1.1'][1]['192.168.1.2']
+		self.assertTrue(edge is self.flows._dst['192.168.1.2'][1]['192.168.1.1'])
+		self.assertEqual(edge[:4], [96, 0, 0, dpctl.BOTH_VIEWS])
+
+	def test_update_touches_one_edge(self):
+		self.flows.update_flows(self.entry)
+		self.entry.bytes = 48
+		self.flows.update_flows(self.entry)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1], {'192.168.1.2': [48, 96]})
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1], {'192.168.1.1': [48, 96]})
+
+	def test_views_are_copies(self):
+		self.flows.update_flows(self.entry)
+		view = self.flows.get_src_flows_by_ip('192.168.1.1')
+		view[1]['192.168.1.2'][0] = 0
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1], {'192.168.1.1': [96, 0]})
+
+	def test_del_src_detaches(self):
+		self.flows.update_flows(self.entry)
+		edge = self.flows._src['192.168.1.1'][1]['192.168.1.2']
+		self.flows.del_src_flows_by_ip('192.168.1.1')
+		self.assertEqual(edge[3], dpctl.DST_VIEW)
 
 class TestFlowsGet(unittest.TestCase):
 		""" Test the ability to retrieve flows references (without copying). """
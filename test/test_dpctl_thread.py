@@ -0,0 +1,331 @@
+import add_to_sys_path
+import dpctl
+import dpctl_thread
+import flow_source
+import math
+import sys
+import time
+import unittest
+from fake_flow_source import StaticFlowSource
+
+class CountingLock(object):
+	""" Lock recording how many flows were applied while it was held. """
+
+	def __init__(self, flows):
+		self.updates = 0
+		self.held = []
+		update_flows = flows.update_flows
+		def counting_update_flows(entry):
+			self.updates += 1
+			update_flows(entry)
+		flows.update_flows = counting_update_flows
+
+	def acquire(self):
+		self.start = self.updates
+
+	def release(self):
+		self.held.append(self.updates - self.start)
+
+class TestDpReadClass(unittest.TestCase):
+	""" Test the polling thread ingests dumps in bounded batches. """
+
+	def test_poll_batches(self):
+		""" Test the lock is taken once per batch, not once per dump, and then
+		once more to expire flows. """
+		lines = ['in_port(2),eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+				 'eth_type(0x0800),ipv4(src=10.0.0.%d,dst=10.0.1.1,proto=6,tos=0,'
+				 'ttl=64,frag=no), packets:1, bytes:%d, used:0.1s, actions:3\n' % (i, i)
+				 for i in range(10)]
+		thread = dpctl_thread.DpReadClass(bridge='xenbr0', source=StaticFlowSource(lines),
+										  batch_size=4)
+		thread.lock = CountingLock(thread.dpctl.flows)
+		thread.poll()
+		self.assertEqual(thread.lock.held, [4, 4, 2, 0])
+		self.assertEqual(thread.dpctl.get_src_flows_by_ip('10.0.0.9')[1], {'10.0.1.1': [9, 0]})
+
+	def test_poll_evicts(self):
+		""" Test flows above the size limit are evicted a batch at a time. """
+		lines = ['in_port(2),eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+				 'eth_type(0x0800),ipv4(src=10.0.0.%d,dst=10.0.1.1,proto=6,tos=0,'
+				 'ttl=64,frag=no), packets:1, bytes:%d, used:0.1s, actions:3\n' % (i, i)
+				 for i in range(10)]
+		thread = dpctl_thread.DpReadClass(bridge='xenbr0', source=StaticFlowSource(lines),
+										  flows=dpctl.Flows(max_entries=3), batch_size=4)
+		thread.lock = CountingLock(thread.dpctl.flows)
+		thread.poll()
+		self.assertEqual(len(thread.lock.held), 5)
+		stats = thread.get_eviction_stats()
+		self.assertEqual((stats['resident_flows'], stats['evicted_lru']), (3, 7))
+
+class TestDpReadClassBulk(unittest.TestCase):
+	""" Test several IP addresses are queried under one lock acquisition. """
+
+	LINE = ('in_port(2),eth(src=00:16:3e:00:00:0%d,dst=00:16:3e:00:00:0%d),'
+			'eth_type(0x0800),ipv4(src=10.0.0.%d,dst=10.0.0.%d,proto=6,tos=0,'
+			'ttl=64,frag=no), packets:1, bytes:%d, used:0.1s, actions:3\n')
+
+	def make_thread(self, rcu=False):
+		lines = [self.LINE % (1, 2, 1, 2, 100), self.LINE % (2, 3, 2, 3, 50)]
+		thread = dpctl_thread.DpReadClass(bridge='xenbr0', source=StaticFlowSource(lines),
+										  rcu=rcu)
+		thread.poll()
+		thread.lock = CountingLock(thread.dpctl.flows)
+		return thread
+
+	def test_copy_and_reset(self):
+		""" Test entries and MACs of every IP address come from one lock
+		acquisition, and their flows are reset. """
+		thread = self.make_thread()
+		results = thread.copy_and_reset_entries_by_ips(['10.0.0.1', '10.0.0.2', '10.0.0.9'])
+		self.assertEqual(len(thread.lock.held), 1)
+		src, dst, mac = results['10.0.0.2']
+		self.assertEqual((src[1], dst[1], mac),
+						 ({'10.0.0.3': [50, 0]}, {'10.0.0.1': [100, 0]}, '00:16:3e:00:00:02'))
+		self.assertEqual(results['10.0.0.1'][1:], (None, '00:16:3e:00:00:01'))
+		self.assertEqual(results['10.0.0.9'], (None, None, None))
+		self.assertEqual(thread.dpctl.get_src_flows_by_ip('10.0.0.1')[1], {'10.0.0.2': [100, -100]})
+
+	def test_copy_and_reset_rates(self):
+		""" Test rates are fetched with the entries, under the same lock
+		acquisition. """
+		lines = [self.LINE % (1, 2, 1, 2, 100), self.LINE % (2, 3, 2, 3, 50)]
+		thread = dpctl_thread.DpReadClass(bridge='xenbr0', source=StaticFlowSource(lines),
+										  flows=dpctl.Flows(rate_windows=(10,)))
+		thread.poll()
+		thread.lock = CountingLock(thread.dpctl.flows)
+		results = thread.copy_and_reset_entries_by_ips(['10.0.0.2', '10.0.0.9'], rates=True)
+		self.assertEqual(len(thread.lock.held), 1)
+		self.assertEqual(results['10.0.0.2'][3:], ({'10.0.0.3': (0,)}, {'10.0.0.1': (0,)}))
+		self.assertEqual(results['10.0.0.9'], (None, None, None, None, None))
+
+	def test_get(self):
+		""" Test bulk reads take the lock once, or not at all from a snapshot. """
+		thread = self.make_thread()
+		results = thread.get_entries_by_ips(['10.0.0.1', '10.0.0.3'])
+		self.assertEqual(len(thread.lock.held), 1)
+		self.assertEqual((results['10.0.0.3'][1][1], results['10.0.0.3'][2]),
+						 ({'10.0.0.2': [50, 0]}, '00:16:3e:00:00:03'))
+		thread = self.make_thread(rcu=True)
+		thread.lock = FailingLock()
+		results = thread.get_entries_by_ips(['10.0.0.1', '10.0.0.3'])
+		self.assertEqual((results['10.0.0.1'][0][1], results['10.0.0.1'][1:]),
+						 ({'10.0.0.2': [100, 0]}, (None, '00:16:3e:00:00:01')))
+
+	def test_export_matrix(self):
+		""" Test the matrix is exported under one lock acquisition, or from
+		the snapshot. """
+		thread = self.make_thread()
+		matrix = thread.export_matrix()
+		self.assertEqual(len(thread.lock.held), 1)
+		self.assertEqual(matrix.row('10.0.0.1'), {'10.0.0.2': 100})
+		thread = self.make_thread(rcu=True)
+		thread.lock = FailingLock()
+		self.assertEqual(thread.export_matrix().row('10.0.0.2'), {'10.0.0.3': 50})
+		self.assertEqual(thread.export_matrix(0), None)
+
+class TestPollScheduler(unittest.TestCase):
+	""" Test the polling interval adapts to traffic within its bounds. """
+
+	def setUp(self):
+		self.scheduler = dpctl_thread.PollScheduler(1, 0.25, 4)
+		self.now = 0
+
+	def update(self, new=0, changed=0, unchanged=100, vanished=0, bytes=0):
+		self.now += self.scheduler.interval
+		return self.scheduler.update(dpctl.PollStats(new, changed, unchanged, vanished, bytes),
+									 self.now)
+
+	def test_backs_off(self):
+		""" Test a stable datapath is polled less often, up to the maximum,
+		even with every flow's counters moving. """
+		self.assertEqual([self.update(changed=100, unchanged=0, bytes=self.scheduler.interval * 1000)
+						  for i in range(6)], [1.5, 2.25, 3.375, 4, 4, 4])
+
+	def test_churn(self):
+		""" Test flows appearing or vanishing shorten the interval, down to the
+		minimum. """
+		self.assertEqual([self.update(new=20), self.update(vanished=20), self.update(new=50)],
+						 [0.5, 0.25, 0.25])
+		self.assertEqual(self.update(new=5), 0.25)
+
+	def test_burst(self):
+		""" Test a jump in aggregate throughput shortens the interval. """
+		self.update(bytes=1000)
+		self.update(bytes=1500)
+		self.assertEqual(self.scheduler.interval, 2.25)
+		self.assertEqual(self.update(bytes=2.25 * 10000), 1.125)
+
+	def test_thread_bounds(self):
+		""" Test the thread only adapts its interval when given bounds. """
+		thread = dpctl_thread.DpReadClass(interval=2, source=StaticFlowSource([]),
+										  max_interval=5)
+		self.assertEqual(thread.get_poll_interval(), 2)
+		self.assertEqual((thread.scheduler.min_interval, thread.scheduler.max_interval), (2, 5))
+		self.assertEqual(dpctl_thread.DpReadClass(source=StaticFlowSource([])).scheduler, None)
+
+class FailingLock(object):
+	""" Lock that must not be taken. """
+
+	def acquire(self):
+		raise AssertionError('lock taken')
+
+	release = acquire
+
+class TestDpReadClassRcu(unittest.TestCase):
+	""" Test queries are answered from published snapshots in RCU mode. """
+
+	LINE = ('in_port(2),eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+			'eth_type(0x0800),ipv4(src=10.0.0.1,dst=10.0.1.%d,proto=6,tos=0,'
+			'ttl=64,frag=no), packets:1, bytes:%d, used:0.1s, actions:3\n')
+
+	def setUp(self):
+		self.source = StaticFlowSource([self.LINE % (1, 100), self.LINE % (2, 200)])
+		self.thread = dpctl_thread.DpReadClass(bridge='xenbr0', source=self.source,
+											   flows=dpctl.Flows(ttl=30), rcu=True)
+
+	def test_reads_published(self):
+		""" Test queries see the last completed poll, without locking. """
+		self.assertEqual(self.thread.get_entries_by_src_ip('10.0.0.1'), None)
+		self.thread.poll()
+		self.source.lines = [self.LINE % (1, 150)]
+		lock, self.thread.lock = self.thread.lock, FailingLock()
+		self.assertEqual(self.thread.get_entries_by_src_ip('10.0.0.1')[1],
+						 {'10.0.1.1': [100, 0], '10.0.1.2': [200, 0]})
+		self.assertEqual(self.thread.copy_entries_by_dst_ip('10.0.1.2')[1],
+						 {'10.0.0.1': [200, 0]})
+		self.assertEqual(self.thread.get_mac_by_ip('10.0.1.1'), '00:16:3e:00:00:02')
+		self.thread.lock = lock
+		self.thread.poll()
+		self.assertEqual(self.thread.get_entries_by_src_ip('10.0.0.1')[1],
+						 {'10.0.1.1': [150, 0], '10.0.1.2': [200, 0]})
+
+	def test_copies_detached(self):
+		""" Test modifying an answer does not modify the snapshot. """
+		self.thread.poll()
+		self.thread.get_entries_by_src_ip('10.0.0.1')[1]['10.0.1.1'][0] = 0
+		self.assertEqual(self.thread.get_entries_by_src_ip('10.0.0.1')[1]['10.0.1.1'],
+						 [100, 0])
+
+	def test_copy_and_reset(self):
+		""" Test a reset is made to the flow data and published by the next poll. """
+		self.thread.poll()
+		self.assertEqual(self.thread.copy_and_reset_entries_by_src_ip('10.0.0.1')[1],
+						 {'10.0.1.1': [100, 0], '10.0.1.2': [200, 0]})
+		self.thread.poll()
+		self.assertEqual(self.thread.get_entries_by_src_ip('10.0.0.1')[1],
+						 {'10.0.1.1': [100, -100], '10.0.1.2': [200, -200]})
+
+	def test_eviction_published(self):
+		""" Test evicted flows leave the next snapshot. """
+		self.thread.poll()
+		self.source.lines = [self.LINE % (1, 150)]
+		self.thread.dpctl.flows.tick = lambda now=None: dpctl.Flows.tick(self.thread.dpctl.flows, 1e10)
+		self.thread.poll()
+		self.assertEqual(self.thread.get_entries_by_src_ip('10.0.0.1')[1],
+						 {'10.0.1.1': [150, 0]})
+		self.assertEqual(self.thread.get_entries_by_dst_ip('10.0.1.2'), None)
+		self.assertEqual(self.thread.snapshot.generation, 2)
+
+	def test_rates_published(self):
+		""" Test rates are published, and decay while their flows are idle. """
+		flows = dpctl.Flows(rate_windows=(10,))
+		thread = dpctl_thread.DpReadClass(bridge='xenbr0', source=self.source,
+										  flows=flows, rcu=True)
+		flows.tick = lambda now=None: dpctl.Flows.tick(flows, self.now)
+		self.now = 0
+		thread.poll()
+		self.now = 10
+		self.source.lines = [self.LINE % (1, 1100), self.LINE % (2, 200)]
+		thread.poll()
+		rates = thread.get_rates_by_src_ip('10.0.0.1')
+		self.assertAlmostEqual(rates['10.0.1.1'][0], 100)
+		self.assertEqual(rates['10.0.1.2'], (0,))
+		self.now = 20
+		thread.poll()
+		lock, thread.lock = thread.lock, FailingLock()
+		self.assertAlmostEqual(thread.get_rates_by_dst_ip('10.0.1.1')['10.0.0.1'][0],
+							   100 * math.exp(-1))
+		thread.lock = lock
+		self.assertEqual(thread.get_rates_by_dst_ip('10.0.1.1'),
+						 flows.get_dst_rates_by_ip('10.0.1.1'))
+
+class TestMultiBridgeReadClass(unittest.TestCase):
+	""" Test several bridges are polled into one flowset. """
+
+	LINE = ('in_port(2),eth(src=00:16:3e:00:00:0%d,dst=00:16:3e:00:00:0%d),'
+			'eth_type(0x0800),ipv4(src=10.0.0.%d,dst=10.0.0.%d,proto=6,tos=0,'
+			'ttl=64,frag=no), packets:1, bytes:%d, used:0.1s, actions:3\n')
+
+	def setUp(self):
+		self.sources = {'xenbr0': StaticFlowSource([self.LINE % (1, 2, 1, 2, 100)]),
+						'xenbr1': StaticFlowSource([self.LINE % (3, 1, 3, 1, 40)])}
+		self.thread = dpctl_thread.MultiBridgeReadClass(['xenbr0', 'xenbr1'], interval=1,
+														intervals={'xenbr1': 5},
+														flows=dpctl.Flows(ttl=30),
+														sources=self.sources)
+
+	def test_shared_flowset(self):
+		""" Test both bridges' flows land in one flowset, tagged by bridge. """
+		stats = self.thread.poll()
+		self.assertEqual((stats['xenbr0'].new, stats['xenbr1'].new), (1, 1))
+		self.assertTrue(self.thread.ctls['xenbr1'].flows is self.thread.dpctl.flows)
+		self.assertEqual(self.thread.get_entries_by_dst_ip('10.0.0.1')[1], {'10.0.0.3': [40, 0]})
+		self.assertEqual(self.thread.get_entries_by_src_ip('10.0.0.1')[1], {'10.0.0.2': [100, 0]})
+		self.assertEqual(self.thread.get_bridge_by_ip('10.0.0.1'), 'xenbr0')
+		self.assertEqual(self.thread.get_bridge_by_ip('10.0.0.3'), 'xenbr1')
+		self.assertEqual(self.thread.get_bridge_by_ip('10.0.0.2'), None)
+		self.assertEqual(self.thread.get_bridges_by_flow('10.0.0.3', '10.0.0.1'), set(['xenbr1']))
+
+	def test_same_flow_on_two_bridges(self):
+		""" Test a flow carried by two bridges counts what both moved. """
+		self.sources['xenbr0'].lines = [self.LINE % (1, 2, 1, 2, 1000)]
+		self.sources['xenbr1'].lines = [self.LINE % (1, 2, 1, 2, 10)]
+		self.thread.poll()
+		self.assertEqual(self.thread.get_entries_by_src_ip('10.0.0.1')[1], {'10.0.0.2': [1000, 0]})
+		for poll in xrange(2, 5):
+			self.sources['xenbr0'].lines = [self.LINE % (1, 2, 1, 2, 1000 * poll)]
+			self.sources['xenbr1'].lines = [self.LINE % (1, 2, 1, 2, 10 * poll)]
+			self.thread.poll()
+			self.assertEqual(self.thread.dpctl.flows.get_flow_bytes('10.0.0.1', '10.0.0.2'),
+							 1010 * poll - 10)
+		self.assertEqual(self.thread.get_bridges_by_flow('10.0.0.1', '10.0.0.2'),
+						 set(['xenbr0', 'xenbr1']))
+		self.assertEqual(self.thread.get_bridges_by_flow('10.0.0.2', '10.0.0.1'), None)
+
+	def test_dumps_started_together(self):
+		""" Test the dump commands of the bridges run at once. """
+		command = [sys.executable, '-c', 'import time; time.sleep(0.5)']
+		sources = dict((bridge, flow_source.SubprocessFlowSource(bridge, command))
+					   for bridge in ('xenbr0', 'xenbr1'))
+		thread = dpctl_thread.MultiBridgeReadClass(['xenbr0', 'xenbr1'], sources=sources)
+		start = time.time()
+		thread.poll()
+		self.assertTrue(time.time() - start < 0.9)
+
+	def test_bridge_stats(self):
+		""" Test each bridge keeps its own interval, due time and timings. """
+		self.thread.poll()
+		self.thread.poll_bridges(['xenbr0'])
+		stats = self.thread.get_bridge_stats()
+		self.assertEqual((stats['xenbr0']['interval'], stats['xenbr0']['polls']), (1, 2))
+		self.assertEqual((stats['xenbr1']['interval'], stats['xenbr1']['polls']), (5, 1))
+		self.assertEqual(stats['xenbr0']['last_poll'].unchanged, 1)
+		self.assertTrue(stats['xenbr0']['max_seconds'] >= stats['xenbr0']['mean_seconds'] > 0)
+		timing = self.thread.bridge_stats
+		self.assertTrue(timing['xenbr1'].due - timing['xenbr0'].due > 3)
+
+	def test_eviction_untags(self):
+		""" Test an IP address whose flows are all evicted loses its bridge. """
+		self.thread.poll()
+		self.sources['xenbr1'].lines = []
+		flows = self.thread.dpctl.flows
+		flows.tick = lambda now=None: dpctl.Flows.tick(flows, 1e10)
+		self.sources['xenbr0'].lines = [self.LINE % (1, 2, 1, 2, 150)]
+		self.thread.poll()
+		self.assertEqual(self.thread.get_bridge_by_ip('10.0.0.3'), None)
+		self.assertEqual(self.thread.get_bridge_by_ip('10.0.0.1'), 'xenbr0')
+		self.assertEqual(self.thread.get_bridges_by_flow('10.0.0.3', '10.0.0.1'), None)
+		self.assertEqual(self.thread.flow_bridges.keys(), ['10.0.0.1'])
+
+if (__name__ == '__main__'):
+	unittest.main()
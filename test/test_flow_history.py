@@ -0,0 +1,75 @@
+import add_to_sys_path
+import flow_history
+import unittest
+
+class TestFlowHistory(unittest.TestCase):
+	""" Test the per-pair throughput history rings. """
+
+	def setUp(self):
+		self.history = flow_history.FlowHistory(levels=((1, 10, 'I'), (5, 4, 'd')), max_pairs=2)
+
+	def add(self, now, bytes, src='10.0.0.1', dst='10.0.0.2'):
+		self.history.tick(now)
+		self.history.add(src, dst, bytes)
+
+	def test_samples(self):
+		""" Test bytes land in the bucket of their tick at every resolution,
+		and skipped buckets read as zero. """
+		self.add(100, 10)
+		self.add(101, 20)
+		self.add(101, 5)
+		self.add(104, 40)
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.2', 0, 5),
+						 [10, 25, 0, 0, 40])
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.2', 1), [0, 0, 0, 75])
+		self.history.tick(106)
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.2', 0, 3), [40, 0, 0])
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.3'), None)
+
+	def test_ring_wraps(self):
+		""" Test buckets older than the ring are cleared when it wraps. """
+		self.add(100, 10)
+		self.add(112, 20)
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.2'),
+						 [0] * 9 + [20])
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.2', 1),
+						 [0, 10, 0, 20])
+
+	def test_rate(self):
+		""" Test rates come from the finest resolution covering the period. """
+		for now in range(100, 120):
+			self.add(now, 100)
+		self.assertEqual(self.history.get_rate('10.0.0.1', '10.0.0.2', 4), 100.0)
+		self.assertEqual(self.history.get_rate('10.0.0.1', '10.0.0.2', 15), 100.0)
+		self.history.tick(125)
+		self.assertEqual(self.history.get_rate('10.0.0.1', '10.0.0.2', 5), 0.0)
+		self.assertEqual(self.history.get_rate('10.0.0.1', '10.0.0.2', 10), 40.0)
+
+	def test_saturates(self):
+		""" Test 32-bit buckets saturate rather than wrap. """
+		self.add(100, flow_history.MAX_UINT)
+		self.add(100, 10)
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.2', 0, 1),
+						 [flow_history.MAX_UINT])
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.2', 1, 1),
+						 [flow_history.MAX_UINT + 10])
+
+	def test_bounded(self):
+		""" Test a pair beyond the limit evicts the least recently written. """
+		self.add(100, 1)
+		self.add(100, 1, dst='10.0.0.3')
+		self.add(101, 1)
+		self.add(102, 1, dst='10.0.0.4')
+		self.assertEqual((list(self.history.pairs), self.history.evicted),
+						 ([('10.0.0.1', '10.0.0.2'), ('10.0.0.1', '10.0.0.4')], 1))
+		self.assertEqual(self.history.get_samples('10.0.0.1', '10.0.0.3'), None)
+		self.add(110, 1, dst='10.0.0.4')
+		self.add(121, 1, dst='10.0.0.4')
+		self.assertEqual(list(self.history.pairs), [('10.0.0.1', '10.0.0.4')])
+
+	def test_pair_bytes(self):
+		""" Test the documented storage per pair. """
+		self.assertEqual(flow_history.pair_bytes(), 300 * 4 + 2 * 60 * 8 + 3 * 8)
+
+if (__name__ == '__main__'):
+	unittest.main()
@@ -0,0 +1,312 @@
+import add_to_sys_path
+import collections
+import dpctl
+import fake_unixctl
+import flow_source
+import gzip
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from fake_flow_source import StaticFlowSource
+
+FLOWS = ('in_port(2),eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+		 'eth_type(0x0800),ipv4(src=192.168.1.1,dst=192.168.1.2,proto=6,'
+		 'tos=0,ttl=64,frag=no),tcp(src=5001,dst=80), packets:2, bytes:300, '
+		 'used:0.1s, actions:3\n'
+		 'in_port(3),eth(src=00:16:3e:00:00:02,dst=00:16:3e:00:00:01),'
+		 'eth_type(0x0800),ipv4(src=192.168.1.2,dst=192.168.1.1,proto=6,'
+		 'tos=0,ttl=64,frag=no),tcp(src=80,dst=5001), packets:1, bytes:60, '
+		 'used:0.1s, actions:2\n')
+
+class TestSubprocessFlowSource(unittest.TestCase):
+	""" Test dumps taken by running a command. """
+
+	def test_dump(self):
+		""" Test the command output is returned line by line. """
+		source = flow_source.SubprocessFlowSource('xenbr0', [sys.executable, '-c',
+												  'import sys; sys.stdout.write(%r)' % FLOWS])
+		self.assertEqual(list(source.dump()), FLOWS.splitlines(True))
+
+	def test_stream_stopped_early(self):
+		""" Test abandoning a dump part way through stops the command. """
+		source = flow_source.SubprocessFlowSource('xenbr0', ['yes', FLOWS.splitlines()[0]])
+		lines = source.dump()
+		self.assertEqual(lines.next(), FLOWS.splitlines(True)[0])
+		lines.close()
+
+	def test_stream_dropped(self):
+		""" Test the command is started with the dump, and reaped if the dump
+		is dropped without being closed, whether part read or never read. """
+		source = flow_source.SubprocessFlowSource('xenbr0', ['yes', FLOWS.splitlines()[0]])
+		for read in (1, 0):
+			lines = source.dump()
+			proc = lines.gi_frame.f_locals['proc']
+			self.assertEqual(proc.poll(), None)
+			for i in range(read):
+				lines.next()
+			del lines
+			self.assertNotEqual(proc.returncode, None)
+
+	def test_missing_command(self):
+		""" Test a command that cannot be run gives an empty dump. """
+		source = flow_source.SubprocessFlowSource('xenbr0', ['/nonexistent/ovs-dpctl'])
+		self.assertEqual(list(source.dump()), [])
+
+class TestUnixctlFlowSource(unittest.TestCase):
+	""" Test dumps taken over the unixctl socket. """
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'ovs-vswitchd.1.ctl')
+		self.server = fake_unixctl.FakeUnixctlServer(self.path, FLOWS)
+		self.fallback = StaticFlowSource(['fallback\n'])
+		self.source = flow_source.UnixctlFlowSource('xenbr0', self.path, self.fallback)
+
+	def tearDown(self):
+		self.source.close()
+		self.server.close()
+		shutil.rmtree(self.dir)
+
+	def test_dump(self):
+		""" Test a dump is requested for the bridge and returned line by line. """
+		self.assertEqual(list(self.source.dump()), FLOWS.splitlines(True))
+		self.assertEqual(self.server.requests[0]['method'], 'dpctl/dump-flows')
+		self.assertEqual(self.server.requests[0]['params'], ['xenbr0'])
+
+	def test_connection_kept(self):
+		""" Test repeated dumps share a single connection. """
+		for i in range(3):
+			list(self.source.dump())
+		self.assertEqual(len(self.server.connections), 1)
+		self.assertEqual(len(self.server.requests), 3)
+		self.assertEqual(self.fallback.dumps, 0)
+
+	def test_large_dump(self):
+		""" Test a reply spanning many reads is reassembled. """
+		self.server.flows = FLOWS * 5000
+		self.assertEqual(len(list(self.source.dump())), 10000)
+
+	def test_streamed(self):
+		""" Test lines are read before the rest of the reply has arrived. """
+		self.server.flows = FLOWS * 5000
+		self.server.hold = threading.Event()
+		lines = self.source.dump()
+		try:
+			self.assertEqual(lines.next(), FLOWS.splitlines(True)[0])
+		finally:
+			self.server.hold.set()
+		self.assertEqual(len(list(lines)), 9999)
+		self.assertEqual(list(self.source.dump()), FLOWS.splitlines(True) * 5000)
+		self.assertEqual(len(self.server.connections), 1)
+
+	def test_escapes(self):
+		""" Test escapes are decoded, however the reply is split into reads. """
+		self.server.flows = (u'a "quoted" \\n\u00e9 line\n' + 'x' * 70000 + '\\\n' +
+							 'no newline at end')
+		expected = self.server.flows.encode('utf-8').splitlines(True)
+		self.assertEqual(list(self.source.dump()), expected)
+		self.server.hold = threading.Event()
+		self.server.hold.set()
+		self.assertEqual(list(self.source.dump()), expected)
+
+	def test_member_order(self):
+		""" Test the result may come before or after the other members. """
+		self.server.respond = lambda msg: collections.OrderedDict(
+			[('result', FLOWS), ('error', None), ('id', msg['id'])])
+		self.assertEqual(list(self.source.dump()), FLOWS.splitlines(True))
+		self.server.respond = lambda msg: collections.OrderedDict(
+			[('id', msg['id']), ('error', None), ('result', FLOWS)])
+		self.assertEqual(list(self.source.dump()), FLOWS.splitlines(True))
+		self.assertEqual(self.fallback.dumps, 0)
+
+	def test_abandoned(self):
+		""" Test a dump abandoned part way through drops the connection, and
+		the next dump opens another. """
+		lines = self.source.dump()
+		lines.next()
+		lines.close()
+		self.assertEqual(self.source.sock, None)
+		self.assertEqual(list(self.source.dump()), FLOWS.splitlines(True))
+		self.assertEqual(len(self.server.connections), 2)
+
+	def test_requested_before_read(self):
+		""" Test the request is sent when the dump is started, and a dump
+		never read drops the connection at the next. """
+		lines = self.source.dump()
+		deadline = time.time() + 5
+		while not self.server.requests and time.time() < deadline:
+			time.sleep(0.01)
+		self.assertEqual(len(self.server.requests), 1)
+		del lines
+		self.assertEqual(list(self.source.dump()), FLOWS.splitlines(True))
+		self.assertEqual(len(self.server.connections), 2)
+		self.assertEqual(self.fallback.dumps, 0)
+
+	def test_reconnect(self):
+		""" Test a dropped connection falls back once and is then re-opened. """
+		list(self.source.dump())
+		self.server.drop_connections()
+		self.assertEqual(list(self.source.dump()), ['fallback\n'])
+		self.assertEqual(list(self.source.dump()), FLOWS.splitlines(True))
+		self.assertEqual(self.fallback.dumps, 1)
+
+	def test_error_reply(self):
+		""" Test an error reply is answered from the fallback. """
+		self.server.respond = lambda msg: {'id': msg['id'], 'result': None, 'error': 'no such datapath'}
+		self.assertEqual(list(self.source.dump()), ['fallback\n'])
+
+	def test_no_socket(self):
+		""" Test a missing socket is answered from the fallback. """
+		source = flow_source.UnixctlFlowSource('xenbr0', os.path.join(self.dir, 'none.ctl'),
+											   self.fallback)
+		self.assertEqual(source.dump(), ['fallback\n'])
+
+	def test_no_socket_no_fallback(self):
+		""" Test a missing socket raises when there is nothing to fall back to. """
+		source = flow_source.UnixctlFlowSource('xenbr0', os.path.join(self.dir, 'none.ctl'))
+		self.assertRaises(socket.error, source.dump)
+
+	def test_find_path(self):
+		""" Test the socket is found from the vswitchd pid file. """
+		f = open(os.path.join(self.dir, 'ovs-vswitchd.pid'), 'w')
+		f.write('1\n')
+		f.close()
+		self.assertEqual(flow_source.find_unixctl_path(self.dir), self.path)
+
+	def test_dpctl(self):
+		""" Test DpCtl ingests a dump taken over the socket. """
+		ctl = dpctl.DpCtl('xenbr0', source=self.source)
+		ctl.update_entries(ctl.get_dp_flows())
+		self.assertEqual(ctl.get_src_flows_by_ip('192.168.1.1')[1], {'192.168.1.2': [300, 0]})
+		self.assertEqual(ctl.get_src_flows_by_ip('192.168.1.2')[1], {'192.168.1.1': [60, 0]})
+
+class FakeClock(object):
+	""" Clock that only moves when slept on. """
+
+	def __init__(self, now=100.0):
+		self.now = now
+		self.sleeps = []
+
+	def time(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+
+class TestTrace(unittest.TestCase):
+	""" Test dumps are recorded to a trace and replayed from it. """
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'trace.gz')
+		self.clock = FakeClock()
+		self.source = StaticFlowSource(FLOWS.splitlines(True))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def record(self, times):
+		""" Record one dump at each of the given times. """
+		recorder = flow_source.RecordingFlowSource(self.source, self.path, self.clock.time)
+		for now in times:
+			self.clock.now = now
+			self.assertEqual(list(recorder.dump()), self.source.lines)
+		recorder.close()
+
+	def test_replay(self):
+		""" Test dumps come back in order, with their recorded times. """
+		self.record([10.0, 11.0])
+		replay = flow_source.ReplayFlowSource(self.path)
+		self.assertEqual(replay.now(), 10.0)
+		self.assertEqual(replay.dump(), FLOWS.splitlines(True))
+		self.assertEqual(replay.now(), 10.0)
+		self.assertEqual(replay.dump(), FLOWS.splitlines(True))
+		self.assertEqual(replay.now(), 11.0)
+		self.assertFalse(replay.finished)
+		self.assertEqual(replay.dump(), [])
+		self.assertTrue(replay.finished)
+		self.assertEqual(replay.now(), 11.0)
+		replay.close()
+
+	def test_partial_dump(self):
+		""" Test a dump abandoned part way through is recorded as far as read. """
+		recorder = flow_source.RecordingFlowSource(self.source, self.path, self.clock.time)
+		lines = recorder.dump()
+		lines.next()
+		lines.close()
+		recorder.close()
+		self.assertEqual(flow_source.ReplayFlowSource(self.path).dump(), FLOWS.splitlines(True)[:1])
+
+	def test_unclosed(self):
+		""" Test a trace whose recorder was never closed replays what was flushed. """
+		recorder = flow_source.RecordingFlowSource(self.source, self.path, self.clock.time)
+		list(recorder.dump())
+		replay = flow_source.ReplayFlowSource(self.path)
+		self.assertEqual(replay.dump(), FLOWS.splitlines(True))
+		self.assertEqual(replay.dump(), [])
+		recorder.close()
+
+	def test_paced(self):
+		""" Test dumps are held back to the recorded spacing over the speed. """
+		self.record([10.0, 14.0, 15.0])
+		replay = flow_source.ReplayFlowSource(self.path, speed=2.0, clock=self.clock.time,
+											  sleep=self.clock.sleep)
+		for i in range(3):
+			replay.dump()
+			self.clock.now += 0.5
+		self.assertEqual(self.clock.sleeps, [1.5])
+		replay = flow_source.ReplayFlowSource(self.path, clock=self.clock.time,
+											  sleep=self.clock.sleep)
+		for i in range(3):
+			replay.dump()
+		self.assertEqual(self.clock.sleeps, [1.5])
+
+	def test_loop(self):
+		""" Test a looped trace carries on one interval after its end. """
+		self.record([10.0, 14.0, 15.0])
+		replay = flow_source.ReplayFlowSource(self.path, loop=True)
+		times = []
+		for i in range(7):
+			self.assertEqual(len(replay.dump()), 2)
+			times.append(replay.now())
+		self.assertEqual(times, [10.0, 14.0, 15.0, 16.0, 20.0, 21.0, 22.0])
+
+	def test_not_a_trace(self):
+		""" Test a file that is not a trace is refused. """
+		f = gzip.open(self.path, 'wb')
+		f.write('something else\n')
+		f.close()
+		self.assertRaises(ValueError, flow_source.ReplayFlowSource, self.path)
+
+	def test_record_trace(self):
+		""" Test a fixed number of dumps are recorded at the interval. """
+		flow_source.record_trace(self.source, self.path, 3, 5.0, self.clock.time,
+								 self.clock.sleep)
+		self.assertEqual(self.clock.sleeps, [5.0, 5.0])
+		replay = flow_source.ReplayFlowSource(self.path)
+		self.assertEqual([replay.now() for i in range(3) if replay.dump()], [100.0, 105.0, 110.0])
+
+	def test_dpctl_replay(self):
+		""" Test DpCtl polls a replayed trace at its recorded times. """
+		lines = FLOWS.splitlines(True)
+		recorder = flow_source.RecordingFlowSource(self.source, self.path, self.clock.time)
+		for now, bytes in ((10.0, 300), (20.0, 1300)):
+			self.clock.now = now
+			self.source.lines = [lines[0].replace('bytes:300', 'bytes:%d' % bytes), lines[1]]
+			list(recorder.dump())
+		recorder.close()
+		ctl = dpctl.DpCtl('xenbr0', dpctl.Flows(rate_windows=(10.0,)),
+						  flow_source.ReplayFlowSource(self.path))
+		for i in range(2):
+			ctl.update_entries(ctl.get_dp_flows())
+		self.assertEqual(ctl.flows.now, 20.0)
+		self.assertEqual(ctl.get_flow_rates('192.168.1.1', '192.168.1.2'), (100.0,))
+
+if (__name__ == '__main__'):
+	unittest.main()
@@ -0,0 +1,183 @@
+import add_to_sys_path
+import dpctl
+import dpctl_thread
+import flow_store
+import flowtable
+import os
+import shutil
+import tempfile
+import unittest
+from fake_flow_source import StaticFlowSource
+
+def entry(src, dst, bytes):
+	return dpctl.FlowEntry('00:16:3e:00:00:0%s' % src[-1], '00:16:3e:00:00:0%s' % dst[-1],
+						   src, dst, bytes)
+
+def fill(flows):
+	""" Give a flowset three flows, a reset and a restarted flow. """
+	flows.tick(1000.0)
+	flows.update_flows(entry('10.0.0.1', '10.0.0.2', 100))
+	flows.update_flows(entry('10.0.0.2', '10.0.0.1', 50))
+	flows.update_flows(entry('10.0.0.1', '10.0.0.3', 70))
+	flows.tick(1010.0)
+	flows.update_flows(entry('10.0.0.1', '10.0.0.2', 300))
+	flows.copy_and_reset_src_flows_by_ip('10.0.0.1')
+	flows.tick(1020.0)
+	flows.update_flows(entry('10.0.0.1', '10.0.0.2', 500))
+	flows.update_flows(entry('10.0.0.2', '10.0.0.1', 20))
+	return flows
+
+def contents(flows, times=True):
+	""" Get what the accessors say of every IP address in fill. """
+	ips = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+	entries = [flows.get_src_flows_by_ip(ip) for ip in ips] + \
+		[flows.get_dst_flows_by_ip(ip) for ip in ips]
+	if not times:
+		entries = [entry and entry[:2] for entry in entries]
+	return entries, [flows.get_src_rates_by_ip(ip) for ip in ips]
+
+BACKENDS = (lambda: dpctl.Flows(ttl=300, rate_windows=(10, 60)),
+			lambda: flowtable.ColumnarFlows(ttl=300, rate_windows=(10, 60)))
+
+class TestFlowStore(unittest.TestCase):
+	""" Test flowsets are written to and read back from a file unchanged. """
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'flows')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_round_trip(self):
+		""" Test each backend reloads its own state, into either backend. """
+		for save in BACKENDS:
+			flows = fill(save())
+			flow_store.save_flows(flows, self.path)
+			for load in BACKENDS:
+				loaded = load()
+				self.assertEqual(flow_store.load_flows(loaded, self.path), 3)
+				self.assertEqual(contents(loaded), contents(flows))
+				self.assertEqual(loaded.now, 1020.0)
+
+	def test_continues(self):
+		""" Test a loaded flowset takes further readings as the original would. """
+		for make in BACKENDS:
+			flows = fill(make())
+			flow_store.save_flows(flows, self.path)
+			loaded = make()
+			flow_store.load_flows(loaded, self.path)
+			for f in (flows, loaded):
+				f.tick(1030.0)
+				f.update_flows(entry('10.0.0.1', '10.0.0.3', 170))
+				f.copy_and_reset_dst_flows_by_ip('10.0.0.1')
+			self.assertEqual(contents(loaded, False), contents(flows, False))
+
+	def test_aging_order(self):
+		""" Test edges keep their last update times and aging order. """
+		for make in BACKENDS:
+			flow_store.save_flows(fill(make()), self.path)
+			flows = make()
+			flow_store.load_flows(flows, self.path)
+			flows.tick(1315.0)
+			self.assertEqual(flows.expire(), 1)
+			self.assertEqual(flows.get_src_flows_by_ip('10.0.0.1')[1].keys(), ['10.0.0.2'])
+
+	def test_other_windows(self):
+		""" Test rates restart when the rate windows differ. """
+		flow_store.save_flows(fill(dpctl.Flows(rate_windows=(10, 60))), self.path)
+		flows = dpctl.Flows(rate_windows=(30,))
+		flow_store.load_flows(flows, self.path)
+		self.assertEqual(flows.get_flow_rates('10.0.0.1', '10.0.0.2'), (0.0,))
+		flow_store.save_flows(fill(dpctl.Flows()), self.path)
+		flows = flowtable.ColumnarFlows(rate_windows=(10,))
+		flow_store.load_flows(flows, self.path)
+		self.assertEqual(flows.get_src_flows_by_ip('10.0.0.1')[1]['10.0.0.2'], [500, -300])
+
+	def test_empty(self):
+		""" Test an empty flowset round trips. """
+		flow_store.save_flows(dpctl.Flows(), self.path)
+		flows = fill(dpctl.Flows())
+		self.assertEqual(flow_store.load_flows(flows, self.path), 0)
+		self.assertEqual(len(flows), 0)
+		self.assertEqual(flows.get_src_flows_by_ip('10.0.0.1'), None)
+
+	def test_refused(self):
+		""" Test corrupt, truncated and foreign files are refused. """
+		flow_store.save_flows(fill(dpctl.Flows()), self.path)
+		data = open(self.path, 'rb').read()
+		for bad in (data[:-1], data[:-9] + chr(ord(data[-9]) ^ 1) + data[-8:], data[:10],
+					'X' + data[1:], data[:8] + '\x02' + data[9:]):
+			open(self.path, 'wb').write(bad)
+			self.assertRaises(flow_store.StoreError, flow_store.read_state, self.path)
+		self.assertRaises(IOError, flow_store.read_state, self.path + '.missing')
+
+	def test_thread_restores(self):
+		""" Test a new polling thread resumes from the flowset an old one saved. """
+		line = ('in_port(2),eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+				'eth_type(0x0800),ipv4(src=10.0.0.1,dst=10.0.0.2,proto=6,tos=0,'
+				'ttl=64,frag=no), packets:1, bytes:%d, used:0.1s, actions:3\n')
+		source = StaticFlowSource([line % 100])
+		thread = dpctl_thread.DpReadClass(source=source, store=self.path)
+		self.assertEqual(thread.restored, 0)
+		thread.poll()
+		thread.copy_and_reset_entries_by_src_ip('10.0.0.1')
+		thread.save()
+		source.lines = [line % 250]
+		thread = dpctl_thread.DpReadClass(source=source, store=self.path, rcu=True)
+		self.assertEqual(thread.restored, 1)
+		self.assertEqual(thread.get_entries_by_src_ip('10.0.0.1')[1], {'10.0.0.2': [100, -100]})
+		thread.poll()
+		self.assertEqual(thread.get_entries_by_src_ip('10.0.0.1')[1], {'10.0.0.2': [250, -100]})
+
+	def test_thread_saves_in_batches(self):
+		""" Test a polling thread copies the flowset a batch of flows per
+		acquisition of the lock, and saves what save_flows would. """
+		for make in BACKENDS:
+			flows = fill(make())
+			thread = dpctl_thread.DpReadClass(source=StaticFlowSource([]), flows=flows,
+											  batch_size=1)
+			thread.store = self.path
+			thread.lock = CountingLock()
+			thread.save()
+			# One to list the IP addresses, then one per IP address with src
+			# flows (2) and dst flows (3), and one per view to find no more.
+			self.assertEqual(thread.lock.acquired, 8)
+			for load in BACKENDS:
+				loaded = load()
+				self.assertEqual(flow_store.load_flows(loaded, self.path), 3)
+				self.assertEqual(contents(loaded), contents(flows))
+				loaded.tick(1315.0)
+				self.assertEqual(loaded.expire(), 1)
+				self.assertEqual(loaded.get_src_flows_by_ip('10.0.0.1')[1].keys(), ['10.0.0.2'])
+
+	def test_thread_saves_while_polled(self):
+		""" Test flows updated between the batches of a save are saved once. """
+		for make in BACKENDS:
+			flows = fill(make())
+			thread = dpctl_thread.DpReadClass(source=StaticFlowSource([]), flows=flows,
+											  batch_size=1)
+			thread.store = self.path
+			thread.lock = CountingLock(lambda: flows.update_flows(entry('10.0.0.2', '10.0.0.1', 5)))
+			thread.save()
+			loaded = make()
+			self.assertEqual(flow_store.load_flows(loaded, self.path), 3)
+			self.assertEqual(loaded.get_src_flows_by_ip('10.0.0.2')[1], {'10.0.0.1': [5, 70]})
+			self.assertEqual(loaded.get_dst_flows_by_ip('10.0.0.1')[1], {'10.0.0.2': [5, 70]})
+
+class CountingLock(object):
+	""" Lock counting its acquisitions, calling a function on each release. """
+
+	def __init__(self, released=None):
+		self.acquired = 0
+		self.released = released
+
+	def acquire(self):
+		self.acquired += 1
+
+	def release(self):
+		if self.released is not None:
+			self.released()
+
+if (__name__ == '__main__'):
+	unittest.main()
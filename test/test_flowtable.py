@@ -0,0 +1,381 @@
+import add_to_sys_path
+import dpctl
+import flowtable
+import math
+import unittest
+
+class FlowsApiTests(object):
+	""" Behaviour every flowset backend must share, through the public API. """
+
+	def make_flows(self, **kwargs):
+		raise NotImplementedError
+
+	def setUp(self):
+		self.flows = self.make_flows()
+		self.entry = dpctl.FlowEntry('00:00:00:00:00:01', '00:00:00:00:00:02',
+						  '192.168.1.1', '192.168.1.2', 96)
+
+	def update(self, bytes, src='192.168.1.1', dst='192.168.1.2'):
+		self.entry.srcIp = src
+		self.entry.dstIp = dst
+		self.entry.bytes = bytes
+		self.flows.update_flows(self.entry)
+
+	def test_empty(self):
+		""" Test an empty flowset has no history and no entries. """
+		self.assertFalse(self.flows.has_src_flow_history('192.168.1.1'))
+		self.assertFalse(self.flows.has_dst_flow_history('192.168.1.1'))
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1'), None)
+		self.assertEqual(self.flows.copy_and_reset_dst_flows_by_ip('192.168.1.1'), None)
+		self.assertEqual(self.flows.get_mac_by_ip('192.168.1.1'), None)
+
+	def test_update_adds_both_views(self):
+		""" Test a single update is visible from the src and dst side. """
+		self.update(96)
+		src = self.flows.get_src_flows_by_ip('192.168.1.1')
+		dst = self.flows.get_dst_flows_by_ip('192.168.1.2')
+		self.assertEqual(src[:2], ['00:00:00:00:00:01', {'192.168.1.2': [96, 0]}])
+		self.assertEqual(dst[:2], ['00:00:00:00:00:02', {'192.168.1.1': [96, 0]}])
+		self.assertTrue(self.flows.has_src_flow_dst_entry('192.168.1.1', '192.168.1.2'))
+		self.assertTrue(self.flows.has_dst_flow_src_entry('192.168.1.2', '192.168.1.1'))
+		self.assertFalse(self.flows.has_src_flow_dst_entry('192.168.1.2', '192.168.1.1'))
+
+	def test_increment_and_new_start(self):
+		""" Test a falling counter is treated as a new flow. """
+		self.update(96)
+		self.update(128)
+		self.update(48)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [48, 128]})
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [48, 128]})
+
+	def test_multiple_peers(self):
+		""" Test peers of one IP are grouped together. """
+		self.update(96)
+		self.update(10, dst='192.168.1.3')
+		self.update(20, src='192.168.1.4')
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [96, 0], '192.168.1.3': [10, 0]})
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [96, 0], '192.168.1.4': [20, 0]})
+
+	def test_reset_src_flows(self):
+		""" Test resetting the src view leaves the dst view alone. """
+		self.update(96)
+		self.flows.reset_src_flows('192.168.1.1')
+		self.update(128)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [128, -96]})
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [128, 0]})
+
+	def test_reset_dst_flow(self):
+		""" Test resetting a single dst flow. """
+		self.update(96)
+		self.flows.reset_dst_flow('192.168.1.2', '192.168.1.1')
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [96, -96]})
+
+	def test_copy_is_detached(self):
+		""" Test a copy does not change with later updates. """
+		self.update(96)
+		copy = self.flows.copy_src_flows_by_ip('192.168.1.1')
+		self.update(128)
+		self.assertEqual(copy[1], {'192.168.1.2': [96, 0]})
+
+	def test_copy_and_reset(self):
+		""" Test copy-and-reset returns the tally and restarts it from zero. """
+		self.update(96)
+		copy = self.flows.copy_and_reset_src_flows_by_ip('192.168.1.1')
+		self.update(128)
+		self.assertEqual(copy[1], {'192.168.1.2': [96, 0]})
+		entries = self.flows.copy_and_reset_src_flows_by_ip('192.168.1.1')
+		self.assertEqual(entries[1], {'192.168.1.2': [128, -96]})
+		self.assertTrue(entries[2] >= copy[2])
+
+	def test_del_src_keeps_dst(self):
+		""" Test deleting the src view keeps the dst view of the same flows. """
+		self.update(96)
+		self.flows.del_src_flows_by_ip('192.168.1.1')
+		self.assertFalse(self.flows.has_src_flow_history('192.168.1.1'))
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [96, 0]})
+		self.update(128)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [128, 0]})
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [128, 0]})
+
+	def test_del_both(self):
+		""" Test deleting both views removes the flow entirely. """
+		self.update(96)
+		self.flows.del_src_flows_by_ip('192.168.1.1')
+		self.flows.del_dst_flows_by_ip('192.168.1.2')
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1'), None)
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2'), None)
+		self.update(48)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [48, 0]})
+
+	def test_get_mac(self):
+		""" Test MACs are found from either side. """
+		self.update(96)
+		self.assertEqual(self.flows.get_src_mac_by_ip('192.168.1.1'), '00:00:00:00:00:01')
+		self.assertEqual(self.flows.get_dst_mac_by_ip('192.168.1.1'), None)
+		self.assertEqual(self.flows.get_mac_by_ip('192.168.1.2'), '00:00:00:00:00:02')
+
+	def test_reset_applies_once_updated(self):
+		""" Test a reset of one view takes effect on read and survives later
+		updates, without touching the other view. """
+		self.update(96)
+		self.flows.reset_src_flows('192.168.1.1')
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [96, -96]})
+		self.update(128)
+		self.flows.reset_dst_flows('192.168.1.3')
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [128, -96]})
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [128, 0]})
+		self.flows.reset_src_flows('192.168.1.1')
+		self.flows.reset_src_flows('192.168.1.1')
+		self.update(200)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [200, -128]})
+
+	def test_reset_then_new_start(self):
+		""" Test a falling counter after a reset counts from the reset. """
+		self.update(96)
+		self.flows.reset_src_flows('192.168.1.1')
+		self.update(48)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [48, 0]})
+		self.assertEqual(self.flows.get_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [48, 96]})
+
+	def test_single_reset_after_reset_all(self):
+		""" Test resetting one flow after resetting all of them. """
+		self.update(96)
+		self.update(10, dst='192.168.1.3')
+		self.flows.reset_src_flows('192.168.1.1')
+		self.update(128)
+		self.update(20, dst='192.168.1.3')
+		self.flows.reset_src_flow('192.168.1.1', '192.168.1.2')
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [128, -128], '192.168.1.3': [20, -10]})
+
+	def test_new_peer_after_reset(self):
+		""" Test a peer added after a reset starts from zero. """
+		self.update(96)
+		self.flows.copy_and_reset_src_flows_by_ip('192.168.1.1')
+		self.update(10, dst='192.168.1.3')
+		self.assertEqual(self.flows.copy_and_reset_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [96, -96], '192.168.1.3': [10, 0]})
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [96, -96], '192.168.1.3': [10, -10]})
+
+	def test_expire_disabled(self):
+		""" Test nothing is evicted without a ttl or size limit. """
+		self.update(96)
+		self.flows.tick(self.flows.now + 3600)
+		self.assertEqual(self.flows.expire(), 0)
+		self.assertEqual(len(self.flows), 1)
+
+	def test_expire_idle(self):
+		""" Test flows not updated within the ttl are evicted, along with IP
+		entries left without flows. """
+		self.flows = self.make_flows(ttl=30)
+		self.flows.tick(100)
+		self.update(96)
+		self.update(10, dst='192.168.1.3')
+		self.flows.tick(120)
+		self.update(128)
+		self.flows.tick(140)
+		self.assertEqual(self.flows.expire(), 1)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [128, 0]})
+		self.assertFalse(self.flows.has_dst_flow_history('192.168.1.3'))
+		self.flows.tick(160)
+		self.assertEqual(self.flows.expire(), 1)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1'), None)
+		self.assertEqual(self.flows.get_mac_by_ip('192.168.1.2'), None)
+		self.assertEqual(self.flows.get_eviction_stats(),
+						 {'resident_flows': 0, 'resident_src_ips': 0, 'resident_dst_ips': 0,
+						  'evicted_idle': 2, 'evicted_lru': 0})
+
+	def test_expire_lru(self):
+		""" Test the least recently updated flows are evicted above the limit. """
+		self.flows = self.make_flows(max_entries=2)
+		for i in range(4):
+			self.flows.tick(i)
+			self.update(i, dst='192.168.2.%d' % i)
+		self.flows.tick(4)
+		self.update(5, dst='192.168.2.0')
+		self.assertEqual(self.flows.expire(), 2)
+		self.assertEqual(sorted(self.flows.get_src_flows_by_ip('192.168.1.1')[1]),
+						 ['192.168.2.0', '192.168.2.3'])
+		self.assertEqual(self.flows.get_eviction_stats()['evicted_lru'], 2)
+
+	def test_expire_budget(self):
+		""" Test expire evicts no more than its budget per call. """
+		self.flows = self.make_flows(ttl=1)
+		self.flows.tick(0)
+		for i in range(5):
+			self.update(i, dst='192.168.2.%d' % i)
+		self.flows.tick(10)
+		self.assertEqual([self.flows.expire(2) for i in range(4)], [2, 2, 1, 0])
+		self.assertEqual(len(self.flows), 0)
+
+	def test_expire_after_delete(self):
+		""" Test flows deleted from both views are not evicted again, and one
+		held by a single view is evicted from it. """
+		self.flows = self.make_flows(ttl=1)
+		self.flows.tick(0)
+		self.update(96)
+		self.flows.del_src_flows_by_ip('192.168.1.1')
+		self.flows.del_dst_flows_by_ip('192.168.1.2')
+		self.update(20, src='192.168.1.4', dst='192.168.1.5')
+		self.flows.del_src_flows_by_ip('192.168.1.4')
+		self.assertEqual(len(self.flows), 1)
+		self.flows.tick(10)
+		self.assertEqual(self.flows.expire(), 1)
+		self.assertFalse(self.flows.has_dst_flow_history('192.168.1.5'))
+		self.assertEqual(len(self.flows), 0)
+
+	def test_rates_disabled(self):
+		""" Test no rates are given unless rate windows are set. """
+		self.update(96)
+		self.assertEqual(self.flows.get_flow_rates('192.168.1.1', '192.168.1.2'), None)
+		self.assertEqual(self.flows.get_src_rates_by_ip('192.168.1.1'), None)
+
+	def test_rates_steady(self):
+		""" Test a steady flow reads its rate at every window, however the polls
+		are spaced, and an idle one decays. """
+		self.flows = self.make_flows(rate_windows=(10, 100))
+		self.flows.tick(0)
+		self.update(1000)
+		self.assertEqual(self.flows.get_flow_rates('192.168.1.1', '192.168.1.2'), (0, 0))
+		now = 0
+		for interval in (1, 5, 1, 20, 2):
+			now += interval
+			self.flows.tick(now)
+			self.update(1000 + 500 * now)
+		for rate in self.flows.get_flow_rates('192.168.1.1', '192.168.1.2'):
+			self.assertAlmostEqual(rate, 500)
+		self.flows.tick(now + 10)
+		rates = self.flows.get_dst_rates_by_ip('192.168.1.2')['192.168.1.1']
+		self.assertAlmostEqual(rates[0], 500 * math.exp(-1))
+		self.assertAlmostEqual(rates[1], 500 * math.exp(-0.1))
+
+	def test_rates_restart(self):
+		""" Test a restarted flow counts its new bytes, readings within one tick
+		add to the same interval, and an idle flow keeps a zero rate. """
+		self.flows = self.make_flows(rate_windows=(10,))
+		self.flows.tick(0)
+		self.update(1000)
+		self.update(20, dst='192.168.1.3')
+		self.flows.tick(10)
+		self.update(400)
+		self.update(600)
+		self.update(20, dst='192.168.1.3')
+		rates = self.flows.get_src_rates_by_ip('192.168.1.1')
+		self.assertAlmostEqual(rates['192.168.1.2'][0], 60)
+		self.assertEqual(rates['192.168.1.3'], (0,))
+		self.flows.tick(20)
+		self.update(1600)
+		rates = self.flows.get_src_rates_by_ip('192.168.1.1')
+		self.assertAlmostEqual(rates['192.168.1.2'][0], 60 * math.exp(-1) + 100 * (1 - math.exp(-1)))
+		self.assertAlmostEqual(rates['192.168.1.3'][0], 0)
+
+	def test_export_matrix(self):
+		""" Test the src view exports as a CSR matrix of bytes since reset. """
+		self.update(96)
+		self.update(10, dst='192.168.1.3')
+		self.update(20, src='192.168.1.3', dst='192.168.1.1')
+		self.flows.reset_src_flow('192.168.1.1', '192.168.1.3')
+		matrix = self.flows.export_matrix()
+		self.assertEqual(len(matrix), 3)
+		self.assertEqual(sorted(matrix.ips), ['192.168.1.1', '192.168.1.2', '192.168.1.3'])
+		self.assertEqual(list(matrix.indptr)[-1], 3)
+		self.assertEqual(matrix.row('192.168.1.1'), {'192.168.1.2': 96, '192.168.1.3': 0})
+		self.assertEqual(matrix.row('192.168.1.3'), {'192.168.1.1': 20})
+		self.assertEqual(matrix.row('192.168.1.2'), {})
+		self.flows.reset_src_flows('192.168.1.3')
+		self.assertEqual(self.flows.export_matrix().row('192.168.1.3'), {'192.168.1.1': 0})
+		self.assertEqual(self.flows.export_matrix(0), None)
+
+	def test_export_matrix_rates(self):
+		""" Test a rate window exports as rates. """
+		self.flows = self.make_flows(rate_windows=(10, 60))
+		self.flows.tick(0)
+		self.update(100)
+		self.flows.tick(10)
+		self.update(600)
+		self.assertEqual(self.flows.export_matrix(1).row('192.168.1.1'), {'192.168.1.2': 50.0})
+
+
+class TestDictFlows(FlowsApiTests, unittest.TestCase):
+	""" Run the backend API tests against dpctl.Flows. """
+
+	def make_flows(self, **kwargs):
+		return dpctl.Flows(**kwargs)
+
+class TestColumnarFlows(FlowsApiTests, unittest.TestCase):
+	""" Run the backend API tests against flowtable.ColumnarFlows. """
+
+	def make_flows(self, **kwargs):
+		return flowtable.ColumnarFlows(**kwargs)
+
+	def test_rows_reused(self):
+		""" Test rows freed by deletion are reused rather than grown. """
+		self.update(96)
+		self.flows.del_src_flows_by_ip('192.168.1.1')
+		self.flows.del_dst_flows_by_ip('192.168.1.2')
+		self.assertEqual(len(self.flows), 0)
+		self.update(96, src='192.168.1.3')
+		self.assertEqual(len(self.flows._live), 1)
+
+	def test_ips_reused(self):
+		""" Test IP indexes freed by eviction are reused rather than grown. """
+		self.flows = self.make_flows(ttl=1)
+		self.flows.tick(0)
+		self.update(96)
+		self.flows.tick(10)
+		self.flows.expire()
+		self.update(96, src='192.168.1.3', dst='192.168.1.4')
+		self.assertEqual(len(self.flows._ips), 2)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.3')[1],
+						 {'192.168.1.4': [96, 0]})
+
+	def test_evict_keeps_positions(self):
+		""" Test evicting rows from the middle of an IP address's rows leaves
+		the others in place, and removable in turn. """
+		self.flows = self.make_flows(max_entries=2)
+		for i in range(5):
+			self.flows.tick(i)
+			self.update(10 + i, dst='192.168.2.%d' % i)
+		self.flows.tick(5)
+		self.update(20, dst='192.168.2.0')
+		self.update(21, dst='192.168.2.3')
+		self.assertEqual(self.flows.expire(), 3)
+		self.assertEqual(self.flows.get_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.2.0': [20, 0], '192.168.2.3': [21, 0]})
+		self.flows.max_entries = 0
+		self.assertEqual(self.flows.expire(), 2)
+		self.assertFalse(self.flows.has_src_flow_history('192.168.1.1'))
+
+	def test_dpctl_backend(self):
+		""" Test DpCtl updates a columnar flowset handed to it. """
+		ctl = dpctl.DpCtl('xenbr0', flowtable.ColumnarFlows())
+		ctl.update_entries(['in_port(2),eth(src=00:16:3e:00:00:01,dst=00:16:3e:00:00:02),'
+							'eth_type(0x0800),ipv4(src=192.168.1.1,dst=192.168.1.2,proto=6,'
+							'tos=0,ttl=64,frag=no),tcp(src=5001,dst=80), packets:2, '
+							'bytes:300, used:0.1s, actions:3\n'])
+		self.assertEqual(ctl.copy_and_reset_src_flows_by_ip('192.168.1.1')[1],
+						 {'192.168.1.2': [300, 0]})
+		self.assertEqual(ctl.copy_dst_flows_by_ip('192.168.1.2')[1],
+						 {'192.168.1.1': [300, 0]})
+
+if (__name__ == '__main__'):
+	unittest.main()
@@ -0,0 +1,95 @@
+import add_to_sys_path
+import heavy_hitters
+import random
+import unittest
+
+class TestSpaceSaving(unittest.TestCase):
+	""" Test the space-saving summary keeps the heaviest keys. """
+
+	def test_heavy_kept(self):
+		""" Test keys heavier than total/capacity are held, among many light
+		ones, with counts never below their true counts. """
+		summary = heavy_hitters.SpaceSaving(8)
+		rand = random.Random(1)
+		stream = ['heavy%d' % (i % 3) for i in range(300)] + ['light%d' % i for i in range(500)]
+		rand.shuffle(stream)
+		for key in stream:
+			summary.add(key, 1)
+		self.assertEqual(len(summary), 8)
+		top = summary.top(3)
+		self.assertEqual(sorted(key for key, count in top), ['heavy0', 'heavy1', 'heavy2'])
+		for key, count in top:
+			self.assertTrue(count >= 100)
+			self.assertTrue(count - summary.get(key)[1] <= 100)
+
+	def test_eviction(self):
+		""" Test the smallest counter is the one taken over. """
+		summary = heavy_hitters.SpaceSaving(2)
+		summary.add('a', 5)
+		summary.add('b', 1)
+		summary.add('b', 10)
+		self.assertEqual(summary.add('c', 1), 'a')
+		self.assertEqual(summary.get('c'), [6, 5])
+
+class TestCountMinSketch(unittest.TestCase):
+	""" Test the count-min sketch. """
+
+	def test_overestimates(self):
+		""" Test estimates are never below the true counts, and exact when the
+		sketch is sparse. """
+		sketch = heavy_hitters.CountMinSketch(64, 4)
+		counts = dict()
+		for i in range(200):
+			key = ('10.0.0.%d' % (i % 50), '10.0.1.1')
+			sketch.add(key, i)
+			counts[key] = counts.get(key, 0) + i
+		for key, count in counts.iteritems():
+			self.assertTrue(sketch.estimate(key) >= count)
+		sketch = heavy_hitters.CountMinSketch(1024, 4)
+		sketch.add('a', 3)
+		self.assertEqual(sketch.estimate('a'), 3)
+		self.assertEqual(sketch.estimate('b'), 0)
+
+class TestHeavyHitters(unittest.TestCase):
+	""" Test the per-IP heavy-hitter tracker. """
+
+	def setUp(self):
+		self.tracker = heavy_hitters.HeavyHitters(peers=2, ips=4, width=256, window=10)
+		self.tracker.tick(0)
+
+	def test_top_peers(self):
+		""" Test peers are ranked by rate in either direction, and decay. """
+		self.tracker.add('10.0.0.1', '10.0.0.2', 100)
+		self.tracker.add('10.0.0.3', '10.0.0.1', 300)
+		self.tracker.add('10.0.0.1', '10.0.0.4', 50)
+		self.assertEqual(self.tracker.top_peers('10.0.0.2', 5), [('10.0.0.1', 10.0)])
+		self.assertEqual(self.tracker.top_peers('10.0.0.9', 5), [])
+		self.assertEqual(self.tracker.estimate_rate('10.0.0.3', '10.0.0.1'), 30.0)
+		# The third peer took over the second's counter, so is overestimated;
+		# the sketch still has it exactly.
+		self.assertEqual(self.tracker.top_peers('10.0.0.1', 2),
+						 [('10.0.0.3', 30.0), ('10.0.0.4', 15.0)])
+		self.assertEqual(self.tracker.estimate_rate('10.0.0.1', '10.0.0.4'), 5.0)
+		self.tracker.tick(10)
+		self.assertAlmostEqual(self.tracker.top_peers('10.0.0.1', 1)[0][1], 30 * 0.36787944117)
+
+	def test_bounded(self):
+		""" Test the number of IP addresses and peers held stays fixed. """
+		for i in range(1000):
+			self.tracker.add('10.0.%d.1' % (i % 7), '10.1.%d.%d' % (i >> 8, i & 0xff), i)
+		self.assertEqual(len(self.tracker.ips), 4)
+		self.assertEqual(len(self.tracker.peer_counts), 4)
+		for summary in self.tracker.peer_counts.itervalues():
+			self.assertTrue(len(summary) <= 2)
+
+	def test_rescale(self):
+		""" Test rates survive counts being scaled down. """
+		self.tracker.add('10.0.0.1', '10.0.0.2', 100)
+		self.tracker.tick(10000)
+		self.tracker.add('10.0.0.1', '10.0.0.3', 100)
+		self.assertEqual(self.tracker.landmark, 10000)
+		self.assertEqual(self.tracker.top_peers('10.0.0.1', 2),
+						 [('10.0.0.3', 10.0), ('10.0.0.2', 0.0)])
+
+if (__name__ == '__main__'):
+	unittest.main()
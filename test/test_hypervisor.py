@@ -0,0 +1,166 @@
+import add_to_sys_path
+import hypervisor
+import threading
+import unittest
+
+XM_LIST = ['Name                                        ID   Mem VCPUs      State   Time(s)',
+		   'Domain-0                                     0  4096     4     r-----   1234.5',
+		   'vm1                                          3   512     1     -b----     12.0',
+		   'vm2                                          5  1024     2     -b----     30.1']
+
+NETWORK_LIST = ['Idx BE     MAC Addr.     handle state evt-ch tx-/rx-ring-ref BE-path',
+				'0   0  00:16:3e:00:00:05    0     4      13    768  /769     /local/domain/0/backend/vif/5/0',
+				'1   0  00:16:3e:00:01:05    1     4      14    770  /771     /local/domain/0/backend/vif/5/1']
+
+DOMAIN_XML = """<domain type='xen' id='5'>
+  <name>vm2</name>
+  <devices>
+    <interface type='bridge'>
+      <mac address='00:16:3e:00:00:05'/>
+      <source bridge='xenbr0'/>
+    </interface>
+    <interface type='bridge'>
+      <mac address='00:16:3e:00:01:05'/>
+      <source bridge='xenbr1'/>
+    </interface>
+  </devices>
+</domain>"""
+
+class TestCommandBackends(unittest.TestCase):
+	""" Test toolstack output is parsed and commands are built. """
+
+	def test_parse(self):
+		""" Test 'list' and 'network-list' output parse into structured data. """
+		self.assertEqual(hypervisor.parse_list(XM_LIST),
+						 [hypervisor.Domain(0, 'Domain-0', 4096), hypervisor.Domain(3, 'vm1', 512),
+						  hypervisor.Domain(5, 'vm2', 1024)])
+		self.assertEqual(hypervisor.parse_network_list(NETWORK_LIST),
+						 ['00:16:3e:00:00:05', '00:16:3e:00:01:05'])
+		self.assertEqual(hypervisor.parse_list(XM_LIST[:1] + ['']), [])
+
+	def test_migrate_args(self):
+		""" Test xm migrates live to a port, and xl over ssh. """
+		self.assertEqual(hypervisor.XmBackend().migrate_args(5, '10.0.0.2', 8002),
+						 ['migrate', '5', '10.0.0.2', '-l', '-p', '8002'])
+		self.assertEqual(hypervisor.XmBackend().migrate_args(5, '10.0.0.2', None),
+						 ['migrate', '5', '10.0.0.2', '-l'])
+		self.assertEqual(hypervisor.XlBackend().migrate_args(5, '10.0.0.2', 8002),
+						 ['migrate', '5', '10.0.0.2'])
+
+	def test_run(self):
+		""" Test output is returned as lines, and failures raise. """
+		backend = hypervisor.CommandBackend()
+		backend.command = 'echo'
+		self.assertEqual(backend.run(['list']), ['list'])
+		backend.command = 'false'
+		self.assertRaises(hypervisor.HypervisorError, backend.run, ['list'])
+		backend.command = '/nonexistent/xm'
+		self.assertRaises(hypervisor.HypervisorError, backend.run, ['list'])
+
+class TestLibvirtBackend(unittest.TestCase):
+	""" Test libvirt domains are described as the toolstacks describe them. """
+
+	def setUp(self):
+		self.conn = FakeConnection()
+		self.backend = hypervisor.LibvirtBackend(conn=self.conn)
+
+	def test_queries(self):
+		""" Test domains, their memory and their MAC addresses are read. """
+		self.assertEqual(self.backend.list_domains(),
+						 [hypervisor.Domain(0, 'Domain-0', 4096), hypervisor.Domain(5, 'vm2', 1024)])
+		self.assertEqual(self.backend.get_macs(5), ['00:16:3e:00:00:05', '00:16:3e:00:01:05'])
+
+	def test_migrate(self):
+		""" Test domains are migrated live to the other host's URI. """
+		self.backend.migrate(5, '10.0.0.2')
+		self.assertEqual(self.conn.migrations, [(5, 'xen+ssh://10.0.0.2/system', 1)])
+
+class FakeConnection(object):
+	""" Stand-in for a libvirt connection to a host with one guest. """
+
+	def __init__(self):
+		self.domains = [FakeDomain(self, 0, 'Domain-0', 4096 * 1024, '<domain/>'),
+						FakeDomain(self, 5, 'vm2', 1024 * 1024, DOMAIN_XML)]
+		self.migrations = []
+
+	def listAllDomains(self, flags):
+		return self.domains
+
+	def lookupByID(self, domid):
+		return [dom for dom in self.domains if dom.ID() == domid][0]
+
+class FakeDomain(object):
+	""" Stand-in for a libvirt domain. """
+
+	def __init__(self, conn, domid, name, memory, xml):
+		self.conn = conn
+		self.domid = domid
+		self.domname = name
+		self.memory = memory
+		self.xml = xml
+
+	def ID(self):
+		return self.domid
+
+	def name(self):
+		return self.domname
+
+	def info(self):
+		return [1, self.memory, self.memory, 1, 0]
+
+	def XMLDesc(self, flags):
+		return self.xml
+
+	def migrateToURI(self, uri, flags, name, bandwidth):
+		self.conn.migrations.append((self.domid, uri, flags))
+
+class TestFakeBackend(unittest.TestCase):
+	""" Test the in-memory backend, and its use from several threads. """
+
+	def setUp(self):
+		self.backend = hypervisor.get_backend('fake')
+		self.backend.add_domain(3, 'vm1', 512, ['00:16:3e:00:00:03'])
+
+	def test_domains(self):
+		""" Test domains come and go, and migrating one removes it. """
+		self.assertEqual(self.backend.list_domains(),
+						 [hypervisor.Domain(0, 'Domain-0', 4096), hypervisor.Domain(3, 'vm1', 512)])
+		self.assertEqual(self.backend.get_macs(3), ['00:16:3e:00:00:03'])
+		self.backend.migrate(3, '10.0.0.2', 8002)
+		self.assertEqual(self.backend.migrations, [(3, '10.0.0.2', 8002)])
+		self.assertRaises(hypervisor.HypervisorError, self.backend.get_macs, 3)
+		self.assertRaises(hypervisor.HypervisorError, self.backend.migrate, 3, '10.0.0.2')
+
+	def test_threads(self):
+		""" Test queries from several threads see whole domains. """
+		errors = []
+		def query():
+			for i in range(200):
+				for domain in self.backend.list_domains():
+					try:
+						if domain.domid:
+							self.backend.get_macs(domain.domid)
+					except hypervisor.HypervisorError:
+						# Removed between the two queries; allowed.
+						pass
+					except Exception, e:
+						errors.append(e)
+		def churn():
+			for i in range(200):
+				self.backend.add_domain(10 + i % 5, 'vm', 256, ['00:16:3e:00:00:%02x' % i])
+				self.backend.remove_domain(10 + i % 5)
+		threads = [threading.Thread(target=f) for f in (query, query, churn)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors, [])
+
+	def test_get_backend(self):
+		""" Test backends are created by name. """
+		self.assertTrue(isinstance(hypervisor.get_backend(), hypervisor.XmBackend))
+		self.assertTrue(isinstance(hypervisor.get_backend('xl'), hypervisor.XlBackend))
+		self.assertRaises(ValueError, hypervisor.get_backend, 'hyper-v')
+
+if (__name__ == '__main__'):
+	unittest.main()
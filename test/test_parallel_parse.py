@@ -0,0 +1,97 @@
+import add_to_sys_path
+import dpctl
+import dpctl_thread
+import parallel_parse
+import synthetic_dumps
+import unittest
+from fake_flow_source import StaticFlowSource
+
+def fields(entry):
+	""" Get the fields of an entry, or None. """
+	if entry is None:
+		return None
+	return tuple(getattr(entry, name, None) for name in dpctl.FlowEntry.__slots__)
+
+def poll(ctl, lines):
+	""" Poll a dump, returning the entries applied and the poll's counts. """
+	ctl.begin_poll()
+	entries = [fields(entry) for entry in ctl.changed_entries(lines)]
+	stats = ctl.end_poll()
+	return entries, (stats.new, stats.changed, stats.unchanged, stats.vanished, stats.bytes)
+
+class TestParallelParser(unittest.TestCase):
+	""" Test dumps parsed in a process pool are parsed as they are serially. """
+
+	def setUp(self):
+		self.parser = parallel_parse.ParallelParser(2, chunk_size=7, min_lines=0)
+
+	def tearDown(self):
+		self.parser.close()
+
+	def test_records(self):
+		""" Test records round trip into the entries parse_dp_flow builds. """
+		lines = synthetic_dumps.SyntheticDatacentre(10, 2).dump() + ['not a flow\n']
+		records = parallel_parse.parse_chunk(lines)
+		self.assertEqual(records[-1], None)
+		self.assertEqual(map(fields, self.parser.parse(lines)),
+						 [fields(dpctl.parse_dp_flow(line)) for line in lines])
+
+	def test_polls(self):
+		""" Test successive polls give the same entries, deltas and counts. """
+		datacentre = synthetic_dumps.SyntheticDatacentre(25, 4)
+		serial = dpctl.DpCtl('xenbr0', source=object())
+		pooled = dpctl.DpCtl('xenbr0', source=object(), parser=self.parser)
+		for i in range(4):
+			lines = datacentre.dump()
+			self.assertEqual(poll(pooled, lines), poll(serial, lines))
+		self.assertEqual(pooled.flows.export_matrix().data, serial.flows.export_matrix().data)
+
+	def test_thread_polls(self):
+		""" Test pollers given the parser apply the flows serial ones do. """
+		make = lambda: synthetic_dumps.SyntheticDatacentre(25, 4, seed=5)
+		bridges = lambda parser: dpctl_thread.MultiBridgeReadClass(
+			['xenbr0', 'xenbr1'], sources={'xenbr0': make(), 'xenbr1': make()}, parser=parser)
+		threads = [(dpctl_thread.DpReadClass(source=make()),
+					dpctl_thread.DpReadClass(source=make(), parser=self.parser)),
+				   (bridges(None), bridges(self.parser))]
+		self.assertTrue(threads[1][1].ctls['xenbr1'].parser is self.parser)
+		for serial, pooled in threads:
+			for i in range(3):
+				self.assertEqual(repr(pooled.poll()), repr(serial.poll()))
+			self.assertEqual(pooled.dpctl.flows.export_matrix().data,
+							 serial.dpctl.flows.export_matrix().data)
+
+	def test_small_dumps(self):
+		""" Test dumps below the threshold are parsed in the calling process. """
+		parser = parallel_parse.ParallelParser(1, min_lines=100)
+		parser.close()
+		lines = synthetic_dumps.SyntheticDatacentre(5, 2).dump()
+		self.assertTrue(len(lines) < 100)
+		self.assertEqual(map(fields, parser.parse(iter(lines))),
+						 [fields(dpctl.parse_dp_flow(line)) for line in lines])
+
+	def test_reads_ahead_boundedly(self):
+		""" Test lines are read a chunk at a time, not the whole dump first. """
+		lines = synthetic_dumps.SyntheticDatacentre(25, 4).dump()
+		read = []
+		def reader():
+			for line in lines:
+				read.append(line)
+				yield line
+		entries = self.parser.parse(reader())
+		first = entries.next()
+		# The chunk taken, and up to two per worker sent ahead of it.
+		self.assertTrue(len(read) <= 7 * 4)
+		self.assertEqual(map(fields, [first] + list(entries)),
+						 [fields(dpctl.parse_dp_flow(line)) for line in lines])
+
+	def test_close(self):
+		""" Test closing a DpCtl stops its parser's workers. """
+		source = StaticFlowSource([])
+		ctl = dpctl.DpCtl('xenbr0', source=source, parser=self.parser)
+		ctl.close()
+		self.assertTrue(source.closed)
+		self.assertFalse([worker for worker in self.parser.pool._pool if worker.is_alive()])
+
+if (__name__ == '__main__'):
+	unittest.main()
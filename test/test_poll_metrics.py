@@ -0,0 +1,100 @@
+import add_to_sys_path
+import dpctl_thread
+import flow_history
+import poll_metrics
+import synthetic_dumps
+import unittest
+
+class TestHistogram(unittest.TestCase):
+	""" Test durations are counted into doubling buckets. """
+
+	def test_percentiles(self):
+		""" Test percentiles are bucket bounds, capped by the longest duration. """
+		histogram = poll_metrics.Histogram()
+		self.assertEqual(histogram.percentile(0.5), 0.0)
+		for seconds in [0.0001] * 98 + [0.01, 0.5]:
+			histogram.add(seconds)
+		stats = histogram.as_dict()
+		self.assertEqual(stats['count'], 100)
+		self.assertTrue(0.0001 <= stats['p50'] < 0.0002)
+		self.assertTrue(0.01 <= stats['p99'] < 0.02)
+		self.assertEqual(stats['max'], 0.5)
+		self.assertEqual(histogram.percentile(1.0), 0.5)
+		self.assertAlmostEqual(stats['mean'], (0.0098 + 0.51) / 100)
+
+	def test_extremes(self):
+		""" Test zero and very long durations land in the end buckets. """
+		histogram = poll_metrics.Histogram()
+		histogram.add(0.0)
+		histogram.add(1e6)
+		self.assertEqual((histogram.counts[0], histogram.counts[-1]), (1, 1))
+
+class TestPollMetrics(unittest.TestCase):
+	""" Test an instrumented poller records its timings and counts. """
+
+	def setUp(self):
+		self.datacentre = synthetic_dumps.SyntheticDatacentre(40, 4, noise=0.2)
+		self.metrics = poll_metrics.PollMetrics()
+
+	def test_counts(self):
+		""" Test lines read, parsed, unchanged and skipped add up over polls. """
+		thread = dpctl_thread.DpReadClass(source=self.datacentre, batch_size=50,
+										  metrics=self.metrics)
+		first = thread.poll()
+		second = thread.poll()
+		stats = thread.get_poll_metrics()
+		self.assertEqual(stats['polls'], 2)
+		self.assertEqual(stats['lines'], 2 * len(self.datacentre.flows))
+		self.assertEqual(stats['parsed'], first.new + second.new + second.changed)
+		self.assertEqual(stats['unchanged'], second.unchanged)
+		self.assertTrue(stats['skipped'] > 0)
+		self.assertEqual(stats['lines'], stats['parsed'] + stats['unchanged'] + stats['skipped'])
+		self.assertEqual(stats['resident'], thread.get_eviction_stats())
+
+	def test_history_evictions(self):
+		""" Test pairs evicted from a full history are reported. """
+		history = flow_history.FlowHistory(max_pairs=10)
+		thread = dpctl_thread.DpReadClass(source=self.datacentre, batch_size=50,
+										  history=history, metrics=self.metrics)
+		thread.poll()
+		thread.poll()
+		resident = thread.get_poll_metrics()['resident']
+		self.assertEqual(resident['history_pairs'], 10)
+		self.assertTrue(resident['evicted_history'] > 0)
+		self.assertEqual(resident['evicted_history'], history.evicted)
+
+	def test_timings(self):
+		""" Test each histogram counts what it times. """
+		thread = dpctl_thread.DpReadClass(source=self.datacentre, batch_size=50, rcu=True,
+										  metrics=self.metrics)
+		thread.poll()
+		stats = thread.get_poll_metrics()
+		for name in ('dump', 'parse', 'poll'):
+			self.assertEqual(stats[name]['count'], 1)
+		self.assertEqual(stats['lock_wait']['count'], stats['lock_hold']['count'])
+		# A batch per 50 flows, an eviction and the publishing of the snapshot.
+		self.assertTrue(stats['lock_hold']['count'] >= 320 // 50 + 3)
+		self.assertTrue(stats['poll']['total'] >= stats['dump']['total'] + stats['parse']['total'])
+		self.metrics.reset()
+		self.assertEqual(thread.get_poll_metrics()['poll']['count'], 0)
+
+	def test_multiple_bridges(self):
+		""" Test a MultiBridgeReadClass times each bridge's dump in one poll. """
+		other = synthetic_dumps.SyntheticDatacentre(10, 2, seed=2)
+		thread = dpctl_thread.MultiBridgeReadClass(['xenbr0', 'xenbr1'],
+												   sources={'xenbr0': self.datacentre,
+															'xenbr1': other},
+												   metrics=self.metrics)
+		thread.poll()
+		stats = thread.get_poll_metrics()
+		self.assertEqual((stats['polls'], stats['dump']['count']), (1, 2))
+		self.assertEqual(stats['lines'], len(self.datacentre.flows) + len(other.flows))
+
+	def test_disabled(self):
+		""" Test a poller without metrics has none to report. """
+		thread = dpctl_thread.DpReadClass(source=self.datacentre)
+		thread.poll()
+		self.assertEqual(thread.get_poll_metrics(), None)
+
+if (__name__ == '__main__'):
+	unittest.main()
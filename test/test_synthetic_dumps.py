@@ -0,0 +1,56 @@
+import add_to_sys_path
+import dpctl
+import synthetic_dumps
+import unittest
+
+class TestSyntheticDatacentre(unittest.TestCase):
+	""" Test the synthetic dumps look like those of a real data centre. """
+
+	def setUp(self):
+		self.datacentre = synthetic_dumps.SyntheticDatacentre(50, 4, noise=0.2)
+
+	def test_reproducible(self):
+		""" Test the same arguments and seed give the same dumps. """
+		other = synthetic_dumps.SyntheticDatacentre(50, 4, noise=0.2)
+		for i in range(3):
+			self.assertEqual(self.datacentre.dump(), other.dump())
+		other = synthetic_dumps.SyntheticDatacentre(50, 4, noise=0.2, seed=2)
+		self.assertNotEqual(self.datacentre.dump(), other.dump())
+
+	def test_lines(self):
+		""" Test every VM pair flow parses, and the noise is mixed in. """
+		lines = self.datacentre.dump()
+		self.assertEqual(len(lines), 50 * 4 * 2 + 80)
+		entries = filter(None, map(dpctl.parse_dp_flow, lines))
+		igmp = [entry for entry in entries if entry.dstIp == '224.0.0.22']
+		self.assertEqual(len(entries) - len(igmp), 400)
+		self.assertTrue(igmp)
+		self.assertTrue([line for line in lines if 'eth_type(0x0806)' in line])
+		self.assertTrue([line for line in lines if 'eth_type(0x86dd)' in line])
+		self.assertTrue(all(entry.bytes > 0 for entry in entries))
+
+	def test_polls(self):
+		""" Test successive polls see some flows move, and some churn. """
+		ctl = dpctl.DpCtl('xenbr0', source=self.datacentre)
+		ctl.update_entries(ctl.get_dp_flows())
+		ctl.update_entries(ctl.get_dp_flows())
+		stats = ctl.poll_stats
+		self.assertTrue(stats.changed > 0 and stats.unchanged > stats.changed)
+		self.assertTrue(0 < stats.new == stats.vanished < 20)
+
+	def test_heavy_tailed(self):
+		""" Test a tenth of the flows carry most of the traffic. """
+		datacentre = synthetic_dumps.SyntheticDatacentre(500, 8, noise=0)
+		datacentre.dump()
+		bytes = sorted([flow[2] for flow in datacentre.flows], reverse=True)
+		self.assertTrue(sum(bytes[:len(bytes) // 10]) > sum(bytes) / 2)
+
+	def test_ufids(self):
+		""" Test lines carry distinct flow IDs when asked to. """
+		datacentre = synthetic_dumps.SyntheticDatacentre(20, 3, ufids=True)
+		lines = datacentre.dump()
+		self.assertTrue(all(line.startswith(dpctl.UFID_PREFIX) for line in lines))
+		self.assertEqual(len(set(line.split(',')[0] for line in lines)), len(lines))
+
+if (__name__ == '__main__'):
+	unittest.main()
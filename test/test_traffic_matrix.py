@@ -0,0 +1,47 @@
+import add_to_sys_path
+import traffic_matrix
+import unittest
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+class TestBuildMatrix(unittest.TestCase):
+	""" Test building a CSR traffic matrix from rows of flows. """
+
+	def setUp(self):
+		self.matrix = traffic_matrix.build_matrix([
+			('10.0.0.1', iter([('10.0.0.2', 5.0), ('10.0.0.9', 1.0)])),
+			('10.0.0.2', iter([('10.0.0.1', 3.0)])),
+			('10.0.0.3', iter([]))])
+
+	def test_layout(self):
+		""" Test rows come first in the index table, followed by peers. """
+		self.assertEqual(self.matrix.ips, ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.9'])
+		self.assertEqual(list(self.matrix.indptr), [0, 2, 3, 3, 3])
+		self.assertEqual(list(self.matrix.indices), [1, 3, 0])
+		self.assertEqual(list(self.matrix.data), [5.0, 1.0, 3.0])
+
+	def test_row(self):
+		""" Test a row reads back as a dictionary. """
+		self.assertEqual(self.matrix.row('10.0.0.1'), {'10.0.0.2': 5.0, '10.0.0.9': 1.0})
+		self.assertEqual(self.matrix.row('10.0.0.9'), {})
+		self.assertEqual(self.matrix.row('10.0.0.8'), {})
+
+	def test_empty(self):
+		""" Test an empty matrix has a single row offset. """
+		matrix = traffic_matrix.build_matrix([])
+		self.assertEqual((matrix.ips, list(matrix.indptr), len(matrix)), ([], [0], 0))
+
+	@unittest.skipIf(numpy is None, 'NumPy is not installed')
+	def test_to_numpy(self):
+		""" Test the arrays are wrapped by NumPy without copying. """
+		indptr, indices, data = self.matrix.to_numpy()
+		self.assertEqual(list(indptr), [0, 2, 3, 3, 3])
+		self.assertEqual(data.sum(), 9.0)
+		self.matrix.data[0] = 6.0
+		self.assertEqual(data[0], 6.0)
+
+if (__name__ == '__main__'):
+	unittest.main()
@@ -0,0 +1,182 @@
+import add_to_sys_path
+import fake_xenstore
+import hypervisor
+import time
+import unittest
+import xen_utils as xen
+
+class CountingBackend(hypervisor.FakeBackend):
+	""" Fake backend logging the queries made of it. """
+
+	def __init__(self):
+		super(CountingBackend, self).__init__(4096)
+		self.calls = []
+
+	def list_domains(self):
+		self.calls.append('list')
+		return super(CountingBackend, self).list_domains()
+
+	def get_macs(self, domid):
+		self.calls.append('network-list %d' % domid)
+		return super(CountingBackend, self).get_macs(domid)
+
+class TestXmParse(unittest.TestCase):
+	""" Test xm output collected into an OutputBuffer still parses. """
+
+	def test_list(self):
+		""" Test domain IDs and memory are read from 'xm list'. """
+		out = xen.OutputBuffer()
+		for line in ['Name      ID   Mem VCPUs      State   Time(s)',
+					 'Domain-0   0  4096     4     r-----   1234.5',
+					 'vm1        3   512     1     -b----     12.0']:
+			out.write(line + '\n')
+		self.assertEqual(xen.xm_parse_doms(out), [3])
+		self.assertEqual(xen.xm_parse_dom_mem(out), [4096, {3: 512}])
+
+class TestDomainInventory(unittest.TestCase):
+	""" Test domains are looked up from a cached inventory. """
+
+	def setUp(self):
+		self.now = 100.0
+		self.backend = CountingBackend()
+		self.backend.add_domain(3, 'vm1', 512, ['00:16:3e:00:00:03'])
+		self.backend.add_domain(5, 'vm2', 1024, ['00:16:3E:00:00:05', '00:16:3e:00:01:05'])
+		self.calls = self.backend.calls
+		self.inventory = xen.DomainInventory(ttl=10, backend=self.backend,
+											 clock=lambda: self.now)
+
+	def test_lookups(self):
+		""" Test every interface of every domain is indexed, from one refresh. """
+		inventory = self.inventory
+		self.assertEqual(inventory.get_dom_by_mac('00:16:3e:00:00:03'), 3)
+		self.assertEqual(inventory.get_dom_by_mac('00:16:3e:00:00:05'), 5)
+		self.assertEqual(inventory.get_dom_by_mac('00:16:3E:00:01:05'), 5)
+		self.assertEqual(inventory.get_dom_by_mac('00:16:3e:00:00:09'), None)
+		self.assertEqual(inventory.get_macs(5), ['00:16:3e:00:00:05', '00:16:3e:00:01:05'])
+		self.assertEqual((inventory.get_mem(3), inventory.get_mem(4)), (512, None))
+		self.assertEqual(sorted(inventory.get_doms()), [3, 5])
+		self.assertEqual(inventory.get_num_doms(), 2)
+		self.assertEqual(inventory.get_avail_mem(), 4096 - 512 - 1024)
+		self.assertEqual(sorted(self.calls), ['list', 'network-list 3', 'network-list 5'])
+
+	def test_ttl(self):
+		""" Test the inventory is refreshed once it is older than its TTL. """
+		self.inventory.get_dom_by_mac('00:16:3e:00:00:03')
+		self.now += 9.9
+		self.inventory.get_mem(3)
+		self.assertEqual(self.inventory.refreshes, 1)
+		self.now += 0.1
+		self.inventory.get_mem(3)
+		self.assertEqual(self.inventory.refreshes, 2)
+
+	def test_invalidate(self):
+		""" Test an invalidated inventory is refreshed by the next lookup only. """
+		self.inventory.get_num_doms()
+		self.inventory.invalidate()
+		self.assertEqual(self.inventory.refreshes, 1)
+		self.inventory.get_num_doms()
+		self.inventory.get_num_doms()
+		self.assertEqual(self.inventory.refreshes, 2)
+
+	def test_vanished(self):
+		""" Test a domain gone between listing it and its interfaces is dropped. """
+		get_macs = self.backend.get_macs
+		def vanish(domid):
+			if domid == 5:
+				self.backend.remove_domain(5)
+			return get_macs(domid)
+		self.backend.get_macs = vanish
+		self.assertEqual(self.inventory.get_doms(), [3])
+		self.assertEqual(self.inventory.get_dom_by_mac('00:16:3e:00:00:05'), None)
+
+	def test_no_ttl(self):
+		""" Test an inventory without a TTL is only refreshed when invalidated. """
+		inventory = xen.DomainInventory(ttl=None, backend=self.backend, clock=lambda: self.now)
+		inventory.get_num_doms()
+		self.now += 1e6
+		inventory.get_num_doms()
+		self.assertEqual(inventory.refreshes, 1)
+
+class TestXenstoreInventory(unittest.TestCase):
+	""" Test the inventory follows xenstore as domains come and go. """
+
+	def setUp(self):
+		self.xs = fake_xenstore.FakeXenstore()
+		self.xs.write('', '/local/domain/0/memory/target', str(4096 * 1024))
+		self.xs.add_domain(3, 'vm1', 512, ['00:16:3E:00:00:03'])
+		self.inventory = xen.XenstoreInventory(self.xs, backend=hypervisor.FakeBackend())
+		self.settle()
+
+	def tearDown(self):
+		self.inventory.close()
+		self.inventory.thread.join()
+
+	def settle(self):
+		""" Wait for the inventory to handle every event fired. """
+		end = time.time() + 5
+		while self.inventory.events < self.xs.fired and time.time() < end:
+			time.sleep(0.001)
+		self.assertEqual(self.inventory.events, self.xs.fired)
+
+	def test_initial(self):
+		""" Test the domains present when the watch starts are read. """
+		self.assertEqual(self.inventory.get_dom_by_mac('00:16:3e:00:00:03'), 3)
+		self.assertEqual(self.inventory.get_doms(), [3])
+		self.assertEqual(self.inventory.get_avail_mem(), 4096 - 512)
+
+	def test_arrival(self):
+		""" Test a new domain is indexed as its entries are written. """
+		self.xs.add_domain(7, 'vm2', 1024, ['00:16:3e:00:00:07', '00:16:3e:00:01:07'])
+		self.settle()
+		self.assertEqual(self.inventory.get_dom_by_mac('00:16:3e:00:01:07'), 7)
+		self.assertEqual(self.inventory.get_mem(7), 1024)
+		self.assertEqual(self.inventory.get_num_doms(), 2)
+		self.assertEqual(self.inventory.get_avail_mem(), 4096 - 512 - 1024)
+
+	def test_departure(self):
+		""" Test a domain is dropped when its directory is removed. """
+		self.xs.remove_domain(3)
+		self.settle()
+		self.assertEqual(self.inventory.get_dom_by_mac('00:16:3e:00:00:03'), None)
+		self.assertEqual((self.inventory.get_doms(), self.inventory.get_mem(3)), ([], None))
+		self.assertEqual(self.inventory.get_avail_mem(), 4096)
+
+	def test_memory_change(self):
+		""" Test ballooning a domain, or Domain-0, updates its memory. """
+		self.xs.write('', '/local/domain/3/memory/target', str(256 * 1024))
+		self.xs.write('', '/local/domain/0/memory/target', str(2048 * 1024))
+		self.settle()
+		self.assertEqual(self.inventory.get_mem(3), 256)
+		self.assertEqual(self.inventory.get_avail_mem(), 2048 - 256)
+
+	def test_watch_error(self):
+		""" Test a failed watch is counted and registered again, and changes
+		made around the failure still arrive. """
+		xen.log.disabled = True
+		try:
+			self.xs.fail_watch(IOError('xenstored restarted'))
+			self.xs.add_domain(7, 'vm2', 1024, ['00:16:3e:00:00:07'])
+			self.settle()
+		finally:
+			xen.log.disabled = False
+		self.assertEqual(self.inventory.errors, 1)
+		self.assertEqual(self.xs.watches, [(xen.DOMAIN_PATH, xen.WATCH_TOKEN)])
+		self.assertEqual(self.inventory.get_dom_by_mac('00:16:3e:00:00:07'), 7)
+		self.xs.remove_domain(3)
+		self.settle()
+		self.assertEqual(self.inventory.get_doms(), [7])
+
+	def test_incremental(self):
+		""" Test events read only their own domain, and others are ignored. """
+		refreshes = self.inventory.refreshes
+		self.xs.write('', '/local/domain/3/console/ring-ref', '8')
+		self.xs.write('', '/local/domain/0/backend/vif/3/0/state', '4')
+		self.xs.add_domain(9, 'vm3', 128, ['00:16:3e:00:00:09'])
+		self.settle()
+		self.assertEqual(self.inventory.refreshes, refreshes)
+		self.assertEqual(self.inventory.get_mem(9), 128)
+		self.inventory.invalidate()
+		self.assertEqual(self.inventory.refreshes, refreshes + 1)
+
+if (__name__ == '__main__'):
+	unittest.main()